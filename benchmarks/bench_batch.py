@@ -0,0 +1,62 @@
+"""
+Runs process_directory in Batch API mode end to end against the fake
+server's files and batches endpoints, sharding into small batches.
+
+Usage: python benchmarks/bench_batch.py --images 25 --per-batch 10 --script 500
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, '..', 'src'))
+
+from image_evaluator import ImageEvaluator
+from fake_openai_server import start_server
+from bench_concurrency import make_images, write_config
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exercise Batch API mode")
+    parser.add_argument('--images', type=int, default=25)
+    parser.add_argument('--per-batch', type=int, default=10)
+    parser.add_argument('--batch-delay', type=float, default=0.5)
+    parser.add_argument('--script', default='', help="Status codes for the first batch requests")
+    args = parser.parse_args()
+
+    script = [int(code) for code in args.script.split(',') if code.strip()]
+    server, base_url = start_server(script=script, batch_delay=args.batch_delay)
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            config_path = write_config(workdir, base_url, {
+                'batch': {'max_requests_per_batch': args.per_batch, 'poll_interval': 0.2},
+                'cache': {'enabled': False}
+            })
+            input_dir = os.path.join(workdir, 'input')
+            make_images(input_dir, args.images)
+
+            evaluator = ImageEvaluator(config_path)
+            start = time.perf_counter()
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                evaluator.process_directory(input_dir, batch=True)
+            elapsed = time.perf_counter() - start
+
+            remaining = len(os.listdir(input_dir))
+            with open(os.path.join(workdir, 'logs', 'evaluation_log.txt')) as f:
+                logged = f.read().count('Image: ')
+    finally:
+        server.shutdown()
+
+    print(f"Batches submitted: {len(server.batches)}")
+    print(f"Images logged:     {logged}/{args.images}")
+    print(f"Images unsorted:   {remaining}/{args.images}")
+    print(f"Elapsed:           {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
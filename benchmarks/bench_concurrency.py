@@ -0,0 +1,91 @@
+"""
+Measures process_directory throughput at several concurrency levels
+against the local fake OpenAI server.
+
+Usage: python benchmarks/bench_concurrency.py --images 64 --latency 0.2
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+import yaml
+from PIL import Image
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, '..', 'src'))
+
+from image_evaluator import ImageEvaluator
+from fake_openai_server import start_server
+
+CONFIG_PATH = os.path.join(current_dir, '..', 'config', 'config.yaml')
+
+
+def make_images(directory, count, size=(64, 48)):
+    """Writes `count` small, distinct JPEG files to `directory`."""
+    os.makedirs(directory, exist_ok=True)
+    for i in range(count):
+        color = (i * 37 % 256, i * 91 % 256, i * 53 % 256)
+        Image.new('RGB', size, color).save(os.path.join(directory, f"image_{i:05d}.jpg"))
+
+
+def write_config(workdir, base_url, overrides=None):
+    """
+    Writes a copy of config.yaml pointed at the fake server, with output and
+    logs under `workdir`. Sections in `overrides` are merged on top.
+    Returns the path of the written config.
+    """
+    with open(CONFIG_PATH, 'r') as f:
+        config = yaml.safe_load(f)
+    config['openai']['api_key'] = 'sk-fake'
+    config['openai']['base_url'] = base_url
+    config['directories'] = {
+        'output': os.path.join(workdir, 'output'),
+        'logs': os.path.join(workdir, 'logs')
+    }
+    for section, values in (overrides or {}).items():
+        config.setdefault(section, {}).update(values)
+
+    config_path = os.path.join(workdir, 'config.yaml')
+    with open(config_path, 'w') as f:
+        yaml.safe_dump(config, f)
+    return config_path
+
+
+def run(base_url, workdir, images, concurrency):
+    config_path = write_config(workdir, base_url, {
+        'rate_limits': {'requests_per_minute': None, 'tokens_per_minute': None}
+    })
+    input_dir = os.path.join(workdir, 'input')
+    make_images(input_dir, images)
+
+    evaluator = ImageEvaluator(config_path)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        evaluator.process_directory(input_dir, concurrency=concurrency)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark concurrent image evaluation")
+    parser.add_argument('--images', type=int, default=64)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--levels', default='1,2,4,8,16')
+    args = parser.parse_args()
+
+    server, base_url = start_server(latency=args.latency)
+    print(f"{'concurrency':>12} {'seconds':>10} {'images/sec':>12}")
+    try:
+        for level in [int(x) for x in args.levels.split(',')]:
+            with tempfile.TemporaryDirectory() as workdir:
+                elapsed = run(base_url, workdir, args.images, level)
+            print(f"{level:>12} {elapsed:>10.2f} {args.images / elapsed:>12.2f}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
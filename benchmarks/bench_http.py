@@ -0,0 +1,96 @@
+"""
+Compares request latency with and without connection pooling against the
+fake server running as a local HTTPS stand-in, using a throwaway
+self-signed certificate (needs the openssl command).
+
+Usage: python benchmarks/bench_http.py --images 48 --concurrency 8 --compress
+"""
+import argparse
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, '..', 'src'))
+
+from image_evaluator import ImageEvaluator
+from fake_openai_server import start_server
+from bench_concurrency import make_images, write_config
+
+
+def make_certificate(directory):
+    """Writes a self-signed certificate for 127.0.0.1; returns (certfile, keyfile)."""
+    certfile = os.path.join(directory, 'cert.pem')
+    keyfile = os.path.join(directory, 'key.pem')
+    subprocess.run([
+        'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+        '-keyout', keyfile, '-out', certfile, '-subj', '/CN=127.0.0.1',
+        '-addext', 'subjectAltName=IP:127.0.0.1'
+    ], check=True, capture_output=True)
+    return certfile, keyfile
+
+
+def run(label, http_settings, args, certfile, keyfile):
+    server, base_url = start_server(latency=args.latency, certfile=certfile, keyfile=keyfile)
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            config_path = write_config(workdir, base_url, {
+                'http': {'verify': certfile, **http_settings},
+                'rate_limits': {'requests_per_minute': None, 'tokens_per_minute': None},
+                'cache': {'enabled': False}
+            })
+            input_dir = os.path.join(workdir, 'input')
+            make_images(input_dir, args.images, size=(args.size, args.size))
+
+            evaluator = ImageEvaluator(config_path)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                evaluator.process_directory(input_dir, concurrency=args.concurrency)
+            elapsed = time.perf_counter() - start
+            summary = evaluator.transport_stats.summary()
+            evaluator.close()
+    finally:
+        server.shutdown()
+
+    def phase(name):
+        return f"{summary[name]['mean_ms']:>7.1f}" if name in summary else f"{'-':>7}"
+
+    print(f"{label:>12} {server.connection_count:>6} {phase('connect')} {phase('upload')} "
+          f"{phase('ttfb')} {phase('total')} {args.images / elapsed:>10.1f} "
+          f"{summary['bytes_saved'] / 1024:>9.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HTTP connection pooling over TLS")
+    parser.add_argument('--images', type=int, default=48)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--size', type=int, default=512, help="Edge length of the test images")
+    parser.add_argument('--compress', action='store_true', help="Also run with gzip request bodies")
+    parser.add_argument('--http2', action='store_true', help="Also run with HTTP/2 (needs h2)")
+    args = parser.parse_args()
+
+    runs = [
+        ('no pooling', {'max_keepalive_connections': 0}),
+        ('pooled', {}),
+    ]
+    if args.compress:
+        runs.append(('pooled+gzip', {'compress_requests': True}))
+    if args.http2:
+        runs.append(('http2', {'http2': True}))
+
+    with tempfile.TemporaryDirectory() as certdir:
+        certfile, keyfile = make_certificate(certdir)
+        print("Mean milliseconds per request phase")
+        print(f"{'transport':>12} {'conns':>6} {'connect':>7} {'upload':>7} {'ttfb':>7} "
+              f"{'total':>7} {'images/s':>10} {'KB saved':>9}")
+        for label, settings in runs:
+            run(label, settings, args, certfile, keyfile)
+
+
+if __name__ == "__main__":
+    main()
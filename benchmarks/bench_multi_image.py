@@ -0,0 +1,72 @@
+"""
+Compares tokens per image and images per minute when several images are
+packed into one chat completion, against the local fake OpenAI server.
+
+Usage: python benchmarks/bench_multi_image.py --images 48 --sizes 1,2,4,8 --drop 1
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, '..', 'src'))
+
+from image_evaluator import ImageEvaluator
+from fake_openai_server import start_server
+from bench_concurrency import make_images, write_config
+
+
+def run(latency, images, per_request, concurrency, drop):
+    server, base_url = start_server(latency=latency, drop_sections=drop)
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            config_path = write_config(workdir, base_url, {
+                'processing': {'images_per_request': per_request},
+                'rate_limits': {'requests_per_minute': None, 'tokens_per_minute': None},
+                'cache': {'enabled': False}
+            })
+            input_dir = os.path.join(workdir, 'input')
+            make_images(input_dir, images)
+
+            evaluator = ImageEvaluator(config_path)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                evaluator.process_directory(input_dir, concurrency=concurrency)
+            elapsed = time.perf_counter() - start
+
+            with open(os.path.join(workdir, 'logs', 'evaluation_log.jsonl')) as f:
+                records = [json.loads(line) for line in f]
+    finally:
+        server.shutdown()
+
+    scored = sum(1 for record in records if record['status'] == 'scored')
+    tokens = sum(record['total_tokens'] or 0 for record in records)
+    return server.request_count, scored, tokens, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark multi-image requests")
+    parser.add_argument('--images', type=int, default=48)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--sizes', default='1,2,4,8')
+    parser.add_argument('--drop', type=int, default=0,
+                        help="Multi-image replies that omit a section, forcing individual re-sends")
+    args = parser.parse_args()
+
+    print(f"{'per request':>12} {'requests':>9} {'scored':>7} {'tokens/image':>13} {'images/min':>11}")
+    for per_request in [int(size) for size in args.sizes.split(',')]:
+        requests, scored, tokens, elapsed = run(
+            args.latency, args.images, per_request, args.concurrency, args.drop
+        )
+        print(f"{per_request:>12} {requests:>9} {scored:>7} {tokens / max(scored, 1):>13.0f} "
+              f"{scored / elapsed * 60:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Checks the reply parsers against recorded responses, fuzzes the text
+parser with formatting variations that must not change the result, and
+compares its speed with the original line-scanning parser.
+
+Usage: python benchmarks/bench_parser.py --fuzz 5000 --seed 1
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, '..', 'src'))
+
+from response_parser import CHARACTERISTIC_KEYS, PARSERS
+
+RECORDED_RESPONSES = os.path.join(current_dir, 'recorded_responses.jsonl')
+
+NOISE_LINES = [
+    "Overall this is a pleasant image.",
+    "Note: scores are subjective.",
+    "---",
+    "",
+    "Summary of strengths and weaknesses follows.",
+]
+
+
+def legacy_parse(response_text):
+    """The parser ImageEvaluator used before response_parser, kept for comparison."""
+    lines = [line.strip() for line in response_text.strip().split('\n') if line.strip()]
+    evaluation_data = {}
+    description_line = next((line for line in lines if line.lower().startswith('description:')), None)
+    if description_line:
+        evaluation_data['description'] = description_line.split(':', 1)[1].strip()
+    scores = []
+    for char in CHARACTERISTIC_KEYS:
+        char_line = next((line for line in lines if line.lower().startswith(f'{char}:')), None)
+        if char_line:
+            try:
+                score = int(''.join(filter(str.isdigit, char_line.split(':', 1)[1])))
+                evaluation_data[char] = score
+                scores.append(score)
+            except ValueError:
+                evaluation_data[char] = 0
+    reason_line = next((line for line in lines if line.lower().startswith('reason:')), None)
+    if reason_line:
+        evaluation_data['final_analysis'] = reason_line.split(':', 1)[1].strip()
+    if not scores:
+        raise ValueError("Could not parse scores from response")
+    return max(1, min(100, (sum(scores) * 10) // len(scores))), evaluation_data
+
+
+def load_recorded():
+    with open(RECORDED_RESPONSES, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def run_case(parse, response):
+    try:
+        score, evaluation_data = parse(response)
+    except ValueError:
+        return None
+    return {'score': score, 'evaluation_data': evaluation_data}
+
+
+def check_recorded(cases):
+    """Returns (passed, failures, legacy_passed) over the recorded responses."""
+    parsers = {name: parser() for name, parser in PARSERS.items()}
+    passed, failures, legacy_passed = 0, [], 0
+    for case in cases:
+        outcome = run_case(parsers[case['mode']].parse, case['response'])
+        if outcome == case['expected']:
+            passed += 1
+        else:
+            failures.append((case['name'], outcome, case['expected']))
+        if case['mode'] == 'text' and run_case(legacy_parse, case['response']) == case['expected']:
+            legacy_passed += 1
+    return passed, failures, legacy_passed
+
+
+def mutate(expected, rng):
+    """Renders an expected evaluation in a random but equivalent text format."""
+    data = expected['evaluation_data']
+    bold = rng.random() < 0.5
+    marker = rng.choice(['', '- ', '* ', '1. ', '### ', '> '])
+
+    def key(name):
+        name = rng.choice([name, name.lower(), name.upper(), name.title()])
+        if bold:
+            return rng.choice([f"**{name}:**", f"**{name}**:", f"__{name}__:"])
+        return rng.choice([f"{name}:", f"{name} :", f"{name} (1-10):"])
+
+    def value(number):
+        return rng.choice([
+            str(number), f"{number}/10", f"{number} / 10", f"{number * 10}/100",
+            f"{number} out of 10", f"{number}.0", f"**{number}/10**"
+        ])
+
+    score_lines = [
+        f"{marker}{key(char.title())} {value(data[char])}"
+        for char in CHARACTERISTIC_KEYS if char in data
+    ]
+    rng.shuffle(score_lines)
+    lines = []
+    if rng.random() < 0.3:
+        lines.append("Here is my assessment:")
+    lines.append(f"{marker}{key('Description')} {data['description']}")
+    for line in score_lines:
+        lines.append(line)
+        if rng.random() < 0.1:
+            lines.append(rng.choice(NOISE_LINES))
+    lines.append(f"{marker}{key('Reason')} {data['final_analysis']}")
+    newline = rng.choice(['\n', '\r\n', '\n\n'])
+    return newline.join(lines)
+
+
+def fuzz(cases, iterations, seed):
+    """Returns a list of (text, outcome, expected) for mutations that parsed differently."""
+    rng = random.Random(seed)
+    parser = PARSERS['text']()
+    seeds = [case['expected'] for case in cases if case['mode'] == 'text' and case['expected']]
+    failures = []
+    for _ in range(iterations):
+        expected = rng.choice(seeds)
+        text = mutate(expected, rng)
+        outcome = run_case(parser.parse, text)
+        if outcome != expected:
+            failures.append((text, outcome, expected))
+    return failures
+
+
+def time_parser(parse, texts, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for text in texts:
+            try:
+                parse(text)
+            except ValueError:
+                pass
+    return rounds * len(texts) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify and benchmark the reply parsers")
+    parser.add_argument('--fuzz', type=int, default=5000, help="Random format variations to check")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--rounds', type=int, default=2000, help="Timing passes over the recorded replies")
+    args = parser.parse_args()
+
+    cases = load_recorded()
+    passed, failures, legacy_passed = check_recorded(cases)
+    text_cases = sum(1 for case in cases if case['mode'] == 'text')
+    print(f"Recorded responses: {passed}/{len(cases)} parsed as expected "
+          f"(original parser: {legacy_passed}/{text_cases} text replies)")
+    for name, outcome, expected in failures:
+        print(f"  MISMATCH {name}: got {outcome}, expected {expected}")
+
+    fuzz_failures = fuzz(cases, args.fuzz, args.seed)
+    print(f"Fuzzed variations:  {args.fuzz - len(fuzz_failures)}/{args.fuzz} parsed as expected")
+    for text, outcome, expected in fuzz_failures[:3]:
+        print(f"  MISMATCH on:\n{text}\n  got {outcome}\n  expected {expected}")
+
+    texts = [case['response'] for case in cases if case['mode'] == 'text']
+    # Long replies show how each parser scales with reply length
+    long_texts = [("Preamble line with no fields.\n" * 200) + text for text in texts]
+    text_parser = PARSERS['text']()
+    print(f"\n{'replies':>10} {'parser':>10} {'parses/sec':>12}")
+    for label, sample, rounds in (('recorded', texts, args.rounds), ('long', long_texts, args.rounds // 20)):
+        for name, parse in (('regex', text_parser.parse), ('original', legacy_parse)):
+            print(f"{label:>10} {name:>10} {time_parser(parse, sample, max(1, rounds)):>12.0f}")
+
+    sys.exit(1 if failures or fuzz_failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Measures throughput with image preprocessing (decode, resize, encode,
+base64) on the request threads versus in worker processes, against the
+local fake OpenAI server. Run it on a many-core machine: on a single core
+the worker processes can only add overhead.
+
+With --stages, near-duplicate hashing and embeddings (which share the
+workers) are switched on as well.
+
+Usage: python benchmarks/bench_preprocess_workers.py --images 64 --concurrency 16 --levels 0,2,4,8 [--stages]
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, '..', 'src'))
+
+from image_evaluator import ImageEvaluator
+from fake_openai_server import start_server
+from bench_concurrency import write_config
+
+
+def make_photos(directory, count, size):
+    """Writes `count` noisy JPEGs, which cost about as much to decode and re-encode as photos."""
+    os.makedirs(directory, exist_ok=True)
+    noise = Image.merge('RGB', [Image.effect_noise(size, sigma) for sigma in (40, 60, 80)])
+    for i in range(count):
+        # Shift the noise so every file is distinct for the cache and dedup
+        image = noise.rotate(i * 7, translate=(i, -i))
+        image.save(os.path.join(directory, f"photo_{i:05d}.jpg"), quality=92)
+
+
+def run(base_url, args, workers):
+    with tempfile.TemporaryDirectory() as workdir:
+        config_path = write_config(workdir, base_url, {
+            'processing': {'preprocess_workers': workers},
+            'rate_limits': {'requests_per_minute': None, 'tokens_per_minute': None},
+            'cache': {'enabled': False},
+            'memory': {'enabled': False},
+            'dedup': {'enabled': args.stages},
+            'embedding': {'enabled': args.stages}
+        })
+        input_dir = os.path.join(workdir, 'input')
+        make_photos(input_dir, args.images, (args.width, args.height))
+
+        evaluator = ImageEvaluator(config_path)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            evaluator.process_directory(input_dir, concurrency=args.concurrency)
+        elapsed = time.perf_counter() - start
+        stages = evaluator.metrics.report()['stages']
+        evaluator.close()
+    steps = ('decode', 'resize', 'encode', 'base64', 'dedup', 'embedding')
+    cpu_seconds = sum(stages.get(step, {}).get('sum_s', 0) for step in steps)
+    return elapsed, cpu_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark preprocessing in worker processes")
+    parser.add_argument('--images', type=int, default=64)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--height', type=int, default=3000)
+    parser.add_argument('--levels', default=None,
+                        help="Comma-separated worker counts (default: 0 and powers of two up to the CPU count)")
+    parser.add_argument('--stages', action='store_true',
+                        help="Also run the dedup and embedding stages")
+    args = parser.parse_args()
+
+    cpus = os.cpu_count() or 1
+    if args.levels:
+        levels = [int(level) for level in args.levels.split(',')]
+    else:
+        levels = [0] + [2 ** power for power in range(cpus.bit_length()) if 2 ** power <= cpus]
+
+    server, base_url = start_server(latency=args.latency)
+    print(f"{cpus} CPUs, {args.images} images of {args.width}x{args.height}, "
+          f"concurrency {args.concurrency}")
+    print(f"{'workers':>8} {'seconds':>9} {'images/sec':>11} {'prep s/img':>11}")
+    try:
+        for workers in levels:
+            elapsed, cpu_seconds = run(base_url, args, workers)
+            print(f"{workers:>8} {elapsed:>9.2f} {args.images / elapsed:>11.1f} "
+                  f"{cpu_seconds / args.images:>11.3f}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
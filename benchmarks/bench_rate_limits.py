@@ -0,0 +1,61 @@
+"""
+Runs process_directory against the fake server while it replays scripted
+429 and 5xx responses, and reports how the scheduler recovered.
+
+Usage: python benchmarks/bench_rate_limits.py --images 16 --script 429,429,429,500,503
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, '..', 'src'))
+
+from image_evaluator import ImageEvaluator
+from fake_openai_server import start_server
+from bench_concurrency import make_images, write_config
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exercise retries against scripted errors")
+    parser.add_argument('--images', type=int, default=16)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--script', default='429,429,429,500,503')
+    parser.add_argument('--retry-after', type=float, default=0.5)
+    args = parser.parse_args()
+
+    script = [int(code) for code in args.script.split(',') if code.strip()]
+    server, base_url = start_server(latency=args.latency, script=script, retry_after=args.retry_after)
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            config_path = write_config(workdir, base_url, {
+                'rate_limits': {'backoff_base': 0.1, 'backoff_max': 2.0}
+            })
+            input_dir = os.path.join(workdir, 'input')
+            make_images(input_dir, args.images)
+
+            evaluator = ImageEvaluator(config_path)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                evaluator.process_directory(input_dir, concurrency=args.concurrency)
+            elapsed = time.perf_counter() - start
+
+            remaining = len(os.listdir(input_dir))
+    finally:
+        server.shutdown()
+
+    stats = evaluator.scheduler.stats
+    print(f"Server requests:   {server.request_count}")
+    print(f"Scheduler stats:   {stats}")
+    print(f"Final concurrency: {evaluator.scheduler.concurrency_limit}")
+    print(f"Images unsorted:   {remaining}/{args.images}")
+    print(f"Elapsed:           {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
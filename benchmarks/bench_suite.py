@@ -0,0 +1,289 @@
+"""
+Repeatable benchmark suite for the evaluator (src/image_evaluator.py) and
+the image_sort.py entry point against the local fake OpenAI server.
+
+Synthetic corpora of several sizes and formats are generated from a fixed
+seed, and every (target, corpus) pair runs in a fresh subprocess so peak
+RSS is measured per scenario. Reports images/sec, p50/p95 per-image
+latency, peak RSS and bytes uploaded per image. --json saves the results;
+--baseline compares a run with saved results and exits with status 1 if
+any metric got worse by more than --tolerance.
+
+Usage: python benchmarks/bench_suite.py --targets evaluator,legacy --corpora small,photo --latency 0.1
+       python benchmarks/bench_suite.py --json before.json
+       python benchmarks/bench_suite.py --baseline before.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+repo_root = os.path.join(current_dir, '..')
+sys.path.append(os.path.join(repo_root, 'src'))
+
+CORPORA = {
+    'small': {'count': 64, 'size': (640, 480), 'format': 'JPEG'},
+    'photo': {'count': 16, 'size': (4000, 3000), 'format': 'JPEG'},
+    'png': {'count': 16, 'size': (1600, 1200), 'format': 'PNG'},
+    'webp': {'count': 32, 'size': (1920, 1080), 'format': 'WEBP'},
+    # Cycles through the sizes and formats above
+    'mixed': {'count': 48, 'size': None, 'format': None}
+}
+EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp'}
+TARGETS = ['evaluator', 'legacy']
+
+# Metric, label, and whether a higher value is better
+COMPARED = [
+    ('images_per_s', 'images/sec', True),
+    ('p95_ms', 'p95 ms', False),
+    ('peak_rss_mb', 'peak RSS MB', False),
+    ('bytes_per_image', 'bytes/image', False)
+]
+
+
+def make_photo(size, seed):
+    """Draws a photo-like image: colored shapes under sensor-style noise and a slight blur."""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    image = Image.new('RGB', size, tuple(int(v) for v in rng.integers(0, 256, 3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        w, h = int(rng.integers(width // 20, width // 3)), int(rng.integers(height // 20, height // 3))
+        draw.ellipse([x, y, x + w, y + h], fill=tuple(int(v) for v in rng.integers(0, 256, 3)))
+    noise = Image.effect_noise(size, 30).convert('RGB')
+    return Image.blend(image, noise, 0.15).filter(ImageFilter.GaussianBlur(1))
+
+
+def make_corpus(directory, name, count=None):
+    """Writes corpus `name` to `directory` unless it is already there. Returns its file paths."""
+    spec = CORPORA[name]
+    count = count or spec['count']
+    cycle = [CORPORA[other] for other in ('small', 'photo', 'png', 'webp')]
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(count):
+        item = cycle[i % len(cycle)] if spec['format'] is None else spec
+        path = os.path.join(directory, f"{name}_{i:05d}{EXTENSIONS[item['format']]}")
+        if not os.path.exists(path):
+            seed = list(CORPORA).index(name) * 1000003 + i
+            make_photo(item['size'], seed).save(path, format=item['format'], quality=90)
+        paths.append(path)
+    return paths
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process and its finished children, in MB."""
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        # Linux keeps ru_maxrss across exec, so it can still hold the
+        # parent's peak; VmHWM starts afresh with the new program
+        with open('/proc/self/status', 'r') as f:
+            own = next(int(line.split()[1]) for line in f if line.startswith('VmHWM:'))
+        scale = 1024
+    except (OSError, StopIteration, ValueError):
+        pass
+    return max(own, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / scale
+
+
+def run_evaluator(workdir, base_url, concurrency):
+    """Sorts workdir/input with ImageEvaluator. Returns tuple of (seconds, latencies in ms, failed)."""
+    from bench_concurrency import write_config
+    from image_evaluator import ImageEvaluator
+
+    config_path = write_config(workdir, base_url, {
+        'processing': {'concurrency': concurrency},
+        'rate_limits': {'requests_per_minute': None, 'tokens_per_minute': None},
+        'cache': {'enabled': False},
+        'logging': {'text_log': False, 'structured': {'format': 'jsonl', 'file': 'evaluation_log.jsonl'}}
+    })
+    evaluator = ImageEvaluator(config_path)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        summary = evaluator.process_directory(os.path.join(workdir, 'input'))
+    evaluator.close()
+    elapsed = time.perf_counter() - start
+
+    return elapsed, read_latencies(os.path.join(workdir, 'logs')), summary['failed']
+
+
+def read_latencies(log_dir):
+    """Returns the per-image latencies, in ms, from the JSONL evaluation log."""
+    with open(os.path.join(log_dir, 'evaluation_log.jsonl'), 'r') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return [record['latency_ms'] for record in records if record['latency_ms'] is not None]
+
+
+def run_legacy(workdir, base_url):
+    """
+    Sorts workdir/input_images through the image_sort.py entry point.
+    Returns tuple of (seconds, latencies in ms, failed).
+    """
+    # The script works relative to the current directory (the child runs
+    # in `workdir`) with the repository's config.yaml; the OpenAI client
+    # reads OPENAI_BASE_URL when the config sets no base_url
+    os.environ['OPENAI_BASE_URL'] = base_url
+    sys.path.insert(0, repo_root)
+    import image_sort
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        summary = image_sort.process_images()
+    elapsed = time.perf_counter() - start
+    return elapsed, read_latencies(os.path.join(workdir, 'logs')), summary['failed']
+
+
+def child(args):
+    """Runs one scenario in this (fresh) process and prints its result as JSON."""
+    if args.child == 'evaluator':
+        elapsed, latencies, failed = run_evaluator(args.workdir, args.base_url, args.concurrency)
+    else:
+        elapsed, latencies, failed = run_legacy(args.workdir, args.base_url)
+    print(json.dumps({
+        'seconds': elapsed,
+        'latencies_ms': latencies,
+        'failed': failed,
+        'peak_rss_mb': peak_rss_mb()
+    }))
+
+
+def run_scenario(server, base_url, target, corpus_paths, args):
+    with tempfile.TemporaryDirectory() as workdir:
+        input_dir = os.path.join(workdir, 'input' if target == 'evaluator' else 'input_images')
+        os.makedirs(input_dir)
+        for path in corpus_paths:
+            shutil.copy(path, input_dir)
+
+        bytes_before = server.bytes_received
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child', target, '--workdir', workdir,
+             '--base-url', base_url, '--concurrency', str(args.concurrency)],
+            cwd=workdir, check=True, capture_output=True, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+
+    images = len(corpus_paths)
+    latencies = result['latencies_ms'] or [0.0]
+    return {
+        'target': target,
+        'images': images,
+        'failed': result['failed'],
+        'seconds': round(result['seconds'], 3),
+        'images_per_s': round(images / result['seconds'], 3),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 1),
+        'p95_ms': round(float(np.percentile(latencies, 95)), 1),
+        'peak_rss_mb': round(result['peak_rss_mb'], 1),
+        'bytes_per_image': (server.bytes_received - bytes_before) // images
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Prints each metric's change against the baseline. Returns the regressions found."""
+    saved = {(entry['target'], entry['corpus']): entry for entry in baseline['results']}
+    regressions = []
+    print(f"\nChange against baseline (tolerance {tolerance:.0%}):")
+    for entry in results:
+        before = saved.get((entry['target'], entry['corpus']))
+        if before is None:
+            continue
+        changes = []
+        for key, label, higher_is_better in COMPARED:
+            if not before[key]:
+                continue
+            change = (entry[key] - before[key]) / before[key]
+            worse = -change if higher_is_better else change
+            flag = ''
+            if worse > tolerance:
+                flag = ' REGRESSION'
+                regressions.append((entry['target'], entry['corpus'], label))
+            changes.append(f"{label} {change:+.1%}{flag}")
+        print(f"  {entry['target']:>9} {entry['corpus']:>7}: " + ", ".join(changes))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the evaluator and the image_sort.py entry point")
+    parser.add_argument('--targets', default=','.join(TARGETS),
+                        help="Comma-separated: evaluator, legacy (default: both)")
+    parser.add_argument('--corpora', default='small,photo,png,mixed',
+                        help=f"Comma-separated, from {', '.join(CORPORA)}")
+    parser.add_argument('--images', type=int, default=None, help="Images per corpus (default: per corpus)")
+    parser.add_argument('--corpus-dir', default=None,
+                        help="Keep generated corpora here and reuse them across runs")
+    parser.add_argument('--concurrency', type=int, default=8, help="Evaluator requests in flight")
+    parser.add_argument('--latency', type=float, default=0.1)
+    parser.add_argument('--jitter', type=float, default=0.05)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', metavar='FILE', help="Write the results to FILE")
+    parser.add_argument('--baseline', metavar='FILE', help="Compare with results saved by --json")
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help="Relative change counted as a regression (default: %(default)s)")
+    parser.add_argument('--child', choices=TARGETS, help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    parser.add_argument('--base-url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return 0
+
+    from fake_openai_server import start_server
+
+    targets = [target for target in args.targets.split(',') if target]
+    corpora = [corpus for corpus in args.corpora.split(',') if corpus]
+    for name in corpora:
+        if name not in CORPORA:
+            parser.error(f"unknown corpus '{name}'")
+
+    corpus_root = args.corpus_dir or tempfile.mkdtemp(prefix='bench_corpora_')
+    server, base_url = start_server(latency=args.latency, jitter=args.jitter,
+                                    error_rate=args.error_rate, seed=args.seed)
+    results = []
+    print(f"Latency {args.latency}s (+{args.jitter}s jitter), error rate {args.error_rate:.0%}, "
+          f"evaluator concurrency {args.concurrency}")
+    print(f"{'target':>9} {'corpus':>7} {'images':>7} {'failed':>7} {'images/sec':>11} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'peak RSS MB':>12} {'KB/image':>9}")
+    try:
+        for name in corpora:
+            paths = make_corpus(os.path.join(corpus_root, name), name, args.images)
+            for target in targets:
+                entry = run_scenario(server, base_url, target, paths, args)
+                entry['corpus'] = name
+                results.append(entry)
+                print(f"{target:>9} {name:>7} {entry['images']:>7} {entry['failed']:>7} "
+                      f"{entry['images_per_s']:>11.1f} {entry['p50_ms']:>8.0f} {entry['p95_ms']:>8.0f} "
+                      f"{entry['peak_rss_mb']:>12.0f} {entry['bytes_per_image'] / 1024:>9.0f}")
+    finally:
+        server.shutdown()
+        if not args.corpus_dir:
+            shutil.rmtree(corpus_root, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'settings': {key: getattr(args, key) for key in
+                                    ('concurrency', 'latency', 'jitter', 'error_rate', 'seed', 'images')},
+                       'results': results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
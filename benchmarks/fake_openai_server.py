@@ -0,0 +1,359 @@
+"""
+Local stand-in for the OpenAI chat completions endpoint.
+
+Replies to every POST .../chat/completions with a canned evaluation in the
+prompts.evaluation_prompt format after a configurable delay, so the
+evaluator can be benchmarked without spending money on the live API.
+A script of status codes (e.g. 429,429,500) can be replayed first to
+exercise rate limiting and retries, and a share of requests can fail at
+random. The files and batches endpoints are emulated closely enough to run
+the Batch API mode end to end.
+"""
+import argparse
+import email.parser
+import email.policy
+import gzip
+import itertools
+import json
+import random
+import ssl
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CANNED_RESPONSE = """Description: A synthetic benchmark image
+Composition: 7
+Color: 6
+Lighting: 8
+Subject: 7
+Originality: 5
+Technical Skill: 7
+Emotion: 6
+Storytelling: 5
+Clarity: 8
+Creativity: 6
+Score: 65
+Reason: Canned response from the local fake server"""
+
+# Simulated usage: a fixed prompt cost per request plus a cost per image
+PROMPT_TOKENS = 300
+IMAGE_TOKENS = 550
+COMPLETION_TOKENS = 90
+
+
+def count_images(request):
+    """Counts image_url parts in a chat completion request."""
+    return sum(
+        1
+        for message in request.get('messages', [])
+        if isinstance(message.get('content'), list)
+        for part in message['content']
+        if part.get('type') == 'image_url'
+    ) or 1
+
+
+CANNED_EVALUATION = {
+    'description': "A synthetic benchmark image",
+    'composition': 7, 'color': 6, 'lighting': 8, 'subject': 7, 'originality': 5,
+    'technical_skill': 7, 'emotion': 6, 'storytelling': 5, 'clarity': 8, 'creativity': 6,
+    'reason': "Canned response from the local fake server"
+}
+
+
+def completion_body(images=1, drop_last_section=False, structured=False):
+    """
+    Returns a chat completion carrying the canned evaluation, split into
+    "### Image N" sections when the request carried several images. With
+    `structured` the evaluation is JSON, as for a json_schema response_format.
+    """
+    if structured:
+        if images == 1:
+            content = json.dumps(CANNED_EVALUATION)
+        else:
+            evaluations = [dict(CANNED_EVALUATION, image=number) for number in range(1, images + 1)]
+            if drop_last_section:
+                evaluations.pop()
+            content = json.dumps({'images': evaluations})
+    elif images == 1:
+        content = CANNED_RESPONSE
+    else:
+        sections = [f"### Image {number}\n{CANNED_RESPONSE}" for number in range(1, images + 1)]
+        if drop_last_section:
+            sections.pop()
+        content = "\n\n".join(sections)
+    prompt_tokens = PROMPT_TOKENS + IMAGE_TOKENS * images
+    completion_tokens = COMPLETION_TOKENS * images
+    return {
+        'id': 'chatcmpl-fake',
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': 'gpt-4o-mini',
+        'choices': [{
+            'index': 0,
+            'message': {'role': 'assistant', 'content': content},
+            'finish_reason': 'stop'
+        }],
+        'usage': {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens
+        }
+    }
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        if isinstance(self.request, ssl.SSLSocket):
+            self.request.do_handshake()
+        super().setup()
+        with self.server.lock:
+            self.server.connection_count += 1
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        with self.server.lock:
+            self.server.bytes_received += length
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        path = self.path.rstrip('/')
+
+        if path.endswith('/files'):
+            self._create_file(body)
+        elif path.endswith('/batches'):
+            self._create_batch(json.loads(body))
+        elif path.endswith('/chat/completions'):
+            self._chat_completion(json.loads(body))
+        else:
+            self._send_json(404, {'error': {'message': f"Unknown path {self.path}"}})
+
+    def do_GET(self):
+        parts = self.path.split('?')[0].rstrip('/').split('/')
+        if len(parts) >= 3 and parts[-3] == 'files' and parts[-1] == 'content':
+            stored = self.server.files.get(parts[-2])
+            if stored is None:
+                self._send_json(404, {'error': {'message': "No such file"}})
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(stored['content'])))
+            self.end_headers()
+            self.wfile.write(stored['content'])
+        elif len(parts) >= 2 and parts[-2] == 'batches':
+            batch = self.server.batches.get(parts[-1])
+            if batch is None:
+                self._send_json(404, {'error': {'message': "No such batch"}})
+                return
+            self._send_json(200, self._batch_state(batch))
+        else:
+            self._send_json(404, {'error': {'message': f"Unknown path {self.path}"}})
+
+    def _create_file(self, body):
+        message = email.parser.BytesParser(policy=email.policy.default).parsebytes(
+            b'Content-Type: ' + self.headers['Content-Type'].encode('latin-1') + b'\r\n\r\n' + body
+        )
+        fields = {}
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            fields[name] = (part.get_filename(), part.get_payload(decode=True))
+        filename, content = fields['file']
+        file_id = self._store_file(content, fields.get('purpose', (None, b'batch'))[1].decode(), filename)
+        self._send_json(200, self.server.files[file_id]['object'])
+
+    def _store_file(self, content, purpose, filename='upload.jsonl'):
+        file_id = f"file-{next(self.server.ids)}"
+        self.server.files[file_id] = {
+            'content': content,
+            'object': {
+                'id': file_id,
+                'object': 'file',
+                'bytes': len(content),
+                'created_at': int(time.time()),
+                'filename': filename or 'upload.jsonl',
+                'purpose': purpose,
+                'status': 'processed'
+            }
+        }
+        return file_id
+
+    def _create_batch(self, request):
+        """Runs every request in the input file immediately; status flips after batch_delay."""
+        lines = self.server.files[request['input_file_id']]['content'].decode('utf-8').splitlines()
+        outputs, errors = [], []
+        for line in lines:
+            if not line.strip():
+                continue
+            batch_request = json.loads(line)
+            custom_id = batch_request['custom_id']
+            structured = (batch_request['body'].get('response_format') or {}).get('type') == 'json_schema'
+            with self.server.lock:
+                status = self.server.script.popleft() if self.server.script else 200
+            if status == 200:
+                outputs.append({
+                    'id': f"batch_req_{custom_id}",
+                    'custom_id': custom_id,
+                    'response': {'status_code': 200, 'request_id': custom_id,
+                                 'body': completion_body(structured=structured)},
+                    'error': None
+                })
+            else:
+                errors.append({
+                    'id': f"batch_req_{custom_id}",
+                    'custom_id': custom_id,
+                    'response': {'status_code': status, 'request_id': custom_id,
+                                 'body': {'error': {'message': f"Scripted {status} response"}}},
+                    'error': None
+                })
+
+        def to_file(records):
+            if not records:
+                return None
+            content = ''.join(json.dumps(record) + '\n' for record in records).encode('utf-8')
+            return self._store_file(content, 'batch_output')
+
+        batch_id = f"batch_{next(self.server.ids)}"
+        batch = {
+            'id': batch_id,
+            'object': 'batch',
+            'endpoint': request['endpoint'],
+            'input_file_id': request['input_file_id'],
+            'completion_window': request['completion_window'],
+            'created_at': int(time.time()),
+            'output_file_id': to_file(outputs),
+            'error_file_id': to_file(errors),
+            'request_counts': {'total': len(outputs) + len(errors),
+                               'completed': len(outputs), 'failed': len(errors)},
+            '_started': time.monotonic()
+        }
+        self.server.batches[batch_id] = batch
+        self._send_json(200, self._batch_state(batch))
+
+    def _batch_state(self, batch):
+        state = {key: value for key, value in batch.items() if not key.startswith('_')}
+        if time.monotonic() - batch['_started'] < self.server.batch_delay:
+            state.update(status='in_progress', output_file_id=None, error_file_id=None,
+                         request_counts={'total': batch['request_counts']['total'],
+                                         'completed': 0, 'failed': 0})
+        else:
+            state['status'] = 'completed'
+        return state
+
+    def _chat_completion(self, request):
+        with self.server.lock:
+            delay = self.server.latency + self.server.random.uniform(0, self.server.jitter)
+        time.sleep(delay)
+
+        with self.server.lock:
+            status = self.server.script.popleft() if self.server.script else 200
+            if status == 200 and self.server.random.random() < self.server.error_rate:
+                status = self.server.random.choice((429, 500))
+            self.server.request_count += 1
+            images = count_images(request)
+            self.server.images_seen += images
+            drop = images > 1 and self.server.drop_sections > 0
+            if drop:
+                self.server.drop_sections -= 1
+        if status != 200:
+            headers = {}
+            if status == 429 and self.server.retry_after is not None:
+                headers['Retry-After'] = str(self.server.retry_after)
+            self._send_json(status, {
+                'error': {'message': f"Scripted {status} response", 'type': 'fake_error'}
+            }, headers)
+            return
+
+        structured = (request.get('response_format') or {}).get('type') == 'json_schema'
+        self._send_json(200, completion_body(images, drop_last_section=drop, structured=structured))
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_server(host='127.0.0.1', port=0, latency=0.2, script=None, retry_after=None,
+                 batch_delay=0.0, drop_sections=0, certfile=None, keyfile=None,
+                 jitter=0.0, error_rate=0.0, seed=0):
+    """
+    Starts the fake server on a background thread.
+    Chat completions wait `latency` plus up to `jitter` seconds.
+    `script` is a list of HTTP status codes returned, in order, before the
+    server falls back to 200s; scripted 429s carry `retry_after` if set.
+    After the script, `error_rate` of requests get a random 429 or 500,
+    drawn from a generator seeded with `seed` so runs repeat.
+    Batches report in_progress until `batch_delay` seconds have passed.
+    The first `drop_sections` multi-image replies omit their last section.
+    With `certfile` (and `keyfile`) the server speaks HTTPS.
+    Returns tuple of (server, base_url).
+    """
+    server = ThreadingHTTPServer((host, port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    scheme = 'http'
+    if certfile:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, keyfile)
+        # Handshake on the handler thread, not the accept loop
+        server.socket = context.wrap_socket(
+            server.socket, server_side=True, do_handshake_on_connect=False
+        )
+        scheme = 'https'
+    server.connection_count = 0
+    server.latency = latency
+    server.jitter = jitter
+    server.error_rate = error_rate
+    server.random = random.Random(seed)
+    server.bytes_received = 0
+    server.script = deque(script or [])
+    server.retry_after = retry_after
+    server.lock = threading.Lock()
+    server.request_count = 0
+    server.images_seen = 0
+    server.drop_sections = drop_sections
+    server.batch_delay = batch_delay
+    server.files = {}
+    server.batches = {}
+    server.ids = itertools.count(1)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"{scheme}://{host}:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.2, help="Seconds to wait before replying")
+    parser.add_argument('--script', default='', help="Comma-separated status codes to return first, e.g. 429,429,500")
+    parser.add_argument('--retry-after', type=float, default=None, help="Retry-After seconds sent with scripted 429s")
+    parser.add_argument('--batch-delay', type=float, default=5.0, help="Seconds before a batch reports completed")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Extra random latency, up to this many seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="Share of requests answered with a random 429 or 500")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for jitter and random errors")
+    args = parser.parse_args()
+
+    script = [int(code) for code in args.script.split(',') if code.strip()]
+    server, base_url = start_server(args.host, args.port, args.latency, script, args.retry_after,
+                                    args.batch_delay, jitter=args.jitter, error_rate=args.error_rate,
+                                    seed=args.seed)
+    print(f"Fake OpenAI server listening on {base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+import argparse
+import glob
 import os
 import sys
 from pathlib import Path
@@ -6,42 +8,395 @@ from pathlib import Path
 current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.join(current_dir, 'src'))
 
-from image_evaluator import ImageEvaluator
+# Only lightweight modules here; the evaluator (openai, Pillow, numpy) is
+# imported when there is work to do, so --help and --dry-run start instantly
+from scanner import IMAGE_EXTENSIONS, ImageScanner
+
+OUTPUT_FORMATS = ['jsonl', 'parquet', 'arrow', 'text']
+
 
 def validate_path(path_str):
     """Validate if the path exists and is an image file or directory."""
     path = Path(path_str)
     if not path.exists():
         return None
-    
+
     if path.is_file():
-        valid_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'}
-        if path.suffix.lower() not in valid_extensions:
+        if path.suffix.lower() not in IMAGE_EXTENSIONS:
             return None
     return path
 
-def main():
+
+def expand_paths(arguments):
+    """
+    Expands path arguments and glob patterns ('*', '?', '[...]', '**').
+    Returns tuple of (files, directories, invalid) with duplicates removed
+    and arguments kept in the order given.
+    """
+    files, directories, invalid = [], [], []
+    seen = set()
+    for argument in arguments:
+        if os.path.exists(argument) or not glob.has_magic(argument):
+            matches = [argument]
+        else:
+            matches = sorted(glob.glob(argument, recursive=True))
+        if not matches:
+            invalid.append(argument)
+        for match in matches:
+            path = validate_path(match)
+            if path is None:
+                invalid.append(match)
+                continue
+            key = os.path.abspath(path)
+            if key in seen:
+                continue
+            seen.add(key)
+            (files if path.is_file() else directories).append(path)
+    return files, directories, invalid
+
+
+def build_overrides(args):
+    """Turns command-line options into config overrides."""
+    overrides = {}
+    if args.format == 'text':
+        overrides['logging'] = {'text_log': True, 'structured': {'format': 'none'}}
+    elif args.format:
+        overrides['logging'] = {'structured': {'format': args.format}}
+    processing = {}
+    if args.concurrency is not None:
+        processing['concurrency'] = args.concurrency
+    if args.images_per_request is not None:
+        processing['images_per_request'] = args.images_per_request
+    if args.score_only:
+        processing['score_only'] = True
+    if args.manifest:
+        processing['manifest'] = args.manifest
+    if processing:
+        overrides['processing'] = processing
+    if args.stages is not None:
+        overrides['pipeline'] = {'stages': [stage for stage in args.stages.split(',') if stage]}
+    if args.forecast:
+        overrides['budget'] = {'enabled': True}
+    if args.index_log:
+        overrides['embedding'] = {'enabled': True}
+    return overrides
+
+
+def load_config(config_path, overrides):
+    import yaml
+    from utils import merge_config
+
+    with open(config_path, 'r') as f:
+        return merge_config(yaml.safe_load(f), overrides)
+
+
+def dry_run(files, directories, args, config):
+    """Lists the images a run would evaluate without calling the API or moving files."""
+    total = 0
+    for directory in directories:
+        scanner = ImageScanner.from_config(directory, config, recursive=args.recursive)
+        count = 0
+        for image_path in scanner.scan():
+            print(image_path)
+            count += 1
+        print(f"# {directory}: {count} images", file=sys.stderr)
+        total += count
+    for file_path in files:
+        print(file_path)
+    total += len(files)
+    print(f"# Dry run: {total} images would be evaluated", file=sys.stderr)
+
+
+def forecast(files, directories, args, config):
+    """Prints the cost forecast for the images a run would evaluate, without calling the API."""
+    from budget import Budget, format_forecast
+
+    paths = list(files)
+    for directory in directories:
+        paths.extend(ImageScanner.from_config(directory, config, recursive=args.recursive).scan())
+    budget = Budget.from_config(config)
+    # Sample evenly across the run rather than just its first images
+    step = max(1, len(paths) // max(1, budget.forecast_sample))
+    batch = args.batch or (config.get('batch', {}) or {}).get('enabled', False)
+    print(format_forecast(budget.forecast(paths[::step][:budget.forecast_sample], len(paths),
+                                          config, batch=batch)))
+
+
+def run_distributed(args, overrides):
+    """
+    Runs --coordinator and/or --worker against the shared work queue. With
+    both, this process queues the directories, works on them itself and
+    then waits for the other workers to finish.
+    """
+    from distributed import FAILED, Coordinator, QueueWorker, WorkQueue
+    from image_evaluator import ImageEvaluator
+
+    directories = []
+    if args.coordinator:
+        files, directories, invalid = expand_paths(args.paths)
+        for path in invalid + files:
+            print(f"Skipping {path}: only directories can be queued", file=sys.stderr)
+        if not directories:
+            print("No directories to queue.", file=sys.stderr)
+            return 1
+
+    evaluator = ImageEvaluator(args.config, overrides)
+    work_queue = WorkQueue.from_config(evaluator.config, args.queue)
+    failed = 0
+    try:
+        if args.coordinator:
+            coordinator = Coordinator.from_config(evaluator.config, work_queue)
+            coordinator.enqueue_directories(directories, recursive=args.recursive)
+        if args.worker:
+            failed += QueueWorker.from_config(evaluator, work_queue).run()['failed']
+        if args.coordinator:
+            failed += coordinator.wait().get(FAILED, 0)
+    finally:
+        work_queue.close()
+        evaluator.close()
+    return 1 if failed else 0
+
+
+def run_score_index(parser, args, config):
+    """Answers --query or carries out --rebucket from the score index."""
+    import time
+    from log_sink import CHARACTERISTIC_FIELDS
+    from score_index import ScoreIndex
+
+    index = ScoreIndex.from_config(config)
+    if index is None:
+        parser.error("the score index is disabled (score_index.enabled)")
+    try:
+        if args.rebucket is not None:
+            stats = index.rebucket(config['directories']['output'], args.rebucket, dry_run=args.dry_run)
+            print(f"{'Would move' if args.dry_run else 'Moved'} {stats['moved']} images into "
+                  f"{args.rebucket}-point folders ({stats['unchanged']} already there, "
+                  f"{stats['missing']} missing, {stats['conflicts']} name conflicts)")
+            if not args.dry_run:
+                print(f"Set processing.bucket_interval to {args.rebucket} to sort new images the same way")
+            return 0
+
+        start = time.perf_counter()
+        try:
+            images = index.query(*args.query, limit=args.limit)
+        except ValueError as e:
+            parser.error(str(e))
+        elapsed = time.perf_counter() - start
+        for image in images:
+            characteristics = ' '.join(
+                '-' if image[field] is None else str(image[field]) for field in CHARACTERISTIC_FIELDS
+            )
+            print(f"{image['score']:>3}  [{characteristics}]  {image['path']}")
+        print(f"# {len(images)} images ({elapsed * 1000:.1f} ms)", file=sys.stderr)
+        return 0
+    finally:
+        index.close()
+
+
+def prompt_for_paths():
+    """The original interactive flow, used when no paths are given on a terminal."""
     while True:
         input_path = input("\nEnter the path to an image or directory: ").strip()
         path = validate_path(input_path)
-        
+
         if path is None:
             print("Invalid path. Please enter a valid path to an image file or directory.")
             continue
-        
+
         recursive = input("Process directories recursively? (y/n): ").lower().startswith('y')
+        return [str(path)], recursive
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Evaluate and sort images by quality.",
+        epilog="With no paths on an interactive terminal, prompts for one."
+    )
+    parser.add_argument('paths', nargs='*',
+                        help="Image files, directories or glob patterns (e.g. 'shoot/**/*.jpg')")
+    parser.add_argument('-c', '--config', default='config/config.yaml',
+                        help="Path to the YAML config (default: %(default)s)")
+    parser.add_argument('-r', '--recursive', action='store_true',
+                        help="Descend into subdirectories of directory arguments")
+    parser.add_argument('-j', '--concurrency', type=int, default=None,
+                        help="Requests in flight at once (default: processing.concurrency)")
+    parser.add_argument('--images-per-request', type=int, default=None, metavar='N',
+                        help="Pack up to N images into each request (default: processing.images_per_request)")
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help="List the images that would be evaluated and exit")
+    parser.add_argument('-f', '--format', choices=OUTPUT_FORMATS, default=None,
+                        help="Evaluation log format (default: logging.structured.format); "
+                             "'text' writes only the plain-text log")
+    parser.add_argument('--score-only', action='store_true',
+                        help="Score images and write a manifest of moves instead of moving files")
+    parser.add_argument('--manifest', default=None,
+                        help="Manifest file for --score-only (default: processing.manifest)")
+    parser.add_argument('--apply', metavar='MANIFEST',
+                        help="Carry out the moves recorded in a score-only manifest and exit")
+    parser.add_argument('--rollback', metavar='MANIFEST',
+                        help="Undo the moves made by --apply for a manifest and exit")
+    parser.add_argument('--workers', type=int, default=8,
+                        help="Parallel file moves for --apply and --rollback (default: %(default)s)")
+    parser.add_argument('--stages', default=None,
+                        help="Comma-separated pipeline stages to use for this run, in order "
+                             "(default: pipeline.stages); '' sends every image to the API")
+    parser.add_argument('--resume', action='store_true',
+                        help="Continue an interrupted directory run from the job journal")
+    parser.add_argument('--batch', action='store_true',
+                        help="Evaluate directories through the OpenAI Batch API")
+    parser.add_argument('--watch', nargs='*', metavar='DIR',
+                        help="Run as a daemon sorting images dropped into these directories "
+                             "(default: watch.directories from the config)")
+    parser.add_argument('--coordinator', action='store_true',
+                        help="Queue the images in the given directories for --worker processes "
+                             "on any node, then wait until they are sorted")
+    parser.add_argument('--worker', action='store_true',
+                        help="Sort images from the shared work queue until it is drained")
+    parser.add_argument('--queue', metavar='PATH', default=None,
+                        help="Work queue for --coordinator and --worker (default: distributed.queue)")
+    parser.add_argument('--index-log', metavar='LOG',
+                        help="Add the scored images in a JSONL evaluation log to the score and embedding "
+                             "indexes, then exit")
+    parser.add_argument('--query', nargs='*', metavar='CONDITION',
+                        help="List indexed images matching every condition, e.g. 'score>=85' 'lighting>=8' "
+                             "'date>=2026-01-01' 'path=/photos/*', best first, then exit")
+    parser.add_argument('--limit', type=int, default=None,
+                        help="Show at most this many images for --query")
+    parser.add_argument('--rebucket', type=int, metavar='INTERVAL',
+                        help="Move the sorted images in directories.output into score folders INTERVAL "
+                             "points wide, using the indexed scores, then exit (with -n, only report)")
+    parser.add_argument('--forecast', action='store_true',
+                        help="Estimate the run's token use and cost against the budget, then exit")
+    parser.add_argument('--profile', metavar='FILE',
+                        help="Profile the run with cProfile, writing pstats output to FILE")
+    args = parser.parse_args(argv)
+    if args.coordinator and not args.paths:
+        parser.error("--coordinator needs directories to queue")
+    if args.concurrency is not None and args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if args.images_per_request is not None and args.images_per_request < 1:
+        parser.error("--images-per-request must be at least 1")
+    if args.rebucket is not None and not 1 <= args.rebucket <= 100:
+        parser.error("--rebucket takes an interval from 1 to 100")
+    return parser, args
+
 
-        # Initialize the evaluator
-        evaluator = ImageEvaluator()
+def main(argv=None):
+    parser, args = parse_args(argv)
+    if args.profile:
+        from metrics import profile_call
 
-        # Process single file or directory
-        if path.is_file():
-            print(f"\nProcessing single file: {path}")
-            evaluator.process_single_image(path)
+        return profile_call(lambda: run(parser, args), args.profile)
+    return run(parser, args)
+
+
+def run(parser, args):
+    overrides = build_overrides(args)
+
+    if args.apply or args.rollback:
+        from manifest import apply_manifest, rollback_manifest
+        from score_index import ScoreIndex
+
+        # Moves are collected from the worker threads and indexed in one go
+        moves = []
+        on_move = lambda old_path, new_path: moves.append((old_path, new_path))
+        if args.apply:
+            stats = apply_manifest(args.apply, workers=args.workers, on_move=on_move)
+            print(f"Applied {args.apply}: {stats['renamed']} renamed, {stats['copied']} copied "
+                  f"across filesystems, {stats['skipped']} already gone, {stats['failed']} failed")
         else:
-            print(f"\nProcessing directory: {path}")
-            evaluator.process_directory(path, recursive=recursive)
-        break
+            restored = rollback_manifest(args.rollback, workers=args.workers, on_move=on_move)
+            print(f"Rolled back {args.rollback}: {restored} files restored")
+        index = ScoreIndex.from_config(load_config(args.config, overrides))
+        if index:
+            try:
+                index.record_moves(moves)
+            finally:
+                index.close()
+        return 1 if args.apply and stats['failed'] else 0
+
+    if args.index_log:
+        from embedding_index import EmbeddingIndex, index_log
+        import score_index
+
+        config = load_config(args.config, overrides)
+        scores = score_index.ScoreIndex.from_config(config)
+        if scores:
+            try:
+                added, skipped = score_index.index_log(scores, args.index_log)
+                print(f"Indexed {added} scores from {args.index_log} ({skipped} skipped; "
+                      f"{scores.size} images in the score index)")
+            finally:
+                scores.close()
+
+        index = EmbeddingIndex.from_config(config)
+        try:
+            added, skipped = index_log(index, args.index_log)
+        finally:
+            index.close()
+        print(f"Indexed {added} scored images from {args.index_log} ({skipped} skipped; "
+              f"{index.size} images in the index)")
+        return 0
+
+    if args.query is not None or args.rebucket is not None:
+        return run_score_index(parser, args, load_config(args.config, overrides))
+
+    if args.watch is not None:
+        from image_evaluator import ImageEvaluator
+        from watcher import WatchDaemon
+
+        evaluator = ImageEvaluator(args.config, overrides)
+        try:
+            WatchDaemon.from_config(evaluator, args.watch, recursive=args.recursive or None).run()
+        finally:
+            evaluator.close()
+        return 0
+
+    if args.coordinator or args.worker:
+        return run_distributed(args, overrides)
+
+    paths, recursive = args.paths, args.recursive
+    if not paths:
+        if not sys.stdin.isatty():
+            parser.error("no paths given")
+        paths, recursive = prompt_for_paths()
+        args.recursive = recursive
+
+    files, directories, invalid = expand_paths(paths)
+    for path in invalid:
+        print(f"Skipping {path}: not an image file or directory", file=sys.stderr)
+    if not files and not directories:
+        print("No images to process.", file=sys.stderr)
+        return 1
+
+    if args.dry_run:
+        dry_run(files, directories, args, load_config(args.config, overrides))
+        return 0
+    if args.forecast:
+        forecast(files, directories, args, load_config(args.config, overrides))
+        return 0
+
+    from image_evaluator import ImageEvaluator
+
+    # One evaluator (config, client, caches) for every path in the run
+    evaluator = ImageEvaluator(args.config, overrides)
+    failed = 0
+    try:
+        for directory in directories:
+            print(f"\nProcessing directory: {directory}")
+            summary = evaluator.process_directory(directory, recursive=args.recursive,
+                                                  resume=args.resume, batch=args.batch or None)
+            failed += summary['failed']
+            if summary['budget_stopped']:
+                return 1
+        if files:
+            print(f"\nProcessing {len(files)} image file{'s' if len(files) != 1 else ''}")
+            summary = evaluator.process_files(files, resume=args.resume, batch=args.batch or None)
+            failed += summary['failed']
+    finally:
+        evaluator.close()
+    return 1 if failed else 0
+
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    sys.exit(main())
@@ -4,10 +4,22 @@ setup(
     name="image-quality-sorter",
     version="0.1",
     packages=find_packages(),
+    py_modules=['main'],
     install_requires=[
         'openai>=1.0.0',
+        'httpx>=0.23.0',
         'Pillow>=10.0.0',
+        'numpy>=1.24.0',
         'PyYAML>=6.0',
         'python-dotenv>=1.0.0',
     ],
+    extras_require={
+        'columnar': ['pyarrow>=14.0'],
+        'http2': ['httpx[http2]>=0.23.0'],
+    },
+    entry_points={
+        'console_scripts': [
+            'image-quality-sorter=main:main',
+        ],
+    },
 ) 
\ No newline at end of file
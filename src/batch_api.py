@@ -0,0 +1,337 @@
+"""
+Offline evaluation through the OpenAI Batch API.
+"""
+import glob
+import json
+import os
+import time
+from datetime import datetime
+
+import openai
+
+from scheduler import RETRYABLE_STATUS_CODES
+
+TERMINAL_STATUSES = {'completed', 'failed', 'expired', 'cancelled'}
+
+
+class BatchRunner:
+    """
+    Evaluates images by writing their requests to JSONL files, submitting
+    each file as a batch and collecting the results once it finishes.
+
+    Images are sharded so no batch exceeds max_requests_per_batch requests
+    or max_bytes_per_batch bytes. Shards are submitted as soon as they fill
+    up and their results are yielded shard by shard.
+
+    Each submitted batch is recorded in a sidecar JSON file beside its
+    request file, and marked collected once its results are read. An image
+    that an earlier run submitted but never collected (it crashed or was
+    stopped) is not submitted again: its batch is polled and collected
+    instead, as long as the image's cache key (content, prompt, model and
+    preprocessing) is unchanged.
+
+    Uploads, polls and downloads go through the evaluator's scheduler, so
+    transient errors are retried like evaluation requests. A poll that
+    still fails is retried after a growing delay rather than abandoning
+    batches that are already submitted.
+    """
+
+    def __init__(self, evaluator):
+        self.evaluator = evaluator
+        self.client = evaluator.client
+        self.scheduler = evaluator.scheduler
+        self.logger = evaluator.logger
+        settings = evaluator.config.get('batch', {}) or {}
+        self.max_requests = settings.get('max_requests_per_batch', 1000)
+        self.max_bytes = settings.get('max_bytes_per_batch', 100 * 1024 * 1024)
+        self.poll_interval = settings.get('poll_interval', 60)
+        self.max_poll_interval = max(self.poll_interval, settings.get('max_poll_interval', 900))
+        self.completion_window = settings.get('completion_window', '24h')
+        self.keep_files = settings.get('keep_files', False)
+        self.batches_dir = os.path.join(evaluator.config['directories']['logs'], 'batches')
+        # Unique per run, so a quick rerun cannot overwrite uncollected sidecars
+        self.work_dir = os.path.join(self.batches_dir, f"{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}")
+
+    def evaluate(self, file_paths, lookup=None):
+        """
+        Yields (file_path, (score, evaluation_data, token_usage)) for every
+        image in `file_paths`. `lookup(file_path)` may return a known result,
+        in which case the image is not submitted; cache hits are also served
+        without a request.
+        """
+        os.makedirs(self.work_dir, exist_ok=True)
+        earlier = self._submitted_earlier()
+        resumed = {}  # batch id -> shard of images an earlier run submitted
+        shards = []
+        shard = None
+        request_count = 0
+
+        for file_path in file_paths:
+            known = lookup(file_path) if lookup else None
+            cache_key = previous = None
+            if known is None:
+                try:
+                    cache_key = self.evaluator.cache_key(file_path)
+                    known = self._cached_result(cache_key)
+                    if known is None:
+                        previous = earlier.get(os.path.abspath(file_path))
+                        if previous and previous['cache_key'] != cache_key:
+                            previous = None
+                    if known is None and previous is None:
+                        request_body, payload = self.evaluator.build_request(file_path)
+                except Exception as e:
+                    self.logger.error(f"Error preparing image {file_path}: {str(e)}")
+                    known = (None, str(e), None)
+
+            if known is not None:
+                if shard is None and not shards:
+                    yield file_path, known
+                else:
+                    # Keep discovery order: hold the result behind pending shards
+                    (shard or shards[-1])['entries'].append({'path': file_path, 'result': known})
+                continue
+
+            if previous is not None:
+                if previous['batch_id'] not in resumed:
+                    resumed[previous['batch_id']] = {
+                        'batch_id': previous['batch_id'],
+                        'sidecar': previous['sidecar'],
+                        'resumed': True,
+                        'entries': []
+                    }
+                    shards.append(resumed[previous['batch_id']])
+                resumed[previous['batch_id']]['entries'].append({
+                    'path': file_path,
+                    'custom_id': previous['custom_id'],
+                    'cache_key': cache_key,
+                    'tokens_saved': previous['tokens_saved']
+                })
+                continue
+
+            custom_id = f"image-{request_count}"
+            request_count += 1
+            line = json.dumps({
+                'custom_id': custom_id,
+                'method': 'POST',
+                'url': '/v1/chat/completions',
+                'body': request_body
+            }) + '\n'
+
+            if shard is not None and (
+                shard['requests'] >= self.max_requests
+                or shard['bytes'] + len(line) > self.max_bytes
+            ):
+                shards.append(self._submit(shard))
+                shard = None
+            if shard is None:
+                shard = self._open_shard(len(shards))
+
+            shard['file'].write(line)
+            shard['bytes'] += len(line)
+            shard['requests'] += 1
+            shard['entries'].append({
+                'path': file_path,
+                'custom_id': custom_id,
+                'cache_key': cache_key,
+                'tokens_saved': payload['tokens_saved']
+            })
+
+        if shard is not None:
+            shards.append(self._submit(shard))
+        for batch_id, earlier_shard in resumed.items():
+            print(f"Resuming batch {batch_id} with {len(earlier_shard['entries'])} images "
+                  f"submitted by an earlier run")
+
+        for submitted in shards:
+            yield from self._collect(submitted)
+
+    def _submitted_earlier(self):
+        """
+        Returns the images in batches that earlier runs submitted but never
+        collected, as a dict of absolute path -> dict with the sidecar,
+        batch_id, custom_id, cache_key and tokens_saved. The latest
+        submission of an image wins.
+        """
+        submitted = {}
+        for sidecar in sorted(glob.glob(os.path.join(self.batches_dir, '*', 'shard_*.json'))):
+            try:
+                with open(sidecar, 'r') as f:
+                    record = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if record.get('collected'):
+                continue
+            cache_keys = record.get('cache_keys', {})
+            tokens_saved = record.get('tokens_saved', {})
+            for custom_id, path in record['images'].items():
+                submitted[os.path.abspath(path)] = {
+                    'sidecar': sidecar,
+                    'batch_id': record['batch_id'],
+                    'custom_id': custom_id,
+                    'cache_key': cache_keys.get(custom_id),
+                    'tokens_saved': tokens_saved.get(custom_id, 0)
+                }
+        return submitted
+
+    def _cached_result(self, cache_key):
+        if cache_key:
+            cached = self.evaluator.cache.get(cache_key)
+            if cached:
+                score, evaluation_data, _ = cached
+                return score, evaluation_data, None
+        return None
+
+    def _open_shard(self, index):
+        path = os.path.join(self.work_dir, f"shard_{index:04d}.jsonl")
+        return {
+            'index': index,
+            'path': path,
+            'file': open(path, 'w', encoding='utf-8'),
+            'bytes': 0,
+            'requests': 0,
+            'entries': []
+        }
+
+    def _submit(self, shard):
+        """Uploads a shard's request file and creates its batch."""
+        shard['file'].close()
+
+        def upload():
+            # Reopened for each attempt, as a failed upload may have read part of it
+            with open(shard['path'], 'rb') as f:
+                return self.client.files.create(file=f, purpose='batch')
+
+        input_file = self.scheduler.call(upload)
+        batch = self.scheduler.call(lambda: self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint='/v1/chat/completions',
+            completion_window=self.completion_window
+        ))
+        shard['batch_id'] = batch.id
+        print(f"Submitted batch {batch.id} with {shard['requests']} images")
+
+        # Record what was submitted so a run after a crash collects the
+        # batch instead of paying for it again
+        requests = [entry for entry in shard['entries'] if 'custom_id' in entry]
+        shard['sidecar'] = shard['path'].replace('.jsonl', '.json')
+        self._write_sidecar(shard['sidecar'], {
+            'batch_id': batch.id,
+            'input_file_id': input_file.id,
+            'images': {entry['custom_id']: os.path.abspath(entry['path']) for entry in requests},
+            'cache_keys': {entry['custom_id']: entry['cache_key'] for entry in requests},
+            'tokens_saved': {entry['custom_id']: entry['tokens_saved'] for entry in requests}
+        })
+        if not self.keep_files:
+            os.remove(shard['path'])
+        return shard
+
+    @staticmethod
+    def _write_sidecar(path, record):
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(record, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+
+    def _mark_collected(self, sidecar):
+        with open(sidecar, 'r') as f:
+            record = json.load(f)
+        record['collected'] = True
+        self._write_sidecar(sidecar, record)
+
+    def _wait(self, batch_id):
+        failures = 0
+        while True:
+            try:
+                batch = self.scheduler.call(lambda: self.client.batches.retrieve(batch_id))
+            except (openai.APIConnectionError, openai.APIStatusError) as e:
+                if isinstance(e, openai.APIStatusError) and not self._transient(e):
+                    raise
+                # The batch keeps running server-side; poll again later
+                failures += 1
+                delay = min(self.max_poll_interval, self.poll_interval * 2 ** failures)
+                self.logger.warning(f"Polling batch {batch_id} failed ({str(e)}); "
+                                    f"trying again in {delay:.0f}s")
+                time.sleep(delay)
+                continue
+            failures = 0
+            if batch.status in TERMINAL_STATUSES:
+                return batch
+            counts = batch.request_counts
+            if counts:
+                print(f"Batch {batch_id}: {batch.status} "
+                      f"({counts.completed + counts.failed}/{counts.total} done)")
+            time.sleep(self.poll_interval)
+
+    @staticmethod
+    def _transient(error):
+        return error.status_code >= 500 or error.status_code in RETRYABLE_STATUS_CODES
+
+    def _collect(self, shard):
+        """Waits for a shard's batch and yields its results in order."""
+        try:
+            batch = self._wait(shard['batch_id'])
+        except openai.NotFoundError:
+            if not shard.get('resumed'):
+                raise
+            # Submitted by an earlier run and since deleted: the images stay
+            # in place and are submitted again by the next run
+            self.logger.warning(f"Batch {shard['batch_id']} from an earlier run no longer exists")
+            self._mark_collected(shard['sidecar'])
+            for entry in shard['entries']:
+                yield entry['path'], entry.get('result') or (
+                    None, f"Batch {shard['batch_id']} no longer exists", None
+                )
+            return
+        print(f"Batch {batch.id} finished with status {batch.status}")
+
+        outputs = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            content = self.scheduler.call(lambda: self.client.files.content(file_id))
+            for line in content.text.splitlines():
+                if line.strip():
+                    record = json.loads(line)
+                    outputs[record['custom_id']] = record
+
+        for entry in shard['entries']:
+            if 'result' in entry:
+                yield entry['path'], entry['result']
+                continue
+            record = outputs.get(entry['custom_id'])
+            yield entry['path'], self._parse_record(entry, record, batch.status)
+        self._mark_collected(shard['sidecar'])
+
+    def _parse_record(self, entry, record, status):
+        if record is None:
+            return None, f"No batch result (batch {status})", None
+
+        response = record.get('response') or {}
+        if record.get('error') or response.get('status_code') != 200:
+            error = record.get('error') or (response.get('body') or {}).get('error')
+            return None, f"Batch request failed: {error}", None
+
+        body = response['body']
+        usage = body.get('usage') or {}
+        token_usage = {
+            'prompt_tokens': usage.get('prompt_tokens', 0),
+            'completion_tokens': usage.get('completion_tokens', 0),
+            'total_tokens': usage.get('total_tokens', 0),
+            'image_tokens_saved': entry['tokens_saved']
+        }
+        if self.evaluator.budget:
+            self.evaluator.budget.charge(
+                token_usage['prompt_tokens'], token_usage['completion_tokens'], batch=True
+            )
+        try:
+            score, evaluation_data = self.evaluator.parse_response(
+                body['choices'][0]['message']['content']
+            )
+        except (KeyError, IndexError, ValueError) as e:
+            return None, str(e), token_usage
+
+        if entry['cache_key']:
+            self.evaluator.cache.put(entry['cache_key'], score, evaluation_data, token_usage)
+        return score, evaluation_data, token_usage
@@ -0,0 +1,443 @@
+"""
+Token and spend accounting against per-model prices, with soft and hard
+budget limits that persist across runs.
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: rely on the in-process lock only
+    fcntl = None
+
+# USD per million tokens. Models that bill images at a multiple of the
+# 85 + 170-per-tile token count set image_token_multiplier.
+DEFAULT_PRICING = {
+    'gpt-4o-mini': {'input': 0.15, 'output': 0.60, 'image_token_multiplier': 33.33},
+    'gpt-4o': {'input': 2.50, 'output': 10.00},
+    'gpt-4.1-mini': {'input': 0.40, 'output': 1.60},
+    'gpt-4.1': {'input': 2.00, 'output': 8.00}
+}
+
+PERIODS = ('monthly', 'daily', 'total', 'run')
+
+COUNTERS = ('prompt_tokens', 'completion_tokens', 'cost_usd', 'images', 'requests')
+
+
+def period_key(period, now=None):
+    """Returns the label of the accounting period `now` falls in."""
+    now = now or datetime.now()
+    if period == 'monthly':
+        return now.strftime('%Y-%m')
+    if period == 'daily':
+        return now.strftime('%Y-%m-%d')
+    return period
+
+
+def _empty():
+    return {key: 0 for key in COUNTERS}
+
+
+def _add(totals, delta):
+    for key in COUNTERS:
+        totals[key] = totals.get(key, 0) + delta.get(key, 0)
+
+
+def find_price(pricing, model):
+    """
+    Looks a model up in a pricing table, falling back to the longest
+    matching prefix so dated snapshots ('gpt-4o-2024-08-06') use their
+    family's price. Returns the price dict or None.
+    """
+    if model in pricing:
+        return pricing[model]
+    matches = [name for name in pricing if model.startswith(name)]
+    return pricing[max(matches, key=len)] if matches else None
+
+
+def format_usd(value):
+    """Formats a dollar amount, keeping cents of a cent visible for small runs."""
+    return f"${value:.2f}" if value >= 1 else f"${value:.4f}"
+
+
+def format_forecast(forecast):
+    """Renders a Budget.forecast result, warning if the budget will not cover it."""
+    lines = [
+        f"Cost forecast for up to {forecast['images']} images on {forecast['model']}"
+        f"{' (Batch API)' if forecast['batch'] else ''}: "
+        f"~{forecast['prompt_tokens_per_image'] + forecast['completion_tokens_per_image']} tokens "
+        f"per image, ~{forecast['tokens']} tokens, ~{format_usd(forecast['cost_usd'])} "
+        f"(from {forecast['sampled']} sampled images)"
+    ]
+    affordable = forecast['affordable_images']
+    if affordable is not None:
+        remaining = [format_usd(forecast['remaining_usd'])] if forecast['remaining_usd'] is not None else []
+        if forecast['remaining_tokens'] is not None:
+            remaining.append(f"{forecast['remaining_tokens']} tokens")
+        lines.append(f"Budget remaining: {' / '.join(remaining)}, enough for about {affordable} images")
+        if affordable < forecast['images']:
+            lines.append("Warning: the budget will run out before this run finishes; "
+                         "it will stop gracefully when the limit is reached")
+    return "\n".join(lines)
+
+
+def scale_forecast(forecast, count):
+    """Returns a Budget.forecast result recomputed for `count` images at the same per-image cost."""
+    per_image_tokens = forecast['prompt_tokens_per_image'] + forecast['completion_tokens_per_image']
+    return dict(
+        forecast,
+        images=count,
+        tokens=per_image_tokens * count,
+        cost_usd=round(forecast['cost_usd_per_image'] * count, 4)
+    )
+
+
+class Budget:
+    """
+    Tracks tokens and dollars spent in the current period (a calendar month
+    by default) and enforces limits on both.
+
+    Before work is sent, callers reserve() images at the estimated cost per
+    image; a reservation that would take spending plus work in flight past
+    a hard limit is refused, so the caller stops (or pauses) gracefully
+    instead of overshooting. charge() records actual usage from each API
+    response. Crossing a soft limit logs a warning, or is treated like the
+    hard limit with soft_limit_action 'stop'.
+
+    Spending is kept in a JSON state file that several processes can share:
+    each flush adds this process's unsaved usage to the totals on disk under
+    a file lock.
+    """
+
+    def __init__(self, state_path, model, pricing=None, period='monthly',
+                 soft_limit_usd=None, hard_limit_usd=None,
+                 soft_limit_tokens=None, hard_limit_tokens=None,
+                 soft_limit_action='warn', batch_discount=0.5,
+                 expected_completion_tokens=250, forecast_sample=20,
+                 flush_interval=5.0, logger=None):
+        if period not in PERIODS:
+            raise ValueError(f"Unknown budget period '{period}', expected one of {list(PERIODS)}")
+        self.state_path = state_path if period != 'run' else None
+        self.model = model
+        self.pricing = {**DEFAULT_PRICING, **(pricing or {})}
+        self.period = period
+        self.soft_limit_usd = soft_limit_usd
+        self.hard_limit_usd = hard_limit_usd
+        self.soft_limit_tokens = soft_limit_tokens
+        self.hard_limit_tokens = hard_limit_tokens
+        self.soft_limit_action = soft_limit_action
+        self.batch_discount = batch_discount
+        self.expected_completion_tokens = expected_completion_tokens
+        self.forecast_sample = forecast_sample
+        self.flush_interval = flush_interval
+        self.logger = logger
+
+        self.price = find_price(self.pricing, model)
+        if self.price is None and logger:
+            logger.warning(f"No price for model '{model}' in budget.pricing; "
+                           "only token limits will be enforced")
+
+        self._lock = threading.Lock()
+        self._period = period_key(period)
+        self._saved = self._load()[0]  # This period's totals on disk
+        self._unsaved = _empty()  # This process's usage since the last flush
+        self._unsaved_by_model = {}
+        self.run = _empty()  # This process's usage since it started
+        self._reserved = 0  # Images reserved and not yet released
+        self._forecast = None
+        self._last_flush = time.monotonic()
+        self._soft_warned = False
+        self.blocked = None  # Reason reservations are refused, or None
+
+    @classmethod
+    def from_config(cls, config, logger=None):
+        """Builds the budget from the budget section of the config, or returns None if disabled."""
+        settings = config.get('budget', {}) or {}
+        if not settings.get('enabled', False):
+            return None
+        return cls(
+            os.path.join(config['directories']['logs'], settings.get('state_file', 'budget_state.json')),
+            config['openai']['model'],
+            pricing=settings.get('pricing'),
+            period=settings.get('period', 'monthly'),
+            soft_limit_usd=settings.get('soft_limit_usd'),
+            hard_limit_usd=settings.get('hard_limit_usd'),
+            soft_limit_tokens=settings.get('soft_limit_tokens'),
+            hard_limit_tokens=settings.get('hard_limit_tokens'),
+            soft_limit_action=settings.get('soft_limit_action', 'warn'),
+            batch_discount=settings.get('batch_discount', 0.5),
+            expected_completion_tokens=settings.get('expected_completion_tokens', 250),
+            forecast_sample=settings.get('forecast_sample', 20),
+            flush_interval=settings.get('flush_interval', 5.0),
+            logger=logger
+        )
+
+    def cost(self, prompt_tokens, completion_tokens, batch=False):
+        """Returns the USD cost of a request at this model's price."""
+        if not self.price:
+            return 0.0
+        cost = (prompt_tokens * self.price['input'] + completion_tokens * self.price['output']) / 1e6
+        return cost * (1 - self.batch_discount) if batch else cost
+
+    def charge(self, prompt_tokens, completion_tokens, images=1, batch=False):
+        """Records the usage of one API request covering `images` images."""
+        delta = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'cost_usd': self.cost(prompt_tokens, completion_tokens, batch),
+            'images': images,
+            'requests': 1
+        }
+        with self._lock:
+            self._roll_locked()
+            _add(self._unsaved, delta)
+            _add(self._unsaved_by_model.setdefault(self.model, _empty()), delta)
+            _add(self.run, delta)
+            self._check_soft_locked()
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def reserve(self, images=1, batch=False):
+        """
+        Sets aside the estimated cost of `images` images about to be sent.
+        Returns False, leaving nothing reserved, if that would exceed a hard
+        limit (or a soft limit with soft_limit_action 'stop').
+        """
+        prompt_tokens, completion_tokens = self.estimate_per_image()
+        with self._lock:
+            self._roll_locked()
+            spent = self._spent_locked()
+            # Images in flight are priced at the current estimate
+            pending = self._reserved + images
+            reason = self._limit_reason(
+                spent['cost_usd'] + self.cost(prompt_tokens, completion_tokens, batch) * pending,
+                spent['prompt_tokens'] + spent['completion_tokens']
+                + (prompt_tokens + completion_tokens) * pending
+            )
+            if reason:
+                if self.blocked is None and self.logger:
+                    self.logger.warning(f"Budget limit reached ({reason}); no new images will be sent "
+                                        f"until the {self.period} period ends or the limit is raised")
+                self.blocked = reason
+                return False
+            if self.blocked is not None and self.logger:
+                self.logger.info("Budget available again; resuming")
+            self.blocked = None
+            self._reserved = pending
+            return True
+
+    def release(self, images=1):
+        """Returns the reservation for `images` images once they are done."""
+        with self._lock:
+            self._reserved = max(0, self._reserved - images)
+
+    def estimate_per_image(self):
+        """
+        Returns (prompt_tokens, completion_tokens) expected per image: this
+        run's average once something has been charged, else the forecast,
+        else the period's average. (0, 0) when nothing is known yet.
+        """
+        for totals in (self.run, self._forecast, self._saved):
+            if totals and totals.get('images'):
+                return (totals['prompt_tokens'] / totals['images'],
+                        totals['completion_tokens'] / totals['images'])
+        return 0, 0
+
+    def forecast(self, sample_paths, count, config, batch=False):
+        """
+        Estimates the cost of evaluating `count` images from the header sizes
+        of `sample_paths`, the prompt length and the expected reply length
+        (the period's average reply once there is one). With `batch`, Batch
+        API prices apply.
+        Returns a dict with per-image and total tokens and cost, and how many
+        images the remaining hard budget covers.
+        """
+        from preprocess import estimate_file_tokens
+
+        preprocessing = config.get('preprocessing', {}) or {}
+        multiplier = (self.price or {}).get('image_token_multiplier', 1)
+        image_tokens = []
+        for path in sample_paths:
+            try:
+                image_tokens.append(estimate_file_tokens(path, preprocessing) * multiplier)
+            except Exception:
+                # Unreadable samples are left out; the run will report them
+                continue
+        processing = config.get('processing', {}) or {}
+        images_per_request = max(1, int(processing.get('images_per_request', 1)))
+        # About four characters per token; the prompt is shared by a request's images
+        prompt_text_tokens = len(config['prompts']['evaluation_prompt']) / 4 / images_per_request
+
+        with self._lock:
+            history = self._spent_locked()
+        if history['images']:
+            completion_tokens = history['completion_tokens'] / history['images']
+        else:
+            completion_tokens = self.expected_completion_tokens
+        prompt_tokens = prompt_text_tokens + (
+            sum(image_tokens) / len(image_tokens) if image_tokens else 0
+        )
+
+        per_image_cost = self.cost(prompt_tokens, completion_tokens, batch)
+        self._forecast = {
+            'images': 1,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens
+        }
+        remaining = self.remaining()
+        affordable = None
+        if remaining['usd'] is not None and per_image_cost:
+            affordable = int(remaining['usd'] // per_image_cost)
+        if remaining['tokens'] is not None:
+            by_tokens = int(remaining['tokens'] // max(1, prompt_tokens + completion_tokens))
+            affordable = by_tokens if affordable is None else min(affordable, by_tokens)
+        return {
+            'images': count,
+            'sampled': len(image_tokens),
+            'model': self.model,
+            'batch': bool(batch),
+            'prompt_tokens_per_image': round(prompt_tokens),
+            'completion_tokens_per_image': round(completion_tokens),
+            'tokens': round((prompt_tokens + completion_tokens) * count),
+            'cost_usd': round(per_image_cost * count, 4),
+            'cost_usd_per_image': per_image_cost,
+            'remaining_usd': remaining['usd'],
+            'remaining_tokens': remaining['tokens'],
+            'affordable_images': affordable
+        }
+
+    def remaining(self):
+        """Returns the USD and tokens left under the hard limits (None where unlimited)."""
+        with self._lock:
+            self._roll_locked()
+            spent = self._spent_locked()
+        tokens = spent['prompt_tokens'] + spent['completion_tokens']
+        return {
+            'usd': round(max(0.0, self.hard_limit_usd - spent['cost_usd']), 4)
+            if self.hard_limit_usd is not None else None,
+            'tokens': max(0, self.hard_limit_tokens - tokens)
+            if self.hard_limit_tokens is not None else None
+        }
+
+    def summary(self):
+        """Returns this run's and this period's usage, for reports."""
+        with self._lock:
+            spent = self._spent_locked()
+            run = dict(self.run)
+        return {
+            'model': self.model,
+            'period': self._period,
+            'run': {**run, 'cost_usd': round(run['cost_usd'], 6)},
+            'period_total': {**spent, 'cost_usd': round(spent['cost_usd'], 6)},
+            'soft_limit_usd': self.soft_limit_usd,
+            'hard_limit_usd': self.hard_limit_usd,
+            'soft_limit_tokens': self.soft_limit_tokens,
+            'hard_limit_tokens': self.hard_limit_tokens,
+            'blocked': self.blocked
+        }
+
+    def record_stop(self, root, remaining_images=None):
+        """Notes in the state file that a run over `root` stopped on the budget."""
+        self.flush(stop={
+            'root': str(root),
+            'at': datetime.now().isoformat(timespec='seconds'),
+            'reason': self.blocked,
+            'remaining_images': remaining_images
+        })
+
+    def flush(self, stop=None):
+        """Adds unsaved usage to the state file."""
+        with self._lock:
+            unsaved, self._unsaved = self._unsaved, _empty()
+            by_model, self._unsaved_by_model = self._unsaved_by_model, {}
+            self._last_flush = time.monotonic()
+            period = self._period
+        if not self.state_path:
+            with self._lock:
+                _add(self._saved, unsaved)
+            return
+
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+        with open(self.state_path + '.lock', 'a') as lock:
+            if fcntl:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                totals, state = self._load()
+                if state.get('period') != period:
+                    state = {'period': period, 'by_model': {}}
+                    totals = _empty()
+                _add(totals, unsaved)
+                for model, delta in by_model.items():
+                    _add(state['by_model'].setdefault(model, _empty()), delta)
+                state.update(totals)
+                state['updated_at'] = datetime.now().isoformat(timespec='seconds')
+                if stop:
+                    state['last_stop'] = stop
+                temporary = self.state_path + '.tmp'
+                with open(temporary, 'w') as f:
+                    json.dump(state, f, indent=2)
+                os.replace(temporary, self.state_path)
+            finally:
+                if fcntl:
+                    fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+        with self._lock:
+            if self._period == period:
+                self._saved = totals
+
+    def close(self):
+        self.flush()
+
+    def _load(self):
+        """Returns (totals, state) for the current period from the state file."""
+        state = {}
+        if self.state_path and os.path.exists(self.state_path):
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+        if state.get('period') != self._period:
+            return _empty(), {'period': self._period, 'by_model': {}}
+        return {key: state.get(key, 0) for key in COUNTERS}, state
+
+    def _roll_locked(self):
+        """Starts a new period's totals once the calendar moves on."""
+        current = period_key(self.period)
+        if current != self._period:
+            self._period = current
+            self._saved = _empty()
+            self._soft_warned = False
+
+    def _spent_locked(self):
+        spent = dict(self._saved)
+        _add(spent, self._unsaved)
+        return spent
+
+    def _limit_reason(self, cost, tokens):
+        if self.hard_limit_usd is not None and cost > self.hard_limit_usd:
+            return f"hard limit ${self.hard_limit_usd:.2f}"
+        if self.hard_limit_tokens is not None and tokens > self.hard_limit_tokens:
+            return f"hard limit {self.hard_limit_tokens} tokens"
+        if self.soft_limit_action == 'stop':
+            if self.soft_limit_usd is not None and cost > self.soft_limit_usd:
+                return f"soft limit ${self.soft_limit_usd:.2f}"
+            if self.soft_limit_tokens is not None and tokens > self.soft_limit_tokens:
+                return f"soft limit {self.soft_limit_tokens} tokens"
+        return None
+
+    def _check_soft_locked(self):
+        if self._soft_warned:
+            return
+        spent = self._spent_locked()
+        tokens = spent['prompt_tokens'] + spent['completion_tokens']
+        over_usd = self.soft_limit_usd is not None and spent['cost_usd'] >= self.soft_limit_usd
+        over_tokens = self.soft_limit_tokens is not None and tokens >= self.soft_limit_tokens
+        if not (over_usd or over_tokens):
+            return
+        self._soft_warned = True
+        if self.logger:
+            self.logger.warning(
+                f"Soft budget limit passed: ${spent['cost_usd']:.2f} and {tokens} tokens "
+                f"spent this period ({self._period})"
+            )
@@ -0,0 +1,139 @@
+"""
+Persistent, content-addressed cache of image evaluations.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """Returns the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class EvaluationCache:
+    """
+    SQLite-backed cache keyed by the image content hash together with the
+    evaluation prompt, model and max_tokens, so a change to any of them
+    invalidates earlier results. Entries are evicted by age and, beyond
+    max_entries, least recently used first.
+    """
+
+    def __init__(self, db_path, max_entries=None, max_age_days=None):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.stats = {'hits': 0, 'misses': 0, 'tokens_saved': 0}
+
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS evaluations (
+                key TEXT PRIMARY KEY,
+                score INTEGER NOT NULL,
+                evaluation_data TEXT NOT NULL,
+                token_usage TEXT,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_evaluations_accessed ON evaluations (accessed_at)"
+        )
+        self._conn.commit()
+        self.evict()
+
+    @classmethod
+    def from_config(cls, config):
+        """Opens the cache described by the config, or returns None if disabled."""
+        cache_config = config.get('cache', {}) or {}
+        if not cache_config.get('enabled', False):
+            return None
+        db_path = os.path.join(
+            config['directories']['logs'],
+            cache_config.get('file', 'evaluation_cache.sqlite')
+        )
+        return cls(
+            db_path,
+            max_entries=cache_config.get('max_entries'),
+            max_age_days=cache_config.get('max_age_days')
+        )
+
+    @staticmethod
+    def make_key(image_hash, prompt, model, max_tokens, variant=''):
+        """
+        Combines the image hash with everything that shapes the response.
+        `variant` covers any other request settings, such as preprocessing.
+        """
+        prompt_hash = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        return hashlib.sha256(
+            f"{image_hash}:{prompt_hash}:{model}:{max_tokens}:{variant}".encode('utf-8')
+        ).hexdigest()
+
+    def get(self, key):
+        """
+        Looks up a cached evaluation.
+        Returns tuple of (score, evaluation_data, token_usage) or None.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT score, evaluation_data, token_usage FROM evaluations WHERE key = ?",
+                (key,)
+            ).fetchone()
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+            self._conn.execute(
+                "UPDATE evaluations SET accessed_at = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+            self.stats['hits'] += 1
+
+        score, evaluation_data, token_usage = row
+        token_usage = json.loads(token_usage) if token_usage else None
+        if token_usage:
+            self.stats['tokens_saved'] += token_usage.get('total_tokens', 0)
+        return score, json.loads(evaluation_data), token_usage
+
+    def put(self, key, score, evaluation_data, token_usage):
+        """Stores a successful evaluation."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO evaluations VALUES (?, ?, ?, ?, ?, ?)",
+                (key, score, json.dumps(evaluation_data),
+                 json.dumps(token_usage) if token_usage else None, now, now)
+            )
+            self._conn.commit()
+
+    def evict(self):
+        """Drops entries older than max_age_days, then the least recently used over max_entries."""
+        with self._lock:
+            if self.max_age_days:
+                cutoff = time.time() - self.max_age_days * 86400
+                self._conn.execute("DELETE FROM evaluations WHERE created_at < ?", (cutoff,))
+            if self.max_entries:
+                self._conn.execute(
+                    """
+                    DELETE FROM evaluations WHERE key IN (
+                        SELECT key FROM evaluations ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                    )
+                    """,
+                    (self.max_entries,)
+                )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,235 @@
+"""
+Perceptual-hash deduplication so near-identical images share one evaluation.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+HASH_SIZE = 8
+_DCT_SIZE = 32
+
+
+def _dct_matrix(n):
+    k = np.arange(n)
+    matrix = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n))
+    matrix[0] *= 1 / np.sqrt(2)
+    return matrix * np.sqrt(2 / n)
+
+
+_DCT = _dct_matrix(_DCT_SIZE)
+
+
+def _load_gray(image_path, size):
+    with Image.open(image_path) as image:
+        # Let the JPEG decoder downscale while decoding
+        image.draft('L', (size[0] * 4, size[1] * 4))
+        return np.asarray(image.convert('L').resize(size, Image.BILINEAR), dtype=np.float32)
+
+
+def _bits_to_int(bits):
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+
+
+def average_hash(image_path):
+    pixels = _load_gray(image_path, (HASH_SIZE, HASH_SIZE))
+    return _bits_to_int(pixels > pixels.mean())
+
+
+def difference_hash(image_path):
+    pixels = _load_gray(image_path, (HASH_SIZE + 1, HASH_SIZE))
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def perceptual_hash(image_path):
+    pixels = _load_gray(image_path, (_DCT_SIZE, _DCT_SIZE))
+    low = (_DCT @ pixels @ _DCT.T)[:HASH_SIZE, :HASH_SIZE]
+    return _bits_to_int(low > np.median(low))
+
+
+HASH_FUNCTIONS = {
+    'ahash': average_hash,
+    'dhash': difference_hash,
+    'phash': perceptual_hash
+}
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """Burkhard-Keller tree over 64-bit hashes for Hamming radius queries."""
+
+    def __init__(self):
+        self._root = None
+
+    def add(self, value, item):
+        node = [value, item, {}]
+        if self._root is None:
+            self._root = node
+            return
+        current = self._root
+        while True:
+            distance = hamming_distance(value, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def remove(self, value, item):
+        """
+        Removes `item`, stored under `value`. Its node stays behind, empty,
+        to keep the tree's structure. Returns True if it was found.
+        """
+        current = self._root
+        while current is not None:
+            distance = hamming_distance(value, current[0])
+            if distance == 0 and current[1] is item:
+                current[1] = None
+                return True
+            current = current[2].get(distance)
+        return False
+
+    def nearest(self, value, max_distance):
+        """Returns (distance, item) of the closest entry within max_distance, or None."""
+        if self._root is None:
+            return None
+        best = None
+        stack = [self._root]
+        while stack:
+            node_value, item, children = stack.pop()
+            distance = hamming_distance(value, node_value)
+            if item is not None and distance <= max_distance and (best is None or distance < best[0]):
+                best = (distance, item)
+            for child_distance, child in children.items():
+                if abs(child_distance - distance) <= max_distance:
+                    stack.append(child)
+        return best
+
+
+class Cluster:
+    """A group of near-duplicates sharing the representative's evaluation."""
+
+    def __init__(self, representative, result=None):
+        self.representative = str(representative)
+        self.result = result
+        self.ready = threading.Event()
+        if result is not None:
+            self.ready.set()
+
+    def wait(self):
+        """Blocks until the representative has been evaluated; returns its result."""
+        self.ready.wait()
+        return self.result
+
+
+class DedupIndex:
+    """
+    Clusters images whose perceptual hashes lie within `max_distance` bits.
+
+    The first image of a cluster is its representative and is evaluated;
+    later members reuse its result. Scored representatives are persisted in
+    SQLite and reloaded into the BK-tree, so later runs recognise
+    near-duplicates of images sorted before.
+    """
+
+    def __init__(self, db_path, hash_name='phash', max_distance=4):
+        if hash_name not in HASH_FUNCTIONS:
+            raise ValueError(f"Unknown hash '{hash_name}', expected one of {sorted(HASH_FUNCTIONS)}")
+        self.hash_name = hash_name
+        self.hash_function = HASH_FUNCTIONS[hash_name]
+        self.max_distance = max_distance
+        self.stats = {'representatives': 0, 'duplicates': 0, 'known': 0}
+
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._tree = BKTree()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS representatives (
+                hash_name TEXT NOT NULL,
+                hash INTEGER NOT NULL,
+                source TEXT NOT NULL,
+                score INTEGER NOT NULL,
+                evaluation_data TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+        for value, source, score, evaluation_data in self._conn.execute(
+            "SELECT hash, source, score, evaluation_data FROM representatives WHERE hash_name = ?",
+            (hash_name,)
+        ):
+            cluster = Cluster(source, (score, json.loads(evaluation_data), None))
+            self._tree.add(value & 0xFFFFFFFFFFFFFFFF, cluster)
+
+    @classmethod
+    def from_config(cls, config):
+        """Opens the index described by the dedup config section, or returns None if disabled."""
+        settings = config.get('dedup', {}) or {}
+        if not settings.get('enabled', False):
+            return None
+        db_path = os.path.join(
+            config['directories']['logs'],
+            settings.get('file', 'dedup_index.sqlite')
+        )
+        return cls(db_path, settings.get('hash', 'phash'), settings.get('max_distance', 4))
+
+    def claim(self, image_path, value=None):
+        """
+        Places an image in a cluster, hashing it unless its `value` is given.
+        Returns tuple of (cluster, is_representative, hash); cluster is None
+        if the image could not be hashed.
+        """
+        if value is None:
+            try:
+                value = self.hash_function(image_path)
+            except Exception:
+                return None, False, None
+
+        with self._lock:
+            match = self._tree.nearest(value, self.max_distance)
+            if match:
+                cluster = match[1]
+                if cluster.ready.is_set() and cluster.result and cluster.result[0]:
+                    self.stats['known'] += 1
+                else:
+                    self.stats['duplicates'] += 1
+                return cluster, False, value
+            cluster = Cluster(image_path)
+            self._tree.add(value, cluster)
+            self.stats['representatives'] += 1
+        return cluster, True, value
+
+    def resolve(self, cluster, value, result):
+        """
+        Publishes a representative's result to its members and persists it
+        if scored. A cluster whose representative failed is dropped, so the
+        next near-duplicate to arrive starts a new one.
+        """
+        score, evaluation_data, _ = result
+        if not score:
+            with self._lock:
+                self._tree.remove(value, cluster)
+        cluster.result = result
+        cluster.ready.set()
+        if score:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT INTO representatives VALUES (?, ?, ?, ?, ?, ?)",
+                    (self.hash_name, value - (1 << 64) if value >= (1 << 63) else value,
+                     cluster.representative, score, json.dumps(evaluation_data), time.time())
+                )
+                self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,562 @@
+"""
+Coordinator/worker mode for sorting one shared tree from several nodes.
+"""
+import json
+import os
+import signal
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from pathlib import Path
+
+from log_sink import make_record
+from scanner import ImageScanner
+
+QUEUED = 'queued'
+LEASED = 'leased'
+EVALUATED = 'evaluated'
+DONE = 'done'
+FAILED = 'failed'
+
+_ENQUEUE_BATCH = 1000
+
+
+class WorkQueue:
+    """
+    Work items for a distributed run, kept in one SQLite file on the
+    filesystem the nodes share:
+    queued -> leased -> evaluated -> done (or failed).
+
+    Workers lease items for `lease_seconds` and renew their leases with
+    heartbeats while they work. An item is leased to one worker at a time,
+    so no image is evaluated twice; a lease that runs out (the worker
+    crashed or lost the share) is handed to the next worker that asks.
+    Results are only accepted from the worker holding the lease, and are
+    committed before the file is moved, so an item reclaimed after its
+    evaluation is moved with the stored result instead of being sent to
+    the API again. An evaluated item whose file could not be moved is
+    handed back at once, to be moved under the next lease. Items leased
+    `max_attempts` times without finishing are marked failed.
+
+    The file uses SQLite's rollback journal rather than WAL, whose shared
+    memory does not work across hosts; the filesystem must support POSIX
+    locks (e.g. NFSv4), and node clocks must agree to well within
+    `lease_seconds`.
+    """
+
+    def __init__(self, db_path, lease_seconds=300, max_attempts=3, busy_timeout=60.0):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=busy_timeout, isolation_level=None,
+                                     check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=DELETE")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        with self._transaction() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS items (
+                    source TEXT PRIMARY KEY,
+                    root TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    worker TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    score INTEGER,
+                    evaluation_data TEXT,
+                    token_usage TEXT,
+                    destination TEXT,
+                    error TEXT,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_items_state ON items (state, lease_expires)")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS workers (
+                    worker TEXT PRIMARY KEY,
+                    host TEXT NOT NULL,
+                    pid INTEGER NOT NULL,
+                    started_at REAL NOT NULL,
+                    heartbeat_at REAL NOT NULL,
+                    processed INTEGER NOT NULL DEFAULT 0
+                )
+                """
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    @classmethod
+    def from_config(cls, config, path=None):
+        """
+        Opens the queue described by the distributed config section. A
+        relative distributed.queue (or `path`) is taken under
+        directories.logs, which only works when that is shared too.
+        """
+        settings = config.get('distributed', {}) or {}
+        db_path = path or settings.get('queue', 'work_queue.sqlite')
+        if not os.path.isabs(db_path):
+            db_path = os.path.join(config['directories']['logs'], db_path)
+        return cls(
+            db_path,
+            lease_seconds=settings.get('lease_seconds', 300),
+            max_attempts=settings.get('max_attempts', 3)
+        )
+
+    @contextmanager
+    def _transaction(self):
+        """Runs a block in one write transaction, taking the database lock up front."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _set_meta(self, key, value):
+        with self._transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, str(value)))
+
+    def begin_scan(self):
+        """Marks the queue as still being filled, so idle workers wait for more."""
+        self._set_meta('scan_complete', 0)
+
+    def finish_scan(self):
+        self._set_meta('scan_complete', 1)
+
+    def enqueue(self, root, sources):
+        """
+        Adds images under `root`. Images already in the queue are left as
+        they are, except failed ones, which are queued again. Returns the
+        number added or requeued.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT INTO items (source, root, state, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (source) DO UPDATE SET state = excluded.state, attempts = 0, error = NULL, "
+                "updated_at = excluded.updated_at WHERE items.state = ?",
+                [(str(source), str(root), QUEUED, now, FAILED) for source in sources]
+            )
+            return conn.total_changes - before
+
+    def register(self, worker):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO workers VALUES (?, ?, ?, ?, ?, 0)",
+                (worker, socket.gethostname(), os.getpid(), now, now)
+            )
+
+    def lease(self, worker, count):
+        """
+        Leases up to `count` items to `worker`, reclaiming expired leases
+        first. Returns a list of dicts with source, root, state and, for
+        items evaluated under an earlier lease, the stored result
+        (score, evaluation_data, token_usage) and destination.
+        """
+        now = time.time()
+        leased = []
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT source, root, state, attempts, score, evaluation_data, token_usage, destination "
+                "FROM items WHERE state IN (?, ?) AND lease_expires < ? ORDER BY lease_expires LIMIT ?",
+                (LEASED, EVALUATED, now, count)
+            ).fetchall()
+            if len(rows) < count:
+                rows += conn.execute(
+                    "SELECT source, root, state, attempts, score, evaluation_data, token_usage, destination "
+                    "FROM items WHERE state = ? ORDER BY rowid LIMIT ?",
+                    (QUEUED, count - len(rows))
+                ).fetchall()
+            for source, root, state, attempts, score, evaluation_data, token_usage, destination in rows:
+                if state == LEASED and attempts >= self.max_attempts:
+                    conn.execute(
+                        "UPDATE items SET state = ?, worker = NULL, error = ?, updated_at = ? WHERE source = ?",
+                        (FAILED, f"Lease expired {attempts} times", now, source)
+                    )
+                    continue
+                conn.execute(
+                    "UPDATE items SET state = ?, worker = ?, lease_expires = ?, attempts = attempts + 1, "
+                    "updated_at = ? WHERE source = ?",
+                    (EVALUATED if state == EVALUATED else LEASED, worker,
+                     now + self.lease_seconds, now, source)
+                )
+                item = {'source': source, 'root': root, 'state': state}
+                if state == EVALUATED:
+                    item['result'] = (
+                        score, json.loads(evaluation_data), json.loads(token_usage) if token_usage else None
+                    )
+                    item['destination'] = destination
+                leased.append(item)
+        return leased
+
+    def heartbeat(self, worker):
+        """Extends every lease `worker` holds. Returns the number renewed."""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("UPDATE workers SET heartbeat_at = ? WHERE worker = ?", (now, worker))
+            return conn.execute(
+                "UPDATE items SET lease_expires = ? WHERE worker = ? AND state IN (?, ?)",
+                (now + self.lease_seconds, worker, LEASED, EVALUATED)
+            ).rowcount
+
+    def record_evaluated(self, worker, source, result, destination):
+        """
+        Stores an evaluation result if `worker` still holds the item's
+        lease. Returns False if the lease was lost, in which case the file
+        must be left alone.
+        """
+        score, evaluation_data, token_usage = result
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE items SET state = ?, score = ?, evaluation_data = ?, token_usage = ?, "
+                "destination = ?, updated_at = ? WHERE source = ? AND worker = ? AND state = ?",
+                (EVALUATED, score, json.dumps(evaluation_data),
+                 json.dumps(token_usage) if token_usage else None,
+                 str(destination), time.time(), str(source), worker, LEASED)
+            ).rowcount == 1
+
+    def record_done(self, worker, source):
+        """Marks an item sorted. Returns False if `worker` no longer held it."""
+        with self._transaction() as conn:
+            updated = conn.execute(
+                "UPDATE items SET state = ?, lease_expires = NULL, updated_at = ? "
+                "WHERE source = ? AND worker = ? AND state IN (?, ?)",
+                (DONE, time.time(), str(source), worker, LEASED, EVALUATED)
+            ).rowcount == 1
+            if updated:
+                conn.execute("UPDATE workers SET processed = processed + 1 WHERE worker = ?", (worker,))
+            return updated
+
+    def release_unmoved(self, worker, source, error):
+        """
+        Gives up `worker`'s lease on an evaluated item whose file could not
+        be moved, so the next lease retries the move with the stored
+        result. An item already leased `max_attempts` times is marked
+        failed instead. Returns True if it was marked failed.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT attempts FROM items WHERE source = ? AND worker = ? AND state = ?",
+                (str(source), worker, EVALUATED)
+            ).fetchone()
+            if not row:
+                return False
+            give_up = row[0] >= self.max_attempts
+            conn.execute(
+                "UPDATE items SET state = ?, worker = NULL, lease_expires = ?, error = ?, updated_at = ? "
+                "WHERE source = ?",
+                (FAILED if give_up else EVALUATED, None if give_up else now, str(error), now, str(source))
+            )
+            return give_up
+
+    def record_failed(self, worker, source, error):
+        """
+        Marks an item whose evaluation failed; like a single-node run, the
+        image stays where it is. Enqueueing it again retries it.
+        """
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE items SET state = ?, lease_expires = NULL, error = ?, updated_at = ? "
+                "WHERE source = ? AND worker = ? AND state = ?",
+                (FAILED, str(error), time.time(), str(source), worker, LEASED)
+            )
+
+    def reclaim(self):
+        """
+        Returns items whose lease ran out to the queue (evaluated ones keep
+        their result and wait for the next lease). Returns the number reclaimed.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE items SET state = ?, worker = NULL, lease_expires = NULL, updated_at = ? "
+                "WHERE state = ? AND lease_expires < ? AND attempts < ?",
+                (QUEUED, now, LEASED, now, self.max_attempts)
+            ).rowcount
+
+    def counts(self):
+        """Returns a dict of state -> number of items."""
+        with self._lock:
+            return dict(self._conn.execute("SELECT state, COUNT(*) FROM items GROUP BY state").fetchall())
+
+    def workers(self):
+        """Returns the registered workers as dicts, most recent heartbeat first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT worker, host, pid, started_at, heartbeat_at, processed FROM workers "
+                "ORDER BY heartbeat_at DESC"
+            ).fetchall()
+        columns = ('worker', 'host', 'pid', 'started_at', 'heartbeat_at', 'processed')
+        return [dict(zip(columns, row)) for row in rows]
+
+    def drained(self):
+        """True once the scan has finished and every item is done or failed."""
+        with self._lock:
+            complete = self._conn.execute("SELECT value FROM meta WHERE key = 'scan_complete'").fetchone()
+            open_items = self._conn.execute(
+                "SELECT COUNT(*) FROM items WHERE state IN (?, ?, ?)", (QUEUED, LEASED, EVALUATED)
+            ).fetchone()[0]
+        return bool(complete and complete[0] == '1') and open_items == 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class Coordinator:
+    """
+    Scans directories into the work queue and, optionally, watches the
+    workers drain it: reclaiming expired leases and printing progress.
+    """
+
+    def __init__(self, config, work_queue, poll_interval=5.0, status_interval=60.0):
+        self.config = config
+        self.queue = work_queue
+        self.poll_interval = poll_interval
+        self.status_interval = status_interval
+
+    @classmethod
+    def from_config(cls, config, work_queue):
+        settings = config.get('distributed', {}) or {}
+        return cls(
+            config,
+            work_queue,
+            poll_interval=settings.get('poll_interval', 5.0),
+            status_interval=settings.get('status_interval', 60.0)
+        )
+
+    def enqueue_directories(self, directories, recursive=False):
+        """Scans each directory into the queue. Returns tuple of (found, added)."""
+        self.queue.begin_scan()
+        found = added = 0
+        for directory in directories:
+            root = os.path.abspath(directory)
+            scanner = ImageScanner.from_config(root, self.config, recursive=recursive)
+            batch = []
+            for image_path in scanner.scan():
+                batch.append(os.path.abspath(image_path))
+                if len(batch) >= _ENQUEUE_BATCH:
+                    added += self.queue.enqueue(root, batch)
+                    found += len(batch)
+                    batch = []
+            if batch:
+                added += self.queue.enqueue(root, batch)
+                found += len(batch)
+        self.queue.finish_scan()
+        print(f"Queued {added} new images of {found} found in {self.queue.db_path}")
+        return found, added
+
+    def wait(self):
+        """Blocks until the queue is drained. Returns the final state counts."""
+        last_status = 0.0
+        while not self.queue.drained():
+            reclaimed = self.queue.reclaim()
+            if reclaimed:
+                print(f"Reclaimed {reclaimed} expired leases")
+            if time.monotonic() - last_status >= self.status_interval:
+                last_status = time.monotonic()
+                self._print_status()
+            time.sleep(self.poll_interval)
+        counts = self.queue.counts()
+        print("Queue drained: " + ", ".join(f"{state}: {count}" for state, count in sorted(counts.items())))
+        return counts
+
+    def _print_status(self):
+        counts = self.queue.counts()
+        now = time.time()
+        live = [
+            worker for worker in self.queue.workers()
+            if now - worker['heartbeat_at'] < self.queue.lease_seconds
+        ]
+        print("Queue: " + ", ".join(f"{state}: {count}" for state, count in sorted(counts.items()))
+              + f"; {len(live)} live workers")
+
+
+class QueueWorker:
+    """
+    Leases images from the work queue, runs them through the evaluator's
+    pipeline and sorts them, until the queue is drained or stop() is
+    called. A heartbeat thread renews the worker's leases every
+    `heartbeat_interval` seconds.
+    """
+
+    def __init__(self, evaluator, work_queue, worker_id=None, concurrency=None,
+                 lease_batch=None, heartbeat_interval=30.0, poll_interval=5.0):
+        self.evaluator = evaluator
+        self.queue = work_queue
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        processing = evaluator.config.get('processing', {}) or {}
+        if concurrency is None:
+            concurrency = processing.get('concurrency', 1)
+        self.concurrency = max(1, int(concurrency))
+        self.images_per_request = max(1, int(processing.get('images_per_request', 1)))
+        self.lease_batch = lease_batch or self.images_per_request
+        self.heartbeat_interval = heartbeat_interval
+        self.poll_interval = poll_interval
+        self.stats = {'processed': 0, 'sorted': 0, 'failed': 0, 'recovered': 0, 'lost': 0}
+        self._in_flight = {}  # future -> list of leased items
+        self._stopping = threading.Event()
+
+    @classmethod
+    def from_config(cls, evaluator, work_queue, concurrency=None):
+        """Builds the worker from the distributed section of the evaluator's config."""
+        settings = evaluator.config.get('distributed', {}) or {}
+        return cls(
+            evaluator,
+            work_queue,
+            worker_id=settings.get('worker_id'),
+            concurrency=concurrency,
+            lease_batch=settings.get('lease_batch'),
+            heartbeat_interval=settings.get('heartbeat_interval', 30.0),
+            poll_interval=settings.get('poll_interval', 5.0)
+        )
+
+    def stop(self):
+        """Asks the worker to finish the items it holds and return from run()."""
+        self._stopping.set()
+
+    def run(self):
+        """Works until the queue is drained, stop() or SIGINT/SIGTERM. Returns the stats."""
+        previous_handlers = {}
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                previous_handlers[signum] = signal.signal(signum, lambda *_: self.stop())
+
+        self.evaluator.scheduler.resize(self.concurrency)
+        self.queue.register(self.worker_id)
+        heartbeat_stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(heartbeat_stop,), daemon=True)
+        heartbeat.start()
+        print(f"Worker {self.worker_id} taking work from {self.queue.db_path}")
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                while not self._stopping.is_set():
+                    if not self._submit(executor) and not self._in_flight:
+                        if self.queue.drained():
+                            break
+                        self._stopping.wait(self.poll_interval)
+                        continue
+                    self._collect(timeout=0.2)
+                while self._in_flight:
+                    self._collect(timeout=None)
+        finally:
+            heartbeat_stop.set()
+            heartbeat.join()
+            self.evaluator.evaluation_log.flush()
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+        print(f"Worker {self.worker_id} sorted {self.stats['sorted']} images "
+              f"({self.stats['failed']} failed, {self.stats['recovered']} finished for other workers, "
+              f"{self.stats['lost']} leases lost)")
+        return dict(self.stats)
+
+    def _heartbeat(self, stop):
+        while not stop.wait(self.heartbeat_interval):
+            try:
+                self.queue.heartbeat(self.worker_id)
+            except sqlite3.Error as e:
+                self.evaluator.logger.warning(f"Heartbeat failed: {str(e)}")
+
+    def _submit(self, executor):
+        """Leases and submits work while there is room. Returns True if anything was leased."""
+        submitted = False
+        budget = self.evaluator.budget
+        while len(self._in_flight) < self.concurrency:
+            # Out of budget: lease nothing until the next period
+            if budget and not budget.reserve(images=self.lease_batch):
+                break
+            items = self.queue.lease(self.worker_id, self.lease_batch)
+            if budget:
+                budget.release(images=self.lease_batch - len(items))
+            if not items:
+                break
+            submitted = True
+            fresh = []
+            for item in items:
+                if item['state'] == EVALUATED:
+                    self._finish_recovered(item)
+                else:
+                    fresh.append(item)
+            for start in range(0, len(fresh), self.images_per_request):
+                chunk = fresh[start:start + self.images_per_request]
+                future = executor.submit(self.evaluator.evaluate_chunk, [item['source'] for item in chunk])
+                self._in_flight[future] = chunk
+        return submitted
+
+    def _collect(self, timeout):
+        done, _ = wait(list(self._in_flight), timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            chunk = self._in_flight.pop(future)
+            try:
+                outcomes = future.result()
+            except Exception as e:
+                self.evaluator.logger.error(f"Chunk evaluation failed: {str(e)}")
+                outcomes = [((None, str(e), None), {'latency': None})] * len(chunk)
+            for item, (result, details) in zip(chunk, outcomes):
+                self._finish(item, result, details)
+
+    def _finish(self, item, result, details):
+        source = item['source']
+        self.stats['processed'] += 1
+        if self.evaluator.budget:
+            self.evaluator.budget.release()
+        score = result[0]
+        if not score:
+            self.queue.record_failed(self.worker_id, source, result[1])
+            self.evaluator.sort_image(source, result, details)
+            self.stats['failed'] += 1
+            return
+        destination = self.evaluator._destination_path(source, score)
+        if not self.queue.record_evaluated(self.worker_id, source, result, destination):
+            # Another worker owns the item now; leave the file to it
+            self.evaluator.logger.warning(f"Lease on {source} was lost; not moving it")
+            self.stats['lost'] += 1
+            return
+        try:
+            self.evaluator.sort_image(source, result, details)
+        except OSError as e:
+            self._release_unmoved(source, e)
+            return
+        self.queue.record_done(self.worker_id, source)
+        self.stats['sorted'] += 1
+
+    def _finish_recovered(self, item):
+        """Completes an item another worker evaluated but did not finish sorting."""
+        source, destination = item['source'], item['destination']
+        score, evaluation_data, token_usage = item['result']
+        if self.evaluator.budget:
+            self.evaluator.budget.release()
+        if os.path.exists(source):
+            try:
+                self.evaluator.sort_image(source, item['result'], {'cache_status': 'queue'})
+            except OSError as e:
+                self._release_unmoved(source, e)
+                return
+        elif destination and os.path.exists(destination):
+            # Moved before the worker died; only the log record may be missing
+            self.evaluator.evaluation_log.write(make_record(
+                Path(source).name, score, evaluation_data, source=source, destination=destination,
+                token_usage=token_usage, cache_status='queue'
+            ))
+        else:
+            self.evaluator.logger.warning(f"Queued image {source} is missing, skipping")
+        self.queue.record_done(self.worker_id, source)
+        self.stats['recovered'] += 1
+
+    def _release_unmoved(self, source, error):
+        """Hands an item whose move failed back to the queue, which retries it with the stored result."""
+        self.evaluator.logger.error(f"Could not sort {source}: {str(error)}")
+        if self.queue.release_unmoved(self.worker_id, source, error):
+            self.evaluator.logger.error(f"Giving up on {source} after {self.queue.max_attempts} attempts")
+        self.stats['failed'] += 1
@@ -0,0 +1,380 @@
+"""
+Local embedding index that predicts the scores of images close to ones already scored.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from file_handler import CHARACTERISTICS
+from preprocess import EXIF_ORIENTATION, ORIENTATION_TRANSPOSE
+
+THUMBNAIL_EDGE = 32
+COLOR_LEVELS = 4  # Per channel, for a 4x4x4 joint RGB histogram
+ORIENTATION_BINS = 8
+EDGE_GRID = 4
+LAYOUT_EDGE = 8
+
+# Share of the squared distance each block contributes; every block is
+# unit length, so the cosine distance between two embeddings is the
+# weighted sum of the per-block cosine distances
+BLOCK_WEIGHTS = {'color': 0.5, 'edges': 0.25, 'layout': 0.25}
+EMBEDDING_SIZE = COLOR_LEVELS ** 3 + ORIENTATION_BINS + EDGE_GRID ** 2 + LAYOUT_EDGE ** 2
+
+_GROW_ROWS = 65536
+_LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def _unit(vector):
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def compute_embedding(image_path):
+    """
+    Computes a unit-length float32 feature vector for an image from a
+    32x32 thumbnail: a joint RGB color histogram, gradient orientation and
+    edge-energy statistics, and an 8x8 grayscale layout.
+    """
+    with Image.open(image_path) as image:
+        orientation = image.getexif().get(EXIF_ORIENTATION)
+        # Let the JPEG decoder downscale while decoding
+        image.draft('RGB', (THUMBNAIL_EDGE * 4, THUMBNAIL_EDGE * 4))
+        thumbnail = image.convert('RGB').resize((THUMBNAIL_EDGE, THUMBNAIL_EDGE), Image.BILINEAR)
+    if orientation in ORIENTATION_TRANSPOSE:
+        thumbnail = thumbnail.transpose(ORIENTATION_TRANSPOSE[orientation])
+    rgb = np.asarray(thumbnail, dtype=np.float32)
+
+    # Each pixel is shared between the two nearest levels of every channel,
+    # so small color shifts do not jump bins; square roots turn the
+    # histogram's L2 distance into the Hellinger distance
+    position = np.clip(rgb.reshape(-1, 3) * (COLOR_LEVELS / 256) - 0.5, 0, COLOR_LEVELS - 1)
+    lower = np.minimum(position.astype(np.int64), COLOR_LEVELS - 2)
+    upper_weight = position - lower
+    color = np.zeros(COLOR_LEVELS ** 3, dtype=np.float64)
+    for corner in range(8):
+        offsets = np.array([(corner >> 2) & 1, (corner >> 1) & 1, corner & 1])
+        weights = np.where(offsets, upper_weight, 1 - upper_weight).prod(axis=1)
+        levels = lower + offsets
+        bins = (levels[:, 0] * COLOR_LEVELS + levels[:, 1]) * COLOR_LEVELS + levels[:, 2]
+        color += np.bincount(bins, weights=weights, minlength=COLOR_LEVELS ** 3)
+    color = np.sqrt(color).astype(np.float32)
+
+    gray = rgb @ _LUMA
+    dx = gray[1:-1, 2:] - gray[1:-1, :-2]
+    dy = gray[2:, 1:-1] - gray[:-2, 1:-1]
+    magnitude = np.hypot(dx, dy)
+    angle = np.mod(np.arctan2(dy, dx), np.pi)
+    orientation_bins = np.minimum((angle * (ORIENTATION_BINS / np.pi)).astype(np.int64), ORIENTATION_BINS - 1)
+    orientations = np.bincount(orientation_bins.ravel(), weights=magnitude.ravel(), minlength=ORIENTATION_BINS)
+    cell = magnitude.shape[0] // EDGE_GRID
+    energy = magnitude[:cell * EDGE_GRID, :cell * EDGE_GRID].reshape(EDGE_GRID, cell, EDGE_GRID, cell).mean(axis=(1, 3))
+    edges = np.concatenate([orientations, energy.ravel()]).astype(np.float32)
+
+    block = THUMBNAIL_EDGE // LAYOUT_EDGE
+    layout = gray.reshape(LAYOUT_EDGE, block, LAYOUT_EDGE, block).mean(axis=(1, 3)).ravel()
+    layout = layout - layout.mean()
+
+    return _unit(np.concatenate([
+        np.sqrt(BLOCK_WEIGHTS['color']) * _unit(color),
+        np.sqrt(BLOCK_WEIGHTS['edges']) * _unit(edges),
+        np.sqrt(BLOCK_WEIGHTS['layout']) * _unit(layout)
+    ])).astype(np.float32)
+
+
+class EmbeddingIndex:
+    """
+    Stores an embedding per scored image and predicts the score of a new
+    image from its nearest scored neighbours, so it needs no API call.
+
+    Vectors live in a memory-mapped float32 file and their locality-sensitive
+    hash codes (random hyperplanes, `tables` tables of `bits` bits) in a
+    second one; sources, scores and evaluations are kept in SQLite. Codes
+    are sorted per table on open, and a lookup compares the query exactly
+    against the rows sharing a bucket with it in any table. Rows added
+    while open are kept in per-table buckets until the next open. One
+    process writes the index at a time.
+
+    A prediction is made only when at least `min_neighbors` scored images
+    lie within cosine distance `radius` and their scores differ by no more
+    than `max_spread`; it is the distance-weighted mean of up to
+    `neighbors` of the closest.
+    """
+
+    def __init__(self, directory, radius=0.05, neighbors=5, min_neighbors=3, max_spread=10,
+                 tables=8, bits=12, seed=0):
+        self.directory = directory
+        self.radius = radius
+        self.neighbors = neighbors
+        self.min_neighbors = min_neighbors
+        self.max_spread = max_spread
+        self.tables = tables
+        self.bits = bits
+        self.stats = {'lookups': 0, 'predicted': 0, 'added': 0}
+
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._planes = np.random.default_rng(seed).standard_normal(
+            (EMBEDDING_SIZE, tables * bits)
+        ).astype(np.float32)
+        self._powers = (1 << np.arange(bits, dtype=np.uint32)).astype(np.uint32)
+
+        self._conn = sqlite3.connect(os.path.join(directory, 'entries.sqlite'), check_same_thread=False)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                id INTEGER PRIMARY KEY,
+                source TEXT NOT NULL UNIQUE,
+                score INTEGER NOT NULL,
+                evaluation_data TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            """
+        )
+        self._conn.commit()
+        # Rows past the last committed entry belong to an interrupted add
+        self.size = self._conn.execute("SELECT COALESCE(MAX(id) + 1, 0) FROM entries").fetchone()[0]
+        self._open_arrays(max(self.size, _GROW_ROWS))
+
+        layout = json.dumps({'embedding_size': EMBEDDING_SIZE, 'tables': tables, 'bits': bits, 'seed': seed})
+        stored = self._conn.execute("SELECT value FROM meta WHERE key = 'layout'").fetchone()
+        if stored is None or stored[0] != layout:
+            if stored is not None and json.loads(stored[0])['embedding_size'] != EMBEDDING_SIZE:
+                raise ValueError(f"{directory} holds embeddings of another size; remove it to rebuild")
+            self._rehash()
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('layout', ?)", (layout,))
+            self._conn.commit()
+        self._build_buckets()
+
+    @classmethod
+    def from_config(cls, config):
+        """Opens the index described by the embedding config section, or returns None if disabled."""
+        settings = config.get('embedding', {}) or {}
+        if not settings.get('enabled', False):
+            return None
+        directory = os.path.join(
+            config['directories']['logs'],
+            settings.get('directory', 'embedding_index')
+        )
+        return cls(
+            directory,
+            radius=settings.get('radius', 0.05),
+            neighbors=settings.get('neighbors', 5),
+            min_neighbors=settings.get('min_neighbors', 3),
+            max_spread=settings.get('max_spread', 10),
+            tables=settings.get('hash_tables', 8),
+            bits=settings.get('hash_bits', 12)
+        )
+
+    def _open_arrays(self, capacity):
+        """Maps the vector and code files, growing them to hold `capacity` rows."""
+        self.capacity = capacity
+        arrays = []
+        for name, dtype, width in (('vectors.f32', np.float32, EMBEDDING_SIZE),
+                                   ('codes.u32', np.uint32, self.tables)):
+            path = os.path.join(self.directory, name)
+            nbytes = capacity * width * np.dtype(dtype).itemsize
+            with open(path, 'ab') as f:
+                if f.tell() < nbytes:
+                    f.truncate(nbytes)
+            arrays.append(np.memmap(path, dtype=dtype, mode='r+', shape=(capacity, width)))
+        self._vectors, self._codes = arrays
+
+    def _hash(self, vectors):
+        bits = (vectors @ self._planes > 0).reshape(len(vectors), self.tables, self.bits)
+        return (bits.astype(np.uint32) * self._powers).sum(axis=2, dtype=np.uint32)
+
+    def _rehash(self):
+        """Recomputes every stored code, after the hash layout changed."""
+        for start in range(0, self.size, _GROW_ROWS):
+            end = min(self.size, start + _GROW_ROWS)
+            self._codes[start:end] = self._hash(np.asarray(self._vectors[start:end]))
+        self._codes.flush()
+
+    def _build_buckets(self):
+        self._sorted = []
+        for table in range(self.tables):
+            codes = np.asarray(self._codes[:self.size, table])
+            order = np.argsort(codes, kind='stable')
+            self._sorted.append((order, codes[order]))
+        self._recent = [{} for _ in range(self.tables)]
+
+    def _candidates(self, codes):
+        found = []
+        for table, code in enumerate(codes):
+            order, sorted_codes = self._sorted[table]
+            start = np.searchsorted(sorted_codes, code, side='left')
+            end = np.searchsorted(sorted_codes, code, side='right')
+            found.append(order[start:end])
+            recent = self._recent[table].get(int(code))
+            if recent:
+                found.append(np.asarray(recent, dtype=np.int64))
+        return np.unique(np.concatenate(found)) if found else np.empty(0, dtype=np.int64)
+
+    def nearest(self, vector):
+        """
+        Returns the up to `neighbors` closest scored images within `radius`
+        as dicts of source, score, distance and evaluation_data, closest first.
+        """
+        vector = np.asarray(vector, dtype=np.float32)
+        codes = self._hash(vector[None, :])[0]
+        with self._lock:
+            ids = self._candidates(codes)
+            if not len(ids):
+                return []
+            distances = 1.0 - np.asarray(self._vectors[ids]) @ vector
+            keep = np.flatnonzero(distances <= self.radius)
+            keep = keep[np.argsort(distances[keep], kind='stable')][:self.neighbors]
+            if not len(keep):
+                return []
+            by_id = {int(ids[i]): float(max(0.0, distances[i])) for i in keep}
+            rows = self._conn.execute(
+                f"SELECT id, source, score, evaluation_data FROM entries "
+                f"WHERE id IN ({','.join('?' * len(by_id))})",
+                list(by_id)
+            ).fetchall()
+        neighbours = [
+            {'source': source, 'score': score, 'distance': by_id[row_id],
+             'evaluation_data': json.loads(evaluation_data)}
+            for row_id, source, score, evaluation_data in rows
+        ]
+        return sorted(neighbours, key=lambda neighbour: neighbour['distance'])
+
+    def predict(self, image_path, vector=None):
+        """
+        Returns tuple of (result, vector): a (score, evaluation_data, None)
+        result predicted from the image's scored neighbours, or None if they
+        are too few or disagree, and the image's embedding for a later add().
+        Images that cannot be read give (None, None).
+        """
+        if vector is None:
+            try:
+                vector = compute_embedding(image_path)
+            except Exception:
+                return None, None
+        neighbours = self.nearest(vector)
+        with self._lock:
+            self.stats['lookups'] += 1
+        if len(neighbours) < self.min_neighbors:
+            return None, vector
+        scores = [neighbour['score'] for neighbour in neighbours]
+        if max(scores) - min(scores) > self.max_spread:
+            return None, vector
+
+        weights = [1.0 / (neighbour['distance'] + 1e-3) for neighbour in neighbours]
+        score = sum(w * s for w, s in zip(weights, scores)) / sum(weights)
+        score = max(1, min(100, int(round(score))))
+        evaluation_data = {
+            'description': f"Predicted from {len(neighbours)} similar scored images",
+            'final_analysis': "Predicted: " + "; ".join(
+                f"{Path(neighbour['source']).name} scored {neighbour['score']} "
+                f"(distance {neighbour['distance']:.3f})"
+                for neighbour in neighbours
+            ),
+            'predicted': True,
+            'neighbours': [
+                {key: neighbour[key] for key in ('source', 'score', 'distance')}
+                for neighbour in neighbours
+            ]
+        }
+        for char in CHARACTERISTICS:
+            key = char.lower()
+            values = [
+                (w, neighbour['evaluation_data'][key]) for w, neighbour in zip(weights, neighbours)
+                if isinstance(neighbour['evaluation_data'].get(key), (int, float))
+            ]
+            if values:
+                evaluation_data[key] = int(round(sum(w * v for w, v in values) / sum(w for w, _ in values)))
+        with self._lock:
+            self.stats['predicted'] += 1
+        return (score, evaluation_data, None), vector
+
+    def add(self, source, result, vector=None, image_path=None):
+        """
+        Stores a scored image under its `source` path, reading `image_path`
+        (default: the source) if no embedding is given. Unscored, prefiltered,
+        predicted and already indexed images are skipped. Returns True if it
+        was added.
+        """
+        score, evaluation_data, _ = result
+        if not score or not isinstance(evaluation_data, dict):
+            return False
+        if evaluation_data.get('prefiltered') or evaluation_data.get('predicted'):
+            return False
+        source = str(source)
+        if vector is None:
+            try:
+                vector = compute_embedding(image_path or source)
+            except Exception:
+                return False
+        vector = np.asarray(vector, dtype=np.float32)
+        codes = self._hash(vector[None, :])[0]
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM entries WHERE source = ?", (source,)).fetchone():
+                return False
+            row = self.size
+            if row >= self.capacity:
+                self._vectors.flush()
+                self._codes.flush()
+                self._open_arrays(self.capacity * 2)
+            self._vectors[row] = vector
+            self._codes[row] = codes
+            self._conn.execute(
+                "INSERT INTO entries VALUES (?, ?, ?, ?, ?)",
+                (row, source, score, json.dumps(evaluation_data), time.time())
+            )
+            self._conn.commit()
+            for table, code in enumerate(codes):
+                self._recent[table].setdefault(int(code), []).append(row)
+            self.size += 1
+            self.stats['added'] += 1
+        return True
+
+    def close(self):
+        with self._lock:
+            self._vectors.flush()
+            self._codes.flush()
+            self._conn.close()
+
+
+def index_log(index, log_path):
+    """
+    Adds the scored images in a JSONL evaluation log to the index, reading
+    each from its destination if it has been moved. Returns tuple of
+    (added, skipped).
+    """
+    added = skipped = 0
+    with open(log_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                skipped += 1
+                continue
+            if record.get('status') != 'scored' or not record.get('source'):
+                skipped += 1
+                continue
+            evaluation_data = {
+                'description': record.get('description'),
+                'final_analysis': record.get('final_analysis')
+            }
+            for char in CHARACTERISTICS:
+                value = record.get(char.lower().replace(' ', '_'))
+                if value is not None:
+                    evaluation_data[char.lower()] = value
+            destination = record.get('destination')
+            image_path = destination if destination and os.path.exists(destination) else record['source']
+            if index.add(record['source'], (record['score'], evaluation_data, None), image_path=image_path):
+                added += 1
+            else:
+                skipped += 1
+    return added, skipped
@@ -1,17 +1,24 @@
 """
 Handles all file operations including moving files and logging.
 """
+import errno
 import os
 import shutil
 from datetime import datetime
 
-def determine_folder(score):
+CHARACTERISTICS = [
+    'Composition', 'Color', 'Lighting', 'Subject', 'Originality',
+    'Technical Skill', 'Emotion', 'Storytelling', 'Clarity', 'Creativity'
+]
+
+def determine_folder(score, interval=3):
     """
-    Determines the appropriate folder name based on the score.
+    Determines the appropriate folder name based on the score, for folders
+    `interval` points wide.
     """
-    # Calculate the lower bound of the interval (rounds down to nearest multiple of 3)
-    lower_bound = ((score - 1) // 3) * 3 + 1
-    upper_bound = lower_bound + 2
+    # Calculate the lower bound of the interval (rounds down to nearest multiple of interval)
+    lower_bound = ((score - 1) // interval) * interval + 1
+    upper_bound = lower_bound + interval - 1
     
     # Handle edge case for score of 100
     if upper_bound > 100:
@@ -33,6 +40,80 @@ def move_image(source_path, score, config):
     
     return destination_path
 
+def move_file(source_path, destination_path, overwrite=False):
+    """
+    Moves a file so that it is never lost or half-written at the destination.
+    A plain rename is used on the same filesystem. Across filesystems the
+    file is copied to a temporary name beside the destination, fsynced,
+    renamed into place and only then unlinked at the source.
+    Returns 'renamed' or 'copied'.
+    """
+    if not overwrite and os.path.lexists(destination_path):
+        raise FileExistsError(errno.EEXIST, "Destination already exists", destination_path)
+    try:
+        os.rename(source_path, destination_path)
+        return 'renamed'
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    temporary_path = os.path.join(
+        os.path.dirname(destination_path) or '.',
+        f".{os.path.basename(destination_path)}.partial"
+    )
+    try:
+        shutil.copy2(source_path, temporary_path)
+        with open(temporary_path, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(temporary_path, destination_path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.unlink(temporary_path)
+        raise
+    fsync_directory(os.path.dirname(destination_path) or '.')
+    os.unlink(source_path)
+    return 'copied'
+
+def fsync_directory(directory):
+    """Makes renames and new entries in a directory durable, where supported."""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def format_evaluation(image_name, score, evaluation_data):
+    """
+    Renders an evaluation as the human-readable text log block.
+    """
+    lines = [f"Image: {image_name}", f"Score: {score}"]
+    
+    # Write the detailed evaluation
+    if isinstance(evaluation_data, dict):
+        # Write description
+        if 'description' in evaluation_data:
+            lines.append(f"Description: {evaluation_data['description']}")
+        
+        # Write individual scores
+        for char in CHARACTERISTICS:
+            if char.lower() in evaluation_data:
+                lines.append(f"{char}: {evaluation_data[char.lower()]}/10")
+        
+        # Write final analysis
+        if 'final_analysis' in evaluation_data:
+            lines.append(f"\nFinal Analysis: {evaluation_data['final_analysis']}")
+    else:
+        # If evaluation_data is just a string (e.g., error message)
+        lines.append(f"Reason: {evaluation_data}")
+    
+    lines.append("-" * 40)
+    return "\n".join(lines) + "\n"
+
 def log_evaluation(image_name, score, evaluation_data, config):
     """
     Appends the evaluation to the log file.
@@ -46,29 +127,4 @@ def log_evaluation(image_name, score, evaluation_data, config):
     os.makedirs(os.path.dirname(log_file_path), exist_ok=True)
     
     with open(log_file_path, 'a') as log_file:
-        log_file.write(f"Image: {image_name}\n")
-        log_file.write(f"Score: {score}\n")
-        
-        # Write the detailed evaluation
-        if isinstance(evaluation_data, dict):
-            # Write description
-            if 'description' in evaluation_data:
-                log_file.write(f"Description: {evaluation_data['description']}\n")
-            
-            # Write individual scores
-            characteristics = [
-                'Composition', 'Color', 'Lighting', 'Subject', 'Originality',
-                'Technical Skill', 'Emotion', 'Storytelling', 'Clarity', 'Creativity'
-            ]
-            for char in characteristics:
-                if char.lower() in evaluation_data:
-                    log_file.write(f"{char}: {evaluation_data[char.lower()]}/10\n")
-            
-            # Write final analysis
-            if 'final_analysis' in evaluation_data:
-                log_file.write(f"\nFinal Analysis: {evaluation_data['final_analysis']}\n")
-        else:
-            # If evaluation_data is just a string (e.g., error message)
-            log_file.write(f"Reason: {evaluation_data}\n")
-        
-        log_file.write("-" * 40 + "\n")
\ No newline at end of file
+        log_file.write(format_evaluation(image_name, score, evaluation_data))
\ No newline at end of file
@@ -1,155 +1,748 @@
 """
 Core module for evaluating image quality using OpenAI's Vision API.
 """
+import contextlib
+import itertools
+import json
 import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import yaml
 from openai import OpenAI
-from utils import get_image_base64, setup_logging
-from file_handler import determine_folder, move_image, log_evaluation
+from utils import merge_config, setup_logging
+from preprocess import UPLOAD_COPIES, PreprocessPool, estimate_memory, prepare_image
+from scheduler import RequestScheduler
+from cache import EvaluationCache, hash_file
+from journal import JobJournal, EVALUATED
+from batch_api import BatchRunner
+from scanner import ImageScanner, ImageList
+from dedup import DedupIndex
+from embedding_index import EmbeddingIndex
+from pipeline import stages_from_config
+from prefilter import Prefilter
+from file_handler import determine_folder, move_file
+from manifest import Manifest
+from log_sink import EvaluationLog, make_record
+from score_index import ScoreIndex
+from response_parser import parser_from_config
+from transport import build_http_client
+from metrics import Metrics
+from budget import Budget, format_forecast, format_usd, scale_forecast
+from memory_budget import MemoryBudget
+
+DEFAULT_MULTI_IMAGE_PROMPT = (
+    'You will receive {count} images, labelled "Image 1" to "Image {count}". '
+    'Evaluate each image separately using the instructions below. Start each '
+    'image\'s answer with a header line "### Image N" and use exactly the '
+    'requested format for every image.'
+)
 
 class ImageEvaluator:
-    def __init__(self, config_path='config/config.yaml'):
-        """Initialize the ImageEvaluator with configuration and logging."""
+    def __init__(self, config_path='config/config.yaml', overrides=None):
+        """
+        Initialize the ImageEvaluator with configuration and logging.
+        `overrides` is a nested dict merged over the loaded config.
+        """
         try:
             # Load configuration
             with open(config_path, 'r') as f:
-                self.config = yaml.safe_load(f)
-            
-            # Setup OpenAI client
-            self.client = OpenAI(api_key=self.config['openai']['api_key'])
+                self.config = merge_config(yaml.safe_load(f), overrides)
             
             # Setup logging
             self.logger = setup_logging()
+
+            # Setup per-stage timers and counters
+            self.metrics = Metrics.from_config(self.config)
+
+            # Setup OpenAI client on a pooled, timed HTTP transport;
+            # retries are handled by the scheduler
+            self.http_client, self.transport_stats = build_http_client(self.config, self.logger)
+            self.client = OpenAI(
+                api_key=self.config['openai']['api_key'],
+                base_url=self.config['openai'].get('base_url'),
+                max_retries=0,
+                http_client=self.http_client
+            )
+
+            # Setup reply parsing (plain text or JSON structured output)
+            self.parser = parser_from_config(self.config)
+
+            # Setup rate limiting and retries
+            self.scheduler = RequestScheduler.from_config(self.config, self.logger)
+
+            # Setup worker processes for image preprocessing (None when
+            # images are prepared on the requesting thread)
+            self.preprocess_pool = PreprocessPool.from_config(self.config, self.logger)
+
+            # Setup the memory budget for images in flight (None when disabled)
+            self.memory = MemoryBudget.from_config(self.config)
             
             # Ensure required directories exist
             for dir_name in self.config['directories'].values():
                 os.makedirs(dir_name, exist_ok=True)
+
+            # Setup evaluation cache (None when disabled)
+            self.cache = EvaluationCache.from_config(self.config)
+
+            # Setup job journal for resumable runs (None when disabled)
+            self.journal = JobJournal.from_config(self.config)
+
+            # Setup local quality prefilter (None when disabled)
+            self.prefilter = Prefilter.from_config(self.config, self.logger)
+
+            # Setup perceptual-hash deduplication (None when disabled)
+            self.dedup = DedupIndex.from_config(self.config)
+
+            # Setup score prediction from similar scored images (None when disabled)
+            self.embeddings = EmbeddingIndex.from_config(self.config)
+
+            # Setup cost accounting and budget limits (None when disabled)
+            self.budget = Budget.from_config(self.config, self.logger)
+
+            # Setup the stages that can settle an image before the API,
+            # in pipeline.stages order
+            self.stages = stages_from_config(self)
+
+            # Setup score-only manifest (None unless processing.score_only)
+            self.manifest = Manifest.from_config(self.config)
+
+            # Setup the score index for queries and re-bucketing (None when disabled)
+            self.score_index = ScoreIndex.from_config(self.config)
+
+            # Setup buffered evaluation log; flushed records are added to the
+            # score index, and journal entries become 'logged' only once
+            # their records are on disk
+            self.evaluation_log = EvaluationLog.from_config(self.config)
+            if self.journal or self.score_index:
+                self.evaluation_log.on_flush = self._log_flushed
+
+            self.metrics.attach('http', self.transport_stats.summary)
+            self.metrics.attach('requests', lambda: dict(self.scheduler.stats))
+            if self.budget:
+                self.metrics.attach('budget', self.budget.summary)
+            if self.memory:
+                self.metrics.attach('memory', lambda: dict(self.memory.stats))
+            if self.embeddings:
+                self.metrics.attach('embedding', lambda: dict(self.embeddings.stats))
             
         except Exception as e:
             print(f"Error initializing ImageEvaluator: {str(e)}")
             raise
 
+    def cache_key(self, image_path):
+        """Returns the evaluation cache key for an image, or None without a cache."""
+        if not self.cache:
+            return None
+        # Stays on this thread even with preprocess workers: hashlib releases
+        # the GIL while digesting, so threads already hash in parallel
+        with self.metrics.time('hash'):
+            image_hash = hash_file(image_path)
+        return EvaluationCache.make_key(
+            image_hash,
+            self.config['prompts']['evaluation_prompt'],
+            self.config['openai']['model'],
+            self.config['openai']['max_tokens'],
+            variant=json.dumps(self.config.get('preprocessing', {}) or {}, sort_keys=True)
+        )
+
+    def offload(self, function, *args):
+        """
+        Runs a CPU-bound per-image step (a module-level function) in the
+        preprocess workers, or on the calling thread without them.
+        """
+        if self.preprocess_pool:
+            return self.preprocess_pool.run(function, *args)
+        return function(*args)
+
+    def build_request(self, image_path):
+        """
+        Preprocesses an image and builds the chat completion request for it.
+        Returns tuple of (request_body, payload) where payload is the
+        prepare_image result.
+        """
+        # Downscale and re-encode the image, then convert to base64
+        if self.preprocess_pool:
+            payload, timings = self.preprocess_pool.prepare(image_path)
+        else:
+            timings = {}
+            payload = prepare_image(image_path, self.config.get('preprocessing', {}) or {}, timings)
+        for step, seconds in timings.items():
+            self.metrics.observe(step, seconds)
+        request_body = {
+            "model": self.config['openai']['model'],
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "text", 
+                            "text": self.config['prompts']['evaluation_prompt']
+                        },
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": payload['data_url'],
+                                "detail": payload['detail']
+                            }
+                        }
+                    ]
+                }
+            ],
+            "max_tokens": self.config['openai']['max_tokens']
+        }
+        response_format = self.parser.response_format()
+        if response_format:
+            request_body["response_format"] = response_format
+        return request_body, payload
+
+    def hold_memory(self, image_paths):
+        """
+        Reserves the estimated memory for preparing and uploading images,
+        waiting while the memory budget is spent. A no-op context without
+        a memory budget; otherwise yields the Reservation.
+        """
+        if not self.memory:
+            return contextlib.nullcontext()
+        settings = self.config.get('preprocessing', {}) or {}
+        return self.memory.hold(sum(estimate_memory(image_path, settings) for image_path in image_paths))
+
+    def parse_response(self, response):
+        """
+        Parses the model's reply into a score and evaluation data with the
+        configured parser (parsing.mode).
+        Returns tuple of (score, evaluation_data); raises ValueError if no
+        characteristic scores could be found.
+        """
+        with self.metrics.time('parse'):
+            return self.parser.parse(response)
+
     def evaluate_image(self, image_path):
         """
         Evaluates an image using OpenAI's Vision API.
         Returns tuple of (score, evaluation_data, token_usage).
+        Cache hits return token_usage as None since no tokens were spent.
         """
         try:
-            # Convert image to base64
-            base64_image = get_image_base64(image_path)
-            
-            # Call the Vision API
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text", 
-                                "text": self.config['prompts']['evaluation_prompt']
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}",
-                                    "detail": "high"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=self.config['openai']['max_tokens']
-            )
+            # Check the cache before paying for an API call
+            cache_key = self.cache_key(image_path)
+            if cache_key:
+                with self.metrics.time('cache_lookup'):
+                    cached = self.cache.get(cache_key)
+                if cached:
+                    score, evaluation_data, _ = cached
+                    return score, evaluation_data, None
+        except Exception as e:
+            self.logger.error(f"Error evaluating image {image_path}: {str(e)}")
+            return None, str(e), None
+
+        return self._evaluate_uncached(image_path, cache_key)
+
+    def _evaluate_uncached(self, image_path, cache_key):
+        """Sends one image to the API and parses the reply."""
+        try:
+            with self.hold_memory([image_path]) as reservation:
+                request_body, payload = self.build_request(image_path)
+                if reservation:
+                    # Only the payload stays alive once the image is encoded
+                    reservation.shrink(payload['bytes_sent'] * UPLOAD_COPIES)
+
+                # Call the Vision API
+                with self.metrics.time('api'):
+                    response = self.scheduler.call(lambda: self.client.chat.completions.create(**request_body))
+                # Drop the payload before its reservation is released
+                del request_body, payload['data_url']
+            if self.budget:
+                self.budget.charge(response.usage.prompt_tokens, response.usage.completion_tokens)
             
             # Get token usage
             token_usage = {
                 'prompt_tokens': response.usage.prompt_tokens,
                 'completion_tokens': response.usage.completion_tokens,
-                'total_tokens': response.usage.total_tokens
+                'total_tokens': response.usage.total_tokens,
+                'image_tokens_saved': payload['tokens_saved']
             }
             
             # Extract and parse the response
-            response_text = response.choices[0].message.content.strip()
-            lines = [line.strip() for line in response_text.split('\n') if line.strip()]
-            
-            # Parse all components
-            evaluation_data = {}
-            
-            # Get description
-            description_line = next((line for line in lines if line.lower().startswith('description:')), None)
-            if description_line:
-                evaluation_data['description'] = description_line.split(':', 1)[1].strip()
-            
-            # Get individual scores
-            characteristics = [
-                'composition', 'color', 'lighting', 'subject', 'originality',
-                'technical skill', 'emotion', 'storytelling', 'clarity', 'creativity'
-            ]
-            
-            scores = []
-            for char in characteristics:
-                char_line = next((line for line in lines if line.lower().startswith(f'{char}:')), None)
-                if char_line:
-                    try:
-                        score = int(''.join(filter(str.isdigit, char_line.split(':', 1)[1])))
-                        evaluation_data[char] = score
-                        scores.append(score)
-                    except ValueError:
-                        evaluation_data[char] = 0
-            
-            # Get final analysis
-            reason_line = next((line for line in lines if line.lower().startswith('reason:')), None)
-            if reason_line:
-                evaluation_data['final_analysis'] = reason_line.split(':', 1)[1].strip()
-            
-            if scores:
-                # Calculate final score (1-100)
-                final_score = (sum(scores) * 10) // len(scores)
-                final_score = max(1, min(100, final_score))
-                return final_score, evaluation_data, token_usage
-            
-            raise ValueError("Could not parse scores from response")
+            score, evaluation_data = self.parse_response(response.choices[0].message.content)
+            if cache_key:
+                self.cache.put(cache_key, score, evaluation_data, token_usage)
+            return score, evaluation_data, token_usage
             
         except Exception as e:
             self.logger.error(f"Error evaluating image {image_path}: {str(e)}")
             return None, str(e), None
 
-    def process_directory(self, directory_path, recursive=False):
+    def evaluate_images(self, image_paths):
+        """
+        Evaluates several images with as few API calls as possible by packing
+        the ones not in the cache into a single multi-image request. Images
+        whose section of the reply is missing or malformed are re-sent on
+        their own.
+        Returns a list of (score, evaluation_data, token_usage) in input order.
+        """
+        if len(image_paths) == 1:
+            return [self.evaluate_image(image_paths[0])]
+
+        results = [None] * len(image_paths)
+        pending = []
+        for index, image_path in enumerate(image_paths):
+            try:
+                cache_key = self.cache_key(image_path)
+                with self.metrics.time('cache_lookup'):
+                    cached = self.cache.get(cache_key) if cache_key else None
+            except Exception as e:
+                self.logger.error(f"Error evaluating image {image_path}: {str(e)}")
+                results[index] = (None, str(e), None)
+                continue
+            if cached:
+                score, evaluation_data, _ = cached
+                results[index] = (score, evaluation_data, None)
+            else:
+                pending.append((index, image_path, cache_key))
+        self._evaluate_pending(pending, results)
+        return results
+
+    def _evaluate_pending(self, pending, results):
+        """
+        Sends images to the API, packing several into one request, and
+        stores each result at its index in `results`. `pending` holds
+        (index, image_path, cache_key) tuples; results are cached under
+        the keys that are not None.
+        """
+        if len(pending) == 1:
+            index, image_path, cache_key = pending[0]
+            results[index] = self._evaluate_uncached(image_path, cache_key)
+        elif pending:
+            sections, token_usage = self._request_multi([image_path for _, image_path, _ in pending])
+            for position, (index, image_path, cache_key) in enumerate(pending):
+                section = sections.get(position + 1)
+                try:
+                    if section is None:
+                        raise ValueError("Section missing from multi-image reply")
+                    score, evaluation_data = self.parse_response(section)
+                except ValueError as e:
+                    self.logger.warning(f"Re-sending {image_path} on its own: {str(e)}")
+                    results[index] = self._evaluate_uncached(image_path, cache_key)
+                    continue
+                usage = dict(token_usage[position])
+                if cache_key:
+                    self.cache.put(cache_key, score, evaluation_data, usage)
+                results[index] = (score, evaluation_data, usage)
+
+    def _request_multi(self, image_paths):
+        """
+        Sends several images in one chat completion.
+        Returns tuple of (sections, token_usage) where sections maps each
+        1-based image label to its slice of the reply and token_usage holds
+        each image's even share of the request's tokens. A failed request
+        returns no sections, so every image is re-sent on its own.
+        """
+        count = len(image_paths)
+        empty_usage = [{'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}] * count
+        try:
+            prompt_template = self.config['prompts'].get('multi_image_prompt') or DEFAULT_MULTI_IMAGE_PROMPT
+            content = [{
+                "type": "text",
+                "text": prompt_template.format(count=count) + "\n\n"
+                        + self.config['prompts']['evaluation_prompt']
+            }]
+            tokens_saved = []
+            with self.hold_memory(image_paths) as reservation:
+                bytes_sent = 0
+                for number, image_path in enumerate(image_paths, 1):
+                    request_body, payload = self.build_request(image_path)
+                    tokens_saved.append(payload['tokens_saved'])
+                    bytes_sent += payload['bytes_sent']
+                    content.append({"type": "text", "text": f"Image {number}:"})
+                    content.append(request_body['messages'][0]['content'][1])
+                if reservation:
+                    reservation.shrink(bytes_sent * UPLOAD_COPIES)
+
+                request_body = {
+                    "model": self.config['openai']['model'],
+                    "messages": [{"role": "user", "content": content}],
+                    "max_tokens": self.config['openai']['max_tokens'] * count
+                }
+                response_format = self.parser.response_format(count)
+                if response_format:
+                    request_body["response_format"] = response_format
+                with self.metrics.time('api'):
+                    response = self.scheduler.call(lambda: self.client.chat.completions.create(**request_body))
+                # Drop the payloads before their reservation is released
+                del request_body, content
+        except Exception as e:
+            self.logger.error(f"Multi-image request failed: {str(e)}")
+            return {}, empty_usage
+        if self.budget:
+            self.budget.charge(response.usage.prompt_tokens, response.usage.completion_tokens, images=count)
+
+        # Split the request's tokens evenly, giving any remainder to the first images
+        token_usage = []
+        for position in range(count):
+            share = {}
+            for key in ('prompt_tokens', 'completion_tokens'):
+                total = getattr(response.usage, key)
+                share[key] = total // count + (1 if position < total % count else 0)
+            share['total_tokens'] = share['prompt_tokens'] + share['completion_tokens']
+            share['image_tokens_saved'] = tokens_saved[position]
+            share['images_in_request'] = count
+            token_usage.append(share)
+
+        sections = self.parser.split(response.choices[0].message.content or '', count)
+        return sections, token_usage
+
+    def _folder_name(self, score):
+        """Returns the score folder for a score, processing.bucket_interval points wide."""
+        processing = self.config.get('processing', {}) or {}
+        return determine_folder(score, processing.get('bucket_interval', 3))
+
+    def _destination_path(self, file_path, score):
+        """Returns the output path an image with this score is moved to."""
+        return os.path.join(
+            self.config['directories']['output'],
+            self._folder_name(score),
+            Path(file_path).name
+        )
+
+    def _journaled_result(self, file_path):
+        """Returns the result a previous run journaled for an image, or None."""
+        entry = self.journal.get(os.path.abspath(file_path))
+        if entry and entry['state'] == EVALUATED and entry['score']:
+            return entry['score'], entry['evaluation_data'], None
+        return None
+
+    def _record_result(self, file_path, result):
+        """Commits an evaluation result to the journal before it is acted on."""
+        score, evaluation_data, token_usage = result
+        destination = self._destination_path(file_path, score) if score else None
+        self.journal.record_evaluated(
+            os.path.abspath(file_path), score, evaluation_data, token_usage, destination
+        )
+
+    def _settle(self, file_path, resume, stages):
+        """
+        Creates the pipeline entry for an image and tries to settle it
+        without the API: from the journal when resuming, then through
+        `stages` until one returns a result or defers the image.
+        """
+        entry = {'path': file_path, 'result': None, 'status': None, 'sent': False, 'duplicate_of': None}
+        if self.journal and resume:
+            entry['result'] = self._journaled_result(file_path)
+            if entry['result'] is not None:
+                entry['status'] = 'journal'
+                return entry
+        for stage in stages:
+            try:
+                with self.metrics.time(stage.name):
+                    result = stage.lookup(entry)
+            except Exception as e:
+                self.logger.error(f"Error evaluating image {file_path}: {str(e)}")
+                entry['result'] = (None, str(e), None)
+                break
+            if result is not None:
+                entry['result'], entry['status'] = result, stage.status
+                break
+            if entry.get('deferred'):
+                break
+        return entry
+
+    def evaluate_chunk(self, file_paths, resume=False):
+        """
+        Runs a group of images through the pipeline: journaled results when
+        resuming, then the stages in pipeline.stages (local prefilter,
+        near-duplicates, cache, score prediction and any plugins), and
+        finally the API, with every image left over packed into one request.
+        Results are committed to the journal before they are returned.
+        Returns a list of (result, details) in input order.
+        """
+        start = time.perf_counter()
+        # Let stages work on the whole chunk at once
+        for file_path in file_paths:
+            for stage in self.stages:
+                stage.prefetch(file_path)
+        entries = [self._settle(file_path, resume, self.stages) for file_path in file_paths]
+
+        to_send = [entry for entry in entries if entry['result'] is None and not entry.get('deferred')]
+        try:
+            if to_send:
+                results = [None] * len(to_send)
+                self._evaluate_pending(
+                    [(index, entry['path'], entry.get('cache_key')) for index, entry in enumerate(to_send)],
+                    results
+                )
+                for entry, result in zip(to_send, results):
+                    entry['result'], entry['sent'] = result, True
+        finally:
+            # Stages always see the chunk, so deferred images are released
+            for stage in self.stages:
+                stage.complete(entries)
+
+        for entry in entries:
+            if self.journal and entry['status'] != 'journal':
+                with self.metrics.time('journal'):
+                    self._record_result(entry['path'], entry['result'])
+
+        latency = time.perf_counter() - start
+        self.metrics.observe('chunk', latency)
+        return [
+            (entry['result'], {
+                'latency': latency,
+                'cache_status': entry['status'] or self._cache_status(entry['result']),
+                'duplicate_of': entry['duplicate_of']
+            })
+            for entry in entries
+        ]
+
+    def _cache_status(self, result):
+        """
+        Describes where a result no stage settled came from, for the
+        evaluation log; settled results carry their stage's status.
+        """
+        score, evaluation_data, token_usage = result
+        if not self.cache:
+            return 'disabled'
+        return 'hit' if score and token_usage is None else 'miss'
+
+    def sort_image(self, file_path, result, details):
+        """
+        Moves a scored image into its score folder and logs the evaluation.
+        In score-only mode the move is written to the manifest instead.
+        `details` is the dict evaluate_chunk returns alongside the result.
+        Returns the folder name the image was (or will be) moved to, or None
+        if it was not scored and stays where it is.
+        """
+        score, evaluation_data, token_usage = result
+        file_path = Path(file_path)
+        source = os.path.abspath(file_path)
+        destination_path = None
+        folder_name = None
+        if score:
+            # Create folder and move file immediately
+            folder_name = self._folder_name(score)
+            destination_path = self._destination_path(file_path, score)
+            if self.manifest:
+                self.manifest.add(source, destination_path, score)
+            else:
+                with self.metrics.time('move'):
+                    os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+
+                    # Move the file; copies across filesystems
+                    move_file(file_path, destination_path, overwrite=True)
+                if self.journal:
+                    self.journal.record_moved(source)
+
+        # Log the evaluation
+        with self.metrics.time('log'):
+            self.evaluation_log.write(make_record(
+                file_path.name, score, evaluation_data,
+                source=source, destination=destination_path, token_usage=token_usage,
+                latency=details.get('latency'), cache_status=details.get('cache_status'),
+                duplicate_of=details.get('duplicate_of')
+            ))
+
+        self.metrics.count('images_processed')
+        self.metrics.count('images_scored' if score else 'images_failed')
+        if details.get('cache_status'):
+            self.metrics.count(f"cache_{details['cache_status']}")
+        for key in ('prompt_tokens', 'completion_tokens'):
+            if token_usage and token_usage.get(key):
+                self.metrics.count(key, token_usage[key])
+        return folder_name
+
+    def _log_flushed(self, records):
+        if self.score_index:
+            with self.metrics.time('score_index'):
+                # Score-only runs leave images at their source until the manifest is applied
+                self.score_index.add_records(records, moved=not self.manifest)
+        if self.journal:
+            self.journal.record_logged_many([record['source'] for record in records if record['source']])
+
+    def close(self):
+        """Flushes the evaluation log and closes the cache and journal."""
+        self.evaluation_log.close()
+        if self.cache:
+            self.cache.close()
+        if self.journal:
+            self.journal.close()
+        if self.score_index:
+            self.score_index.close()
+        if self.dedup:
+            self.dedup.close()
+        if self.embeddings:
+            self.embeddings.close()
+        for stage in self.stages:
+            stage.close()
+        if self.prefilter:
+            self.prefilter.close()
+        if self.manifest:
+            self.manifest.close()
+        if self.budget:
+            self.budget.close()
+        if self.preprocess_pool:
+            self.preprocess_pool.close()
+        self.metrics.write()
+        self.metrics.close()
+        self.http_client.close()
+
+    def _recover_journal(self, root):
+        """
+        Finishes images a previous run scored but did not complete: moves
+        that happened without being journaled and log entries never written.
+        Images still at their source are picked up again by the scan.
+        Returns the set of output folders touched.
+        """
+        folders = set()
+        for entry in self.journal.unfinished(root):
+            source = entry['source']
+            destination = entry['destination']
+            if entry['state'] == EVALUATED:
+                if not entry['score'] or os.path.exists(source):
+                    continue
+                if not (destination and os.path.exists(destination)):
+                    self.logger.warning(f"Journaled image {source} is missing, skipping")
+                    continue
+                self.journal.record_moved(source)
+
+            if entry['score']:
+                folders.add(self._folder_name(entry['score']))
+            self.evaluation_log.write(make_record(
+                os.path.basename(source), entry['score'], entry['evaluation_data'],
+                source=source, destination=destination if entry['score'] else None,
+                token_usage=entry['token_usage'], cache_status='journal'
+            ))
+            print(f"Recovered {os.path.basename(source)} from journal")
+        self.evaluation_log.flush()
+        return folders
+
+    def _prefetched(self, file_paths, lookahead):
+        """Yields `file_paths`, handing each to the stages' prefetch() `lookahead` images early."""
+        window = deque()
+        for file_path in file_paths:
+            for stage in self.stages:
+                stage.prefetch(file_path)
+            window.append(file_path)
+            if len(window) > lookahead:
+                yield window.popleft()
+        yield from window
+
+    def _start_forecast(self, images, sample, batch):
+        """
+        Prices the sampled images right away, so budget reservations have an
+        estimate, and prints the forecast for the whole run once the scanner
+        has counted the tree. The count is waited for on a separate thread,
+        so evaluation starts while the scan is still running.
+        Returns the thread, or None if the count was already known.
+        """
+        forecast = self.budget.forecast(sample, images.found, self.config, batch=batch)
+
+        def report():
+            print(format_forecast(scale_forecast(forecast, images.wait())))
+
+        if images.done:
+            report()
+            return None
+        thread = threading.Thread(target=report, name='forecast', daemon=True)
+        thread.start()
+        return thread
+
+    def process_directory(self, directory_path, recursive=False, concurrency=None, resume=False,
+                          batch=None):
         """
         Process all images in a directory.
+
+        Up to `concurrency` requests are in flight at once on a thread pool
+        (default: processing.concurrency from the config), each carrying up to
+        processing.images_per_request images. Results are handled on the
+        calling thread in discovery order, so moves, logs and token totals are
+        identical to a serial run.
+
+        With `resume`, a run over the same directory continues from the job
+        journal instead of starting over. With `batch` (default: batch.enabled
+        from the config) requests go through the OpenAI Batch API instead.
+        """
+        # Images are fed to the pipeline while the scanner keeps counting
+        scanner = ImageScanner.from_config(directory_path, self.config, recursive=recursive).start()
+        return self.process_images(scanner, directory_path, concurrency=concurrency,
+                                   resume=resume, batch=batch)
+
+    def process_files(self, file_paths, concurrency=None, resume=False, batch=None):
+        """
+        Process a list of image files through the same pipeline as
+        process_directory. The journal tracks them under their closest
+        common parent directory.
+        """
+        file_paths = [Path(file_path) for file_path in file_paths]
+        if not file_paths:
+            return
+        root = os.path.commonpath([os.path.abspath(file_path.parent) for file_path in file_paths])
+        return self.process_images(ImageList(file_paths), root, concurrency=concurrency,
+                                   resume=resume, batch=batch)
+
+    def process_images(self, images, root, concurrency=None, resume=False, batch=None):
+        """
+        Evaluates, sorts and logs the images yielded by `images`, an
+        ImageScanner or ImageList, with journal entries kept under `root`.
+        See process_directory for the concurrency, resume and batch options.
+        Returns a summary dict with the processed and failed image counts,
+        token totals and created folders.
         """
-        valid_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'}
         created_folders = set()
+
+        processing = self.config.get('processing', {}) or {}
+        if concurrency is None:
+            concurrency = processing.get('concurrency', 1)
+        concurrency = max(1, int(concurrency))
+        self.scheduler.resize(concurrency)
+        if batch is None:
+            batch = (self.config.get('batch', {}) or {}).get('enabled', False)
+        images_per_request = max(1, int(processing.get('images_per_request', 1)))
+
+        root = os.path.abspath(root)
+        if self.journal:
+            self.journal.start(root, resume=resume)
+            if resume:
+                created_folders.update(self._recover_journal(root))
         
         total_tokens = {
             'prompt_tokens': 0,
             'completion_tokens': 0,
             'total_tokens': 0
         }
+        image_tokens_saved = 0
         
-        def is_valid_image(path):
-            return path.is_file() and path.suffix.lower() in valid_extensions
-
-        # Count total images
-        total_images = 0
-        if recursive:
-            for root, _, files in os.walk(directory_path):
-                total_images += sum(1 for f in files if is_valid_image(Path(root) / f))
-        else:
-            total_images = sum(1 for item in Path(directory_path).iterdir() if is_valid_image(item))
-
         processed_images = 0
-        print(f"\nStarting to process {total_images} images...")
+        failed_images = 0
+        budget_stopped = False
+        run_cost_before = self.budget.run['cost_usd'] if self.budget else 0.0
+        print(f"\nStarting to process images in {root}...")
+        if batch:
+            print("Submitting images through the Batch API")
+        elif concurrency > 1:
+            print(f"Evaluating up to {concurrency} images concurrently")
+        if not batch and images_per_request > 1:
+            print(f"Packing up to {images_per_request} images into each request")
+        image_stream = iter(images)
+        forecast_thread = None
+        if self.budget and self.budget.forecast_sample:
+            sample = list(itertools.islice(image_stream, self.budget.forecast_sample))
+            image_stream = itertools.chain(sample, image_stream)
+            forecast_thread = self._start_forecast(images, sample, batch)
+        lookahead = max([stage.lookahead for stage in self.stages], default=0)
+        if lookahead:
+            image_stream = self._prefetched(image_stream, lookahead)
         print("=" * 50)
 
-        def process_image(file_path):
-            nonlocal processed_images, total_tokens
+        def process_image(file_path, result, details):
+            nonlocal processed_images, failed_images, total_tokens, image_tokens_saved
             processed_images += 1
-            print(f"\nProcessing image {processed_images}/{total_images}: {file_path.name}")
+            if self.budget:
+                self.budget.release()
+            print(f"\nProcessing image {processed_images}/{images.progress()}: {file_path.name}")
             
-            score, reason, token_usage = self.evaluate_image(file_path)
+            score, reason, token_usage = result
             
             if token_usage:
                 # Update and display token usage
@@ -159,50 +752,177 @@ class ImageEvaluator:
                 print(f"  Prompt tokens: {token_usage['prompt_tokens']}")
                 print(f"  Completion tokens: {token_usage['completion_tokens']}")
                 print(f"  Total tokens: {token_usage['total_tokens']}")
+                saved = token_usage.get('image_tokens_saved', 0)
+                image_tokens_saved += saved
+                if saved:
+                    print(f"  Image tokens saved by preprocessing: ~{saved}")
                 print(f"\nRunning totals after {processed_images} images:")
                 print(f"  Total prompt tokens: {total_tokens['prompt_tokens']}")
                 print(f"  Total completion tokens: {total_tokens['completion_tokens']}")
                 print(f"  Accumulated total tokens: {total_tokens['total_tokens']}")
+                if self.budget:
+                    print(f"  Estimated cost: {format_usd(self.budget.run['cost_usd'] - run_cost_before)}")
                 print("-" * 50)
             
-            if score:
-                # Create folder and move file immediately
-                folder_name = determine_folder(score)
+            folder_name = self.sort_image(file_path, result, details)
+            if folder_name:
                 created_folders.add(folder_name)
-                destination_folder = os.path.join(self.config['directories']['output'], folder_name)
-                os.makedirs(destination_folder, exist_ok=True)
-                
-                # Move the file
-                destination_path = os.path.join(destination_folder, file_path.name)
-                os.rename(file_path, destination_path)
-                
-                # Log the evaluation
-                log_evaluation(file_path.name, score, reason, self.config)
                 print(f"Evaluated {file_path.name} with score {score}")
-                print(f"Moved {file_path.name} to {folder_name}")
+                if self.manifest:
+                    print(f"Planned move of {file_path.name} to {folder_name}")
+                else:
+                    print(f"Moved {file_path.name} to {folder_name}")
             else:
-                log_evaluation(file_path.name, "N/A", reason, self.config)
+                failed_images += 1
                 print(f"Failed to evaluate {file_path.name}: {reason}")
 
+        def discover_images():
+            nonlocal budget_stopped
+            for file_path in image_stream:
+                # Stop handing out images once the budget cannot cover them
+                if self.budget and not self.budget.reserve(batch=batch):
+                    budget_stopped = True
+                    break
+                if self.journal:
+                    self.journal.discover(root, os.path.abspath(file_path))
+                yield file_path
+
+        def discover_chunks():
+            chunk = []
+            for file_path in discover_images():
+                chunk.append(file_path)
+                if len(chunk) >= images_per_request:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
         # Process images
-        if recursive:
-            for root, _, files in os.walk(directory_path):
-                for file in files:
-                    file_path = Path(root) / file
-                    if is_valid_image(file_path):
-                        process_image(file_path)
+        if batch:
+            batch_stages = [stage for stage in self.stages if stage.batch]
+            batch_entries = {}
+
+            def lookup(file_path):
+                entry = self._settle(file_path, resume, batch_stages)
+                batch_entries[file_path] = entry
+                return entry['result']
+
+            for file_path, result in BatchRunner(self).evaluate(discover_images(), lookup=lookup):
+                entry = batch_entries.pop(file_path)
+                if entry['result'] is None:
+                    # Answered by the batch, or by the cache without token usage
+                    entry['result'], entry['sent'] = result, result[2] is not None
+                for stage in batch_stages:
+                    stage.complete([entry])
+                if self.journal and entry['status'] != 'journal':
+                    self._record_result(file_path, result)
+                process_image(file_path, result, {
+                    'latency': None,
+                    'cache_status': entry['status'] or self._cache_status(result)
+                })
+        elif concurrency == 1:
+            for chunk in discover_chunks():
+                for file_path, outcome in zip(chunk, self.evaluate_chunk(chunk, resume)):
+                    process_image(file_path, *outcome)
         else:
-            for item in Path(directory_path).iterdir():
-                if is_valid_image(item):
-                    process_image(item)
+            # Keep at most `concurrency` requests in flight and hand results
+            # back in submission order; only this thread touches files and totals
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                pending = deque()
+                for chunk in discover_chunks():
+                    pending.append((chunk, executor.submit(self.evaluate_chunk, chunk, resume)))
+                    if len(pending) >= concurrency:
+                        done_chunk, future = pending.popleft()
+                        for file_path, outcome in zip(done_chunk, future.result()):
+                            process_image(file_path, *outcome)
+                while pending:
+                    done_chunk, future = pending.popleft()
+                    for file_path, outcome in zip(done_chunk, future.result()):
+                        process_image(file_path, *outcome)
+        self.evaluation_log.flush()
+        if forecast_thread and images.done:
+            forecast_thread.join()
 
         # Display final summary
         print("\nFinal token usage summary:")
         print("=" * 50)
-        print(f"Total images processed: {processed_images}")
+        print(f"Total images processed: {processed_images}/{images.progress()}")
         print(f"Total prompt tokens: {total_tokens['prompt_tokens']}")
         print(f"Total completion tokens: {total_tokens['completion_tokens']}")
         print(f"Total tokens used: {total_tokens['total_tokens']}")
         if processed_images > 0:
             print(f"Average tokens per image: {total_tokens['total_tokens'] / processed_images:.2f}")
-        print("\nCreated folders:", sorted(created_folders)) 
\ No newline at end of file
+        print(f"Estimated image tokens saved by preprocessing: {image_tokens_saved}")
+        stats = self.scheduler.stats
+        print(f"API requests: {stats['requests']} "
+              f"(retries: {stats['retries']}, rate limited: {stats['rate_limited']}, "
+              f"server errors: {stats['server_errors']}, failed: {stats['failed']})")
+        transport = self.transport_stats.summary()
+        if transport['requests']:
+            phases = ", ".join(
+                f"{phase} {transport[phase]['mean_ms']:.0f}/{transport[phase]['p95_ms']:.0f} ms"
+                for phase in ('connect', 'upload', 'ttfb', 'total') if phase in transport
+            )
+            print(f"HTTP: {transport['requests']} requests over {transport['connections']} new connections; "
+                  f"mean/p95 {phases}")
+            if transport['bytes_saved']:
+                print(f"Request compression saved {transport['bytes_saved'] / 1e6:.1f} MB "
+                      f"of {(transport['bytes_sent'] + transport['bytes_saved']) / 1e6:.1f} MB")
+        if self.budget:
+            budget = self.budget.summary()
+            period = budget['period_total']
+            limit = f" of {format_usd(budget['hard_limit_usd'])}" if budget['hard_limit_usd'] is not None else ""
+            print(f"Estimated cost: {format_usd(self.budget.run['cost_usd'] - run_cost_before)} this run; "
+                  f"{format_usd(period['cost_usd'])}{limit} spent in {budget['period']}")
+            if budget_stopped:
+                remaining = images.wait() - processed_images
+                self.budget.record_stop(root, remaining)
+                print(f"Stopped by the budget ({self.budget.blocked}) with {remaining} images left; "
+                      f"run again{' with --resume' if self.journal else ''} to continue")
+            else:
+                self.budget.flush()
+        if self.cache:
+            self.cache.evict()
+            cache_stats = self.cache.stats
+            print(f"Cache hits: {cache_stats['hits']}, misses: {cache_stats['misses']} "
+                  f"(tokens saved: {cache_stats['tokens_saved']})")
+        if self.prefilter:
+            prefilter_stats = self.prefilter.stats
+            print(f"Prefiltered without an API call: {prefilter_stats['rejected']} "
+                  f"of {prefilter_stats['checked']} checked")
+        if self.dedup:
+            dedup_stats = self.dedup.stats
+            print(f"Near-duplicates reusing a score: {dedup_stats['duplicates'] + dedup_stats['known']} "
+                  f"({dedup_stats['known']} matched earlier runs, "
+                  f"{dedup_stats['representatives']} new representatives)")
+        if self.embeddings:
+            embedding_stats = self.embeddings.stats
+            print(f"Scores predicted from similar images: {embedding_stats['predicted']} "
+                  f"of {embedding_stats['lookups']} looked up "
+                  f"({embedding_stats['added']} added; {self.embeddings.size} images indexed)")
+        if self.journal:
+            counts = self.journal.counts(root)
+            print("Journal: " + ", ".join(f"{state}: {count}" for state, count in sorted(counts.items())))
+        self.metrics.write()
+        stages = self.metrics.report()['stages']
+        slowest = sorted(stages.items(), key=lambda item: item[1]['sum_s'], reverse=True)[:4]
+        if slowest:
+            print("Stage time (total, p95): " + ", ".join(
+                f"{stage} {summary['sum_s']:.1f}s/{summary['p95_ms']:.0f}ms" for stage, summary in slowest
+            ))
+        if self.metrics.report_file:
+            print(f"Run report: {self.metrics.report_file}")
+        if self.manifest:
+            self.manifest.flush()
+            print(f"Score-only run: {self.manifest.entries} moves written to {self.manifest.path}")
+            print("\nPlanned folders:", sorted(created_folders))
+        else:
+            print("\nCreated folders:", sorted(created_folders))
+        return {
+            'processed': processed_images,
+            'failed': failed_images,
+            'tokens': total_tokens,
+            'cost_usd': self.budget.run['cost_usd'] - run_cost_before if self.budget else None,
+            'budget_stopped': budget_stopped,
+            'created_folders': sorted(created_folders)
+        }
\ No newline at end of file
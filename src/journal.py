@@ -0,0 +1,162 @@
+"""
+Write-ahead job journal that makes directory runs resumable.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DISCOVERED = 'discovered'
+EVALUATED = 'evaluated'
+MOVED = 'moved'
+LOGGED = 'logged'
+
+
+class JobJournal:
+    """
+    Records each image's progress through a run:
+    discovered -> evaluated -> moved -> logged.
+
+    The evaluation result and intended destination are committed before the
+    file is moved, so a run that dies at any point can be resumed without
+    re-calling the API for images that were already scored.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                source TEXT PRIMARY KEY,
+                root TEXT NOT NULL,
+                state TEXT NOT NULL,
+                score INTEGER,
+                evaluation_data TEXT,
+                token_usage TEXT,
+                destination TEXT,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_root_state ON jobs (root, state)")
+        self._conn.commit()
+
+    @classmethod
+    def from_config(cls, config):
+        """Opens the journal described by the config, or returns None if disabled."""
+        journal_config = config.get('journal', {}) or {}
+        if not journal_config.get('enabled', True):
+            return None
+        db_path = os.path.join(
+            config['directories']['logs'],
+            journal_config.get('file', 'job_journal.sqlite')
+        )
+        return cls(db_path)
+
+    def start(self, root, resume=False):
+        """Begins a run over `root`; a fresh run forgets earlier entries for it."""
+        if not resume:
+            with self._lock:
+                self._conn.execute("DELETE FROM jobs WHERE root = ?", (str(root),))
+                self._conn.commit()
+
+    def discover(self, root, source):
+        """
+        Records a newly found image unless the journal already knows it
+        under `root`. An entry left by a run over another root is started
+        afresh, so each image belongs to the last run that found it.
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (source, root, state, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (source) DO UPDATE SET root = excluded.root, state = excluded.state, "
+                "score = NULL, evaluation_data = NULL, token_usage = NULL, destination = NULL, "
+                "updated_at = excluded.updated_at WHERE jobs.root != excluded.root",
+                (str(source), str(root), DISCOVERED, time.time())
+            )
+            self._conn.commit()
+
+    def get(self, source):
+        """
+        Returns the journal entry for `source` as a dict, or None.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT source, state, score, evaluation_data, token_usage, destination "
+                "FROM jobs WHERE source = ?",
+                (str(source),)
+            ).fetchone()
+        return self._to_entry(row) if row else None
+
+    def record_evaluated(self, source, score, evaluation_data, token_usage, destination):
+        """Commits an evaluation result before any file is touched."""
+        self._set(
+            source, EVALUATED,
+            score=score,
+            evaluation_data=json.dumps(evaluation_data),
+            token_usage=json.dumps(token_usage) if token_usage else None,
+            destination=str(destination) if destination else None
+        )
+
+    def record_moved(self, source):
+        self._set(source, MOVED)
+
+    def record_logged(self, source):
+        self._set(source, LOGGED)
+
+    def record_logged_many(self, sources):
+        """Marks a batch of images logged in one transaction."""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE jobs SET state = ?, updated_at = ? WHERE source = ?",
+                [(LOGGED, now, str(source)) for source in sources]
+            )
+            self._conn.commit()
+
+    def unfinished(self, root):
+        """Returns entries under `root` that were scored but not yet logged."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT source, state, score, evaluation_data, token_usage, destination "
+                "FROM jobs WHERE root = ? AND state IN (?, ?) ORDER BY source",
+                (str(root), EVALUATED, MOVED)
+            ).fetchall()
+        return [self._to_entry(row) for row in rows]
+
+    def counts(self, root):
+        """Returns a dict of state -> number of images under `root`."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT state, COUNT(*) FROM jobs WHERE root = ? GROUP BY state", (str(root),)
+            ).fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _set(self, source, state, **fields):
+        columns = ['state = ?', 'updated_at = ?'] + [f"{name} = ?" for name in fields]
+        values = [state, time.time()] + list(fields.values()) + [str(source)]
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {', '.join(columns)} WHERE source = ?", values)
+            self._conn.commit()
+
+    @staticmethod
+    def _to_entry(row):
+        source, state, score, evaluation_data, token_usage, destination = row
+        return {
+            'source': source,
+            'state': state,
+            'score': score,
+            'evaluation_data': json.loads(evaluation_data) if evaluation_data else None,
+            'token_usage': json.loads(token_usage) if token_usage else None,
+            'destination': destination
+        }
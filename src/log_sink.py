@@ -0,0 +1,241 @@
+"""
+Buffered, structured evaluation log with JSONL, Parquet and Arrow IPC output.
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from file_handler import CHARACTERISTICS, format_evaluation
+
+try:
+    import fcntl
+except ImportError:  # Windows: rely on the in-process lock only
+    fcntl = None
+
+CHARACTERISTIC_FIELDS = [char.lower().replace(' ', '_') for char in CHARACTERISTICS]
+
+COLUMNAR_EXTENSIONS = {'parquet': '.parquet', 'arrow': '.arrow'}
+
+
+def make_record(image_name, score, evaluation_data, source=None, destination=None,
+                token_usage=None, latency=None, cache_status=None, status=None,
+                duplicate_of=None):
+    """
+    Builds a flat log record. Characteristic scores get one field each so
+    the columnar formats can filter on them directly.
+    """
+    evaluation = evaluation_data if isinstance(evaluation_data, dict) else {}
+    if status is None and evaluation.get('prefiltered'):
+        status = 'prefiltered'
+    if status is None and evaluation.get('predicted'):
+        status = 'predicted'
+    token_usage = token_usage or {}
+    record = {
+        'timestamp': datetime.now().isoformat(timespec='milliseconds'),
+        'image': image_name,
+        'source': str(source) if source else None,
+        'destination': str(destination) if destination else None,
+        'status': status or ('scored' if isinstance(score, int) else 'failed'),
+        'score': score if isinstance(score, int) else None,
+        'description': evaluation.get('description'),
+        'final_analysis': evaluation.get('final_analysis'),
+        'error': None if isinstance(evaluation_data, dict) else str(evaluation_data),
+        'prompt_tokens': token_usage.get('prompt_tokens'),
+        'completion_tokens': token_usage.get('completion_tokens'),
+        'total_tokens': token_usage.get('total_tokens'),
+        'latency_ms': round(latency * 1000, 1) if latency is not None else None,
+        'cache_status': cache_status,
+        'duplicate_of': str(duplicate_of) if duplicate_of else None
+    }
+    for char, field in zip(CHARACTERISTICS, CHARACTERISTIC_FIELDS):
+        record[field] = evaluation.get(char.lower())
+    return record
+
+
+class EvaluationLog:
+    """
+    Collects evaluation records and writes them in batches through long-lived
+    file handles.
+
+    The structured output is JSONL (appended under an exclusive file lock, so
+    several processes can share one file) or, with pyarrow installed, Parquet
+    or Arrow IPC (one part file per process, written a batch at a time). The
+    original text format can be rendered alongside. Buffers are flushed every
+    `flush_every` records, on close and, from a background thread, once
+    records have waited `flush_interval` seconds, so an idle daemon's last
+    records reach disk too. `on_flush(records)` is called once a batch is
+    on disk.
+    """
+
+    def __init__(self, log_dir, structured_format='jsonl', structured_file='evaluation_log.jsonl',
+                 text_file=None, flush_every=100, flush_interval=5.0, on_flush=None):
+        self.log_dir = log_dir
+        self.on_flush = on_flush
+        self.structured_format = (structured_format or 'none').lower()
+        self.flush_every = max(1, flush_every)
+        self.flush_interval = flush_interval
+        os.makedirs(log_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._records = []
+        self._last_flush = time.monotonic()
+        self._structured = None
+        self._text = None
+        self._writer = None
+
+        if self.structured_format == 'jsonl':
+            self._structured = open(os.path.join(log_dir, structured_file), 'a', encoding='utf-8')
+        elif self.structured_format in COLUMNAR_EXTENSIONS:
+            stem = os.path.splitext(structured_file)[0]
+            part = f"{stem}-{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}"
+            self.structured_path = os.path.join(
+                log_dir, part + COLUMNAR_EXTENSIONS[self.structured_format]
+            )
+        elif self.structured_format != 'none':
+            raise ValueError(f"Unknown structured log format: {structured_format}")
+
+        if text_file:
+            self._text = open(os.path.join(log_dir, text_file), 'a', encoding='utf-8')
+
+        self._closed = threading.Event()
+        self._timer = None
+        if flush_interval:
+            self._timer = threading.Thread(target=self._flush_periodically, daemon=True)
+            self._timer.start()
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds the log from the logging section of the config."""
+        logging_config = config.get('logging', {}) or {}
+        structured = logging_config.get('structured', {}) or {}
+        return cls(
+            config['directories']['logs'],
+            structured_format=structured.get('format', 'jsonl'),
+            structured_file=structured.get('file', 'evaluation_log.jsonl'),
+            text_file=logging_config.get('file') if logging_config.get('text_log', True) else None,
+            flush_every=structured.get('flush_every', 100),
+            flush_interval=structured.get('flush_interval', 5.0)
+        )
+
+    def write(self, record):
+        """Buffers a record from make_record, flushing when the batch is due."""
+        with self._lock:
+            self._records.append(record)
+            due = (
+                len(self._records) >= self.flush_every
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            )
+            if due:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        self._closed.set()
+        if self._timer:
+            self._timer.join()
+        with self._lock:
+            self._flush_locked()
+            for handle in (self._structured, self._text):
+                if handle:
+                    handle.close()
+            if self._writer:
+                self._writer.close()
+            self._structured = self._text = self._writer = None
+
+    def _flush_periodically(self):
+        wait = self.flush_interval
+        while not self._closed.wait(wait):
+            with self._lock:
+                waited = time.monotonic() - self._last_flush
+                if waited >= self.flush_interval:
+                    try:
+                        self._flush_locked()
+                    except Exception as e:
+                        print(f"Could not write the evaluation log: {e}")
+                    waited = 0.0
+            wait = self.flush_interval - waited
+
+    def _flush_locked(self):
+        records, self._records = self._records, []
+        self._last_flush = time.monotonic()
+        if not records:
+            return
+
+        if self._text:
+            self._append(self._text, ''.join(
+                format_evaluation(
+                    record['image'],
+                    record['score'] if record['score'] is not None else "N/A",
+                    self._evaluation_data(record)
+                )
+                for record in records
+            ))
+        if self.structured_format == 'jsonl':
+            self._append(self._structured, ''.join(json.dumps(record) + '\n' for record in records))
+        elif self.structured_format in COLUMNAR_EXTENSIONS:
+            self._write_columnar(records)
+
+        if self.on_flush:
+            self.on_flush(records)
+
+    @staticmethod
+    def _append(handle, text):
+        """Appends one batch as a single write under an exclusive lock."""
+        if fcntl:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+        try:
+            handle.write(text)
+            handle.flush()
+        finally:
+            if fcntl:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+
+    def _write_columnar(self, records):
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError(
+                f"pyarrow is required for the {self.structured_format} log format "
+                "(pip install pyarrow)"
+            )
+        table = pa.Table.from_pylist(records, schema=self._schema(pa))
+        if self._writer is None:
+            if self.structured_format == 'parquet':
+                import pyarrow.parquet as pq
+                self._writer = pq.ParquetWriter(self.structured_path, table.schema)
+            else:
+                self._writer = pa.ipc.new_file(self.structured_path, table.schema)
+        self._writer.write_table(table)
+
+    @staticmethod
+    def _schema(pa):
+        fields = [
+            ('timestamp', pa.string()), ('image', pa.string()), ('source', pa.string()),
+            ('destination', pa.string()), ('status', pa.string()), ('score', pa.int32()),
+            ('description', pa.string()), ('final_analysis', pa.string()), ('error', pa.string()),
+            ('prompt_tokens', pa.int64()), ('completion_tokens', pa.int64()),
+            ('total_tokens', pa.int64()), ('latency_ms', pa.float64()),
+            ('cache_status', pa.string()), ('duplicate_of', pa.string())
+        ]
+        fields += [(field, pa.int32()) for field in CHARACTERISTIC_FIELDS]
+        return pa.schema(fields)
+
+    @staticmethod
+    def _evaluation_data(record):
+        """Rebuilds the evaluation_data shape the text renderer expects."""
+        if record['error'] is not None:
+            return record['error']
+        evaluation_data = {}
+        if record['description'] is not None:
+            evaluation_data['description'] = record['description']
+        for char, field in zip(CHARACTERISTICS, CHARACTERISTIC_FIELDS):
+            if record[field] is not None:
+                evaluation_data[char.lower()] = record[field]
+        if record['final_analysis'] is not None:
+            evaluation_data['final_analysis'] = record['final_analysis']
+        return evaluation_data
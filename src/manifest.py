@@ -0,0 +1,192 @@
+"""
+Score-only manifests and the bulk step that applies them.
+"""
+import errno
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from file_handler import fsync_directory, move_file
+
+
+class Manifest:
+    """
+    Records image -> score -> destination for a score-only run instead of
+    moving files. Lines are JSON objects appended to `path`; a later entry
+    for the same source supersedes earlier ones.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = 0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._handle = open(path, 'a', encoding='utf-8')
+
+    @classmethod
+    def from_config(cls, config):
+        """Opens the manifest when processing.score_only is set, or returns None."""
+        processing = config.get('processing', {}) or {}
+        if not processing.get('score_only', False):
+            return None
+        path = processing.get('manifest') or 'manifest.jsonl'
+        if not os.path.isabs(path) and os.path.dirname(path) == '':
+            path = os.path.join(config['directories']['logs'], path)
+        return cls(path)
+
+    def add(self, source, destination, score):
+        with self._lock:
+            self._handle.write(json.dumps({
+                'source': os.path.abspath(source),
+                'destination': os.path.abspath(destination),
+                'score': score,
+                'timestamp': datetime.now().isoformat(timespec='seconds')
+            }) + '\n')
+            self.entries += 1
+
+    def flush(self):
+        with self._lock:
+            self._handle.flush()
+
+    def close(self):
+        with self._lock:
+            if self._handle:
+                self._handle.close()
+                self._handle = None
+
+
+def read_manifest(path):
+    """Returns the manifest's entries in order, keeping the last one per source."""
+    entries = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                entries.pop(entry['source'], None)
+                entries[entry['source']] = entry
+    return list(entries.values())
+
+
+def applied_log_path(manifest_path):
+    return manifest_path + '.applied'
+
+
+def apply_manifest(manifest_path, workers=8, stop_on_error=False, on_move=None):
+    """
+    Carries out a manifest's moves in bulk.
+
+    Every destination folder is created up front, then files are moved on
+    `workers` threads: a rename on the same filesystem, copy + fsync +
+    unlink across filesystems (see file_handler.move_file). Each move is
+    appended to `<manifest>.applied` before it is made, so
+    rollback_manifest can undo a partial or complete apply, even one
+    interrupted by a crash.
+    Sources that no longer exist are skipped, so applying twice is harmless;
+    existing destinations are never overwritten.
+
+    With `stop_on_error`, the first failure stops the apply and the moves
+    already made are rolled back. `on_move(source, destination)` is called
+    for each file moved, from the worker threads.
+    Returns a stats dict.
+    """
+    entries = read_manifest(manifest_path)
+    stats = {'renamed': 0, 'copied': 0, 'skipped': 0, 'failed': 0}
+
+    pending = []
+    for entry in entries:
+        if os.path.exists(entry['source']):
+            pending.append(entry)
+        else:
+            stats['skipped'] += 1
+
+    for folder in sorted({os.path.dirname(entry['destination']) for entry in pending}):
+        os.makedirs(folder, exist_ok=True)
+
+    lock = threading.Lock()
+    stopping = threading.Event()
+    with open(applied_log_path(manifest_path), 'a', encoding='utf-8') as applied:
+        def move(entry):
+            if stopping.is_set():
+                return
+            try:
+                if os.path.lexists(entry['destination']):
+                    raise FileExistsError(errno.EEXIST, "Destination already exists", entry['destination'])
+                # Recorded first: rollback skips entries whose move never happened
+                with lock:
+                    applied.write(json.dumps({
+                        'source': entry['source'], 'destination': entry['destination']
+                    }) + '\n')
+                    applied.flush()
+                method = move_file(entry['source'], entry['destination'])
+            except OSError as e:
+                with lock:
+                    stats['failed'] += 1
+                print(f"Could not move {entry['source']}: {e}")
+                if stop_on_error:
+                    stopping.set()
+                return
+            if on_move:
+                on_move(entry['source'], entry['destination'])
+            with lock:
+                stats[method] += 1
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            list(executor.map(move, pending))
+        os.fsync(applied.fileno())
+
+    for folder in {os.path.dirname(entry['destination']) for entry in pending}:
+        fsync_directory(folder)
+
+    if stopping.is_set():
+        stats['rolled_back'] = rollback_manifest(manifest_path, workers, on_move=on_move)
+    return stats
+
+
+def rollback_manifest(manifest_path, workers=8, on_move=None):
+    """
+    Moves every file recorded in `<manifest>.applied` back to its source,
+    newest first, and clears the log for moves that were undone. Entries
+    whose destination does not exist were never moved and are dropped.
+    `on_move(destination, source)` is called for each file restored.
+    Returns the number of files restored.
+    """
+    log_path = applied_log_path(manifest_path)
+    if not os.path.exists(log_path):
+        return 0
+    with open(log_path, 'r', encoding='utf-8') as f:
+        moves = [json.loads(line) for line in f if line.strip()]
+
+    remaining = []
+    lock = threading.Lock()
+
+    def restore(entry):
+        if not os.path.lexists(entry['destination']):
+            return False
+        try:
+            os.makedirs(os.path.dirname(entry['source']), exist_ok=True)
+            move_file(entry['destination'], entry['source'])
+            if on_move:
+                on_move(entry['destination'], entry['source'])
+            return True
+        except OSError as e:
+            print(f"Could not restore {entry['source']}: {e}")
+            with lock:
+                remaining.append(entry)
+            return False
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        restored = sum(executor.map(restore, reversed(moves)))
+
+    # Keep only the moves that could not be undone
+    temporary = log_path + '.tmp'
+    with open(temporary, 'w', encoding='utf-8') as f:
+        for entry in remaining:
+            f.write(json.dumps(entry) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, log_path)
+    if not remaining:
+        os.unlink(log_path)
+    return restored
@@ -0,0 +1,110 @@
+"""
+Global memory budget for images being decoded, encoded and uploaded.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+
+def available_memory():
+    """Returns MemAvailable from /proc/meminfo in bytes, or None where it is not available."""
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class MemoryBudget:
+    """
+    Caps the estimated bytes held by images in flight, from decoding until
+    their upload completes. A worker about to prepare an image waits while
+    the reservation would exceed max_bytes, or while the system's available
+    memory is below min_available_bytes; one image is always let through
+    when nothing else is in flight, so an oversized image cannot stall
+    the run.
+    """
+
+    def __init__(self, max_bytes, min_available_bytes=None, poll_interval=0.1):
+        self.max_bytes = max_bytes
+        self.min_available_bytes = min_available_bytes
+        self.poll_interval = poll_interval
+        self.in_use = 0
+        self.stats = {'reservations': 0, 'waits': 0, 'wait_seconds': 0.0, 'peak_bytes': 0}
+        self._condition = threading.Condition()
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds the budget from the memory section of the config, or returns None if disabled."""
+        settings = config.get('memory', {}) or {}
+        if not settings.get('enabled', False):
+            return None
+        min_available_mb = settings.get('min_available_mb')
+        return cls(
+            int(settings.get('max_in_flight_mb', 1024) * 1024 * 1024),
+            min_available_bytes=int(min_available_mb * 1024 * 1024) if min_available_mb else None
+        )
+
+    def _fits(self, nbytes):
+        if self.in_use == 0:
+            return True
+        if self.in_use + nbytes > self.max_bytes:
+            return False
+        if self.min_available_bytes:
+            available = available_memory()
+            if available is not None and available - nbytes < self.min_available_bytes:
+                return False
+        return True
+
+    def acquire(self, nbytes):
+        """Blocks until `nbytes` fit in the budget, then reserves them."""
+        with self._condition:
+            if not self._fits(nbytes):
+                self.stats['waits'] += 1
+                start = time.perf_counter()
+                # Available memory changes outside this process, so poll as well
+                while not self._fits(nbytes):
+                    self._condition.wait(self.poll_interval)
+                self.stats['wait_seconds'] += time.perf_counter() - start
+            self.in_use += nbytes
+            self.stats['reservations'] += 1
+            self.stats['peak_bytes'] = max(self.stats['peak_bytes'], self.in_use)
+
+    def release(self, nbytes):
+        with self._condition:
+            self.in_use = max(0, self.in_use - nbytes)
+            self._condition.notify_all()
+
+    @contextmanager
+    def hold(self, nbytes):
+        """
+        Reserves `nbytes` for the duration of the block. The yielded
+        Reservation can shrink once the actual size is known.
+        """
+        reservation = Reservation(self, nbytes)
+        try:
+            yield reservation
+        finally:
+            reservation.release()
+
+
+class Reservation:
+    """Bytes reserved in a MemoryBudget by one hold() block."""
+
+    def __init__(self, budget, nbytes):
+        budget.acquire(nbytes)
+        self.budget = budget
+        self.nbytes = nbytes
+
+    def shrink(self, nbytes):
+        """Gives back everything above `nbytes`, e.g. once decoding is done."""
+        if nbytes < self.nbytes:
+            self.budget.release(self.nbytes - nbytes)
+            self.nbytes = nbytes
+
+    def release(self):
+        self.budget.release(self.nbytes)
+        self.nbytes = 0
@@ -0,0 +1,263 @@
+"""
+Per-stage latency histograms, throughput counters and run profiling.
+"""
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Prometheus histogram bucket bounds in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+PERCENTILES = (50, 95, 99)
+
+
+class Histogram:
+    """
+    Cumulative bucket counts for Prometheus plus a bounded sample of recent
+    observations for exact percentiles.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, keep=10000):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=keep)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        self.samples.append(value)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[index] += 1
+                break
+
+    def percentile(self, q):
+        """Returns the q-th percentile (0-100) of the recent samples, or None."""
+        if not self.samples:
+            return None
+        values = sorted(self.samples)
+        return values[min(len(values) - 1, int(len(values) * q / 100))]
+
+    def snapshot(self):
+        summary = {
+            'count': self.count,
+            'sum_s': round(self.sum, 6),
+            'mean_ms': round(self.sum / self.count * 1000, 3) if self.count else None,
+            'max_ms': round(self.max * 1000, 3)
+        }
+        for q in PERCENTILES:
+            value = self.percentile(q)
+            summary[f"p{q}_ms"] = round(value * 1000, 3) if value is not None else None
+        return summary
+
+
+class Metrics:
+    """
+    Thread-safe registry of stage timers and counters.
+
+    Stages are timed with `with metrics.time('parse'):` or observe(); counters
+    are bumped with count(). The current state can be exported as
+    Prometheus text (to a file, and optionally over HTTP on /metrics) and
+    as a JSON run report with p50/p95/p99 per stage and throughput per
+    counter.
+    """
+
+    def __init__(self, namespace='image_sorter', prometheus_file=None, report_file=None):
+        self.namespace = namespace
+        self.prometheus_file = prometheus_file
+        self.report_file = report_file
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._counters = {}
+        self._extra = {}
+        self._server = None
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds the registry from the metrics section of the config."""
+        settings = config.get('metrics', {}) or {}
+        logs = config['directories']['logs']
+
+        def under_logs(name):
+            return os.path.join(logs, name) if name else None
+
+        metrics = cls(
+            prometheus_file=under_logs(settings.get('prometheus_file', 'metrics.prom')),
+            report_file=under_logs(settings.get('report_file', 'run_report.json'))
+        )
+        if settings.get('prometheus_port'):
+            metrics.serve(settings['prometheus_port'], settings.get('prometheus_host', '127.0.0.1'))
+        return metrics
+
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def attach(self, name, provider):
+        """Adds `provider()`'s dict to the JSON report under `name`."""
+        self._extra[name] = provider
+
+    def report(self):
+        """Returns the JSON run report as a dict."""
+        elapsed = time.perf_counter() - self._start
+        with self._lock:
+            stages = {stage: histogram.snapshot() for stage, histogram in sorted(self._stages.items())}
+            counters = dict(sorted(self._counters.items()))
+        report = {
+            'started_at': datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+            'elapsed_s': round(elapsed, 3),
+            'counters': counters,
+            'throughput_per_s': {
+                name: round(value / elapsed, 3) for name, value in counters.items()
+            } if elapsed > 0 else {},
+            'stages': stages
+        }
+        for name, provider in self._extra.items():
+            report[name] = provider()
+        return report
+
+    def prometheus_text(self):
+        """Renders counters and stage histograms in the Prometheus text format."""
+        prefix = self.namespace
+        lines = []
+        with self._lock:
+            for name, value in sorted(self._counters.items()):
+                metric = f"{prefix}_{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric} {value}")
+            metric = f"{prefix}_stage_seconds"
+            if self._stages:
+                lines.append(f"# HELP {metric} Time spent per pipeline stage")
+                lines.append(f"# TYPE {metric} histogram")
+            for stage, histogram in sorted(self._stages.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.bucket_counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{metric}_sum{{stage="{stage}"}} {histogram.sum:.6f}')
+                lines.append(f'{metric}_count{{stage="{stage}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        """Writes the Prometheus file and JSON report, each replaced atomically."""
+        if self.prometheus_file:
+            self._write_atomic(self.prometheus_file, self.prometheus_text())
+        if self.report_file:
+            self._write_atomic(self.report_file, json.dumps(self.report(), indent=2) + "\n")
+
+    def serve(self, port, host='127.0.0.1'):
+        """Serves the Prometheus text on http://host:port/metrics from a background thread."""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server.server_address[1]
+
+    def close(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    @staticmethod
+    def _write_atomic(path, text):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        temporary = path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(temporary, path)
+
+
+def profile_call(function, output_path, top=25):
+    """
+    Runs function() under cProfile, including every thread it starts, and
+    writes the merged statistics to `output_path` in pstats format (readable
+    by pstats, snakeviz, gprof2dot or `flameprof`). Prints the top functions
+    by cumulative time. Returns function()'s result.
+    """
+    profilers = []
+    lock = threading.Lock()
+    # From 3.12 cProfile runs on sys.monitoring, which sees every thread but
+    # allows one profiler at a time; before that each thread needs its own
+    per_thread = sys.version_info < (3, 12)
+
+    def start_thread_profiler(frame, event, arg):
+        # Runs once in each new thread; enabling swaps in the C profiler
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is active; the main one covers this thread
+            return
+        with lock:
+            profilers.append(profiler)
+
+    main_profiler = cProfile.Profile()
+    if per_thread:
+        threading.setprofile(start_thread_profiler)
+    main_profiler.enable()
+    try:
+        return function()
+    finally:
+        main_profiler.disable()
+        if per_thread:
+            threading.setprofile(None)
+        stats = pstats.Stats(main_profiler)
+        with lock:
+            for profiler in profilers:
+                try:
+                    stats.add(profiler)
+                except TypeError:
+                    # A thread that never recorded a call has no stats
+                    pass
+        stats.dump_stats(output_path)
+        print(f"\nProfile written to {output_path} "
+              f"(view with: python -m pstats {output_path}, or snakeviz)")
+        stats.sort_stats('cumulative').print_stats(top)
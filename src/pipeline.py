@@ -0,0 +1,235 @@
+"""
+Pluggable stages that can settle an image before it is sent to the API.
+
+Every image takes the same path through ImageEvaluator: scan, the stages
+below, preprocess, evaluate, parse, sort and log. Stages run in the order
+of pipeline.stages and the first to return a result settles the image;
+images no stage settles are sent to the API, several to a request when
+processing.images_per_request > 1. Extra stages are loaded from
+pipeline.plugins and enabled by listing their name in pipeline.stages.
+"""
+import importlib
+import os
+
+from embedding_index import compute_embedding
+
+
+class Stage:
+    """
+    Base class for pipeline stages.
+
+    lookup(entry) sees each image no earlier stage has settled and returns
+    a (score, evaluation_data, token_usage) result to settle it, or None to
+    pass it on. It may instead set entry['deferred'] to hold the image back
+    from the API, in which case its complete() must fill in the result.
+    complete(entries) runs once per chunk after the API, also when the
+    evaluation failed, and sees every entry.
+
+    Entries are dicts with 'path', 'result', 'status' (the settling stage's
+    `status`, logged as cache_status), 'sent' (True once evaluated by the
+    API) and whatever keys the stages add. Stages with `batch` set are
+    also consulted in Batch API mode, one image at a time.
+
+    prefetch(path) is called for images before their lookup, up to
+    `lookahead` images ahead of the one being settled, so a stage can
+    start slow local work in the background.
+    """
+
+    name = None
+    status = None
+    batch = True
+    lookahead = 0
+
+    @classmethod
+    def from_evaluator(cls, evaluator):
+        """Returns the stage for an evaluator, or None if it is disabled."""
+        return cls()
+
+    def prefetch(self, path):
+        pass
+
+    def lookup(self, entry):
+        return None
+
+    def complete(self, entries):
+        pass
+
+    def close(self):
+        pass
+
+
+class PrefilterStage(Stage):
+    """Settles images the local quality checks reject."""
+
+    name = 'prefilter'
+    status = 'prefiltered'
+
+    def __init__(self, prefilter):
+        self.prefilter = prefilter
+        # Enough queued checks to keep every worker busy
+        self.lookahead = prefilter.workers * 2
+
+    @classmethod
+    def from_evaluator(cls, evaluator):
+        return cls(evaluator.prefilter) if evaluator.prefilter else None
+
+    def prefetch(self, path):
+        self.prefilter.prefetch(path)
+
+    def lookup(self, entry):
+        return self.prefilter.check(entry['path'])
+
+
+class DedupStage(Stage):
+    """
+    Holds near-duplicates back until their cluster's representative has
+    been evaluated, then gives them its result. Members whose
+    representative failed are evaluated on their own.
+    """
+
+    name = 'dedup'
+    status = 'duplicate'
+    # Members would wait on representatives still queued in the batch
+    batch = False
+
+    def __init__(self, dedup, evaluate_image, offload):
+        self.dedup = dedup
+        self.evaluate_image = evaluate_image
+        self.offload = offload
+
+    @classmethod
+    def from_evaluator(cls, evaluator):
+        if not evaluator.dedup:
+            return None
+        return cls(evaluator.dedup, evaluator.evaluate_image, evaluator.offload)
+
+    def lookup(self, entry):
+        try:
+            value = self.offload(self.dedup.hash_function, entry['path'])
+        except Exception:
+            return None
+        cluster, is_representative, value = self.dedup.claim(entry['path'], value)
+        if cluster is not None:
+            entry['cluster'], entry['hash'] = cluster, value
+            entry['representative'] = is_representative
+            entry['deferred'] = not is_representative
+        return None
+
+    def complete(self, entries):
+        # Always release members waiting on these representatives, in this
+        # chunk or others, before waiting on any
+        for entry in entries:
+            if entry.get('representative'):
+                result = entry['result'] or (None, "Evaluation did not complete", None)
+                self.dedup.resolve(entry['cluster'], entry['hash'], result)
+
+        for entry in entries:
+            if not entry.get('deferred') or entry['result'] is not None:
+                continue
+            shared = entry['cluster'].wait()
+            if shared and shared[0]:
+                score, evaluation_data, _ = shared
+                entry['result'] = (score, evaluation_data, None)
+                entry['status'] = self.status
+                entry['duplicate_of'] = entry['cluster'].representative
+            else:
+                entry['result'] = self.evaluate_image(entry['path'])
+                entry['sent'] = True
+
+
+class CacheStage(Stage):
+    """Settles images evaluated before with the same prompt, model and preprocessing."""
+
+    name = 'cache'
+    status = 'hit'
+    # BatchRunner consults the cache itself
+    batch = False
+
+    def __init__(self, cache, cache_key):
+        self.cache = cache
+        self.cache_key = cache_key
+
+    @classmethod
+    def from_evaluator(cls, evaluator):
+        return cls(evaluator.cache, evaluator.cache_key) if evaluator.cache else None
+
+    def lookup(self, entry):
+        # The key is kept so the API result can be stored under it
+        entry['cache_key'] = self.cache_key(entry['path'])
+        cached = self.cache.get(entry['cache_key'])
+        if cached:
+            score, evaluation_data, _ = cached
+            return score, evaluation_data, None
+        return None
+
+
+class EmbeddingStage(Stage):
+    """Predicts scores from similar scored images and indexes the images the API scores."""
+
+    name = 'embedding'
+    status = 'predicted'
+
+    def __init__(self, index, offload):
+        self.index = index
+        self.offload = offload
+
+    @classmethod
+    def from_evaluator(cls, evaluator):
+        return cls(evaluator.embeddings, evaluator.offload) if evaluator.embeddings else None
+
+    def lookup(self, entry):
+        try:
+            vector = self.offload(compute_embedding, entry['path'])
+        except Exception:
+            entry['embedding'] = None
+            return None
+        result, entry['embedding'] = self.index.predict(entry['path'], vector)
+        return result
+
+    def complete(self, entries):
+        for entry in entries:
+            if entry.get('sent') and entry['result'] and entry.get('embedding') is not None:
+                self.index.add(os.path.abspath(entry['path']), entry['result'], entry['embedding'])
+
+
+STAGES = {
+    stage.name: stage
+    for stage in (PrefilterStage, DedupStage, CacheStage, EmbeddingStage)
+}
+
+DEFAULT_ORDER = ['prefilter', 'dedup', 'cache', 'embedding']
+
+
+def load_plugin(spec):
+    """Imports a stage class given as "module:Class"."""
+    module_name, _, attribute = spec.partition(':')
+    if not module_name or not attribute:
+        raise ValueError(f"Pipeline plugin '{spec}' should look like 'module:Class'")
+    stage_class = getattr(importlib.import_module(module_name), attribute)
+    if not (isinstance(stage_class, type) and issubclass(stage_class, Stage)) or not stage_class.name:
+        raise ValueError(f"Pipeline plugin '{spec}' is not a named Stage subclass")
+    return stage_class
+
+
+def stages_from_config(evaluator):
+    """
+    Builds the stages named by pipeline.stages (default: every built-in
+    stage), in order, skipping those whose component is disabled.
+    """
+    settings = evaluator.config.get('pipeline', {}) or {}
+    available = dict(STAGES)
+    for spec in settings.get('plugins') or []:
+        stage_class = load_plugin(spec)
+        available[stage_class.name] = stage_class
+
+    names = settings.get('stages')
+    if names is None:
+        names = DEFAULT_ORDER
+    stages = []
+    for name in names:
+        if name not in available:
+            raise ValueError(f"Unknown pipeline stage '{name}', expected one of {sorted(available)}")
+        stage = available[name].from_evaluator(evaluator)
+        if stage is not None:
+            stages.append(stage)
+    return stages
@@ -0,0 +1,186 @@
+"""
+Fast local quality checks that reject obviously unusable images before any API call.
+"""
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+from PIL import Image
+
+ANALYSIS_EDGE = 512
+
+DEFAULT_THRESHOLDS = {
+    'min_sharpness': 20.0,  # Laplacian variance
+    'max_dark_fraction': 0.9,  # Share of pixels at or below 5/255
+    'max_bright_fraction': 0.9,  # Share of pixels at or above 250/255
+    'min_long_edge': 200,  # Pixels in the original image
+    'max_noise': 25.0  # Estimated noise sigma in 8-bit levels
+}
+
+
+def analyze_image(image_path):
+    """
+    Computes local quality metrics on a downscaled grayscale copy.
+    Returns a dict with width, height, sharpness, dark_fraction,
+    bright_fraction and noise.
+    """
+    with Image.open(image_path) as image:
+        width, height = image.size
+        # Let the JPEG decoder downscale while decoding, then cap the size
+        image.draft('L', (ANALYSIS_EDGE, ANALYSIS_EDGE))
+        gray = image.convert('L')
+        gray.thumbnail((ANALYSIS_EDGE, ANALYSIS_EDGE))
+        pixels = np.asarray(gray, dtype=np.float32)
+
+    metrics = {'width': width, 'height': height}
+    if pixels.shape[0] < 3 or pixels.shape[1] < 3:
+        metrics.update(sharpness=0.0, dark_fraction=0.0, bright_fraction=0.0, noise=0.0)
+        return metrics
+
+    # Variance of the 4-neighbour Laplacian
+    laplacian = (
+        pixels[:-2, 1:-1] + pixels[2:, 1:-1] + pixels[1:-1, :-2] + pixels[1:-1, 2:]
+        - 4 * pixels[1:-1, 1:-1]
+    )
+    metrics['sharpness'] = float(laplacian.var())
+
+    # Exposure clipping at either end of the histogram
+    metrics['dark_fraction'] = float(np.count_nonzero(pixels <= 5) / pixels.size)
+    metrics['bright_fraction'] = float(np.count_nonzero(pixels >= 250) / pixels.size)
+
+    # Immerkaer's fast noise variance estimate
+    residual = (
+        pixels[:-2, :-2] - 2 * pixels[:-2, 1:-1] + pixels[:-2, 2:]
+        - 2 * pixels[1:-1, :-2] + 4 * pixels[1:-1, 1:-1] - 2 * pixels[1:-1, 2:]
+        + pixels[2:, :-2] - 2 * pixels[2:, 1:-1] + pixels[2:, 2:]
+    )
+    rows, cols = pixels.shape
+    metrics['noise'] = float(
+        math.sqrt(math.pi / 2) * np.abs(residual).sum() / (6 * (rows - 2) * (cols - 2))
+    )
+    return metrics
+
+
+def check_image(image_path, thresholds):
+    """
+    Analyzes an image against the thresholds.
+    Returns tuple of (reasons, metrics); an empty reasons list means it passed.
+    """
+    metrics = analyze_image(image_path)
+    reasons = []
+    if max(metrics['width'], metrics['height']) < thresholds['min_long_edge']:
+        reasons.append(f"too small ({metrics['width']}x{metrics['height']})")
+    if metrics['sharpness'] < thresholds['min_sharpness']:
+        reasons.append(f"too blurry (sharpness {metrics['sharpness']:.1f})")
+    if metrics['dark_fraction'] > thresholds['max_dark_fraction']:
+        reasons.append(f"nearly black ({metrics['dark_fraction']:.0%} clipped dark)")
+    if metrics['bright_fraction'] > thresholds['max_bright_fraction']:
+        reasons.append(f"blown out ({metrics['bright_fraction']:.0%} clipped bright)")
+    if metrics['noise'] > thresholds['max_noise']:
+        reasons.append(f"too noisy (noise {metrics['noise']:.1f})")
+    return reasons, metrics
+
+
+class Prefilter:
+    """
+    Runs check_image on a process pool so the checks scale across cores
+    while the evaluator's threads wait on network I/O. Rejected images get
+    `score` and a "Prefiltered" reason instead of an API call.
+
+    prefetch() starts an image's check ahead of time and check() picks up
+    the result, so the pipeline can keep every worker busy on upcoming
+    images instead of checking one image per request thread. Workers are
+    started with 'spawn', which is safe with the request threads running;
+    a pool that loses a worker is replaced.
+    """
+
+    def __init__(self, thresholds=None, score=1, workers=None, logger=None):
+        self.thresholds = {**DEFAULT_THRESHOLDS, **(thresholds or {})}
+        self.score = score
+        self.workers = workers or os.cpu_count() or 1
+        self.logger = logger
+        self.stats = {'checked': 0, 'rejected': 0}
+        self._pool = None
+        self._pending = {}  # image path -> (pool, future) of prefetched checks
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, logger=None):
+        """Builds the prefilter from the config, or returns None if disabled."""
+        settings = config.get('prefilter', {}) or {}
+        if not settings.get('enabled', False):
+            return None
+        thresholds = {key: settings[key] for key in DEFAULT_THRESHOLDS if key in settings}
+        return cls(thresholds, settings.get('score', 1), settings.get('workers'), logger=logger)
+
+    def _pool_for(self, broken=None):
+        """Returns the process pool, starting it (or replacing `broken`) if needed. Call with the lock held."""
+        if broken is not None and self._pool is broken:
+            if self.logger:
+                self.logger.warning("Prefilter worker died; restarting the pool")
+            self._pool = None
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+            )
+        return self._pool
+
+    def _submit(self, image_path, broken=None):
+        with self._lock:
+            pool = self._pool_for(broken)
+            return pool, pool.submit(check_image, image_path, self.thresholds)
+
+    def prefetch(self, image_path):
+        """Starts checking an image in the pool, for a later check() to collect."""
+        image_path = str(image_path)
+        with self._lock:
+            if image_path in self._pending:
+                return
+        submitted = self._submit(image_path)
+        with self._lock:
+            self._pending.setdefault(image_path, submitted)
+
+    def check(self, image_path):
+        """
+        Returns a (score, evaluation_data, None) result for a rejected image,
+        or None if it should go on to the API. Images that cannot be
+        analyzed are passed through.
+        """
+        image_path = str(image_path)
+        with self._lock:
+            submitted = self._pending.pop(image_path, None)
+        pool, future = submitted or self._submit(image_path)
+        try:
+            try:
+                reasons, metrics = future.result()
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for memory); retry once on a new pool
+                reasons, metrics = self._submit(image_path, broken=pool)[1].result()
+        except Exception as e:
+            if self.logger:
+                self.logger.warning(f"Prefilter could not check {image_path}: {str(e)}")
+            return None
+
+        with self._lock:
+            self.stats['checked'] += 1
+            if reasons:
+                self.stats['rejected'] += 1
+        if not reasons:
+            return None
+        return self.score, {
+            'description': "Rejected by the local prefilter",
+            'final_analysis': "Prefiltered: " + "; ".join(reasons),
+            'prefiltered': True,
+            'metrics': metrics
+        }, None
+
+    def close(self):
+        with self._lock:
+            self._pending.clear()
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
@@ -0,0 +1,301 @@
+"""
+Client-side image preprocessing to cut upload size and prompt tokens.
+"""
+import io
+import math
+import mimetypes
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image
+
+from utils import encode_base64, encode_file_base64
+
+
+TILE_SIZE = 512
+FORMAT_MIME_TYPES = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp', 'PNG': 'image/png'}
+
+# EXIF orientation tag and the transpose that undoes each value
+EXIF_ORIENTATION = 0x0112
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90
+}
+
+# Copies of the base64 payload alive during an upload: the data URL, the
+# JSON request body and its encoded bytes
+UPLOAD_COPIES = 3
+
+DEFAULT_SETTINGS = {
+    'enabled': True,
+    'max_long_edge': 2048,
+    'max_tiles': 4,
+    'format': 'JPEG',
+    'quality': 85,
+    'auto_detail': True,
+    'low_detail_max_edge': 512,
+    'tokens_base': 85,
+    'tokens_per_tile': 170
+}
+
+
+def estimate_image_tokens(width, height, detail, settings):
+    """
+    Estimates prompt tokens for an image the way the Vision API bills them:
+    a flat base for detail=low, otherwise the image is fitted into 2048x2048,
+    its short side scaled to 768 and each 512px tile billed on top of the base.
+    """
+    base = settings['tokens_base']
+    if detail == 'low':
+        return base
+    return base + _tiles(width, height) * settings['tokens_per_tile']
+
+
+def _api_scaled_size(width, height):
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    return width * scale, height * scale
+
+
+def _tiles(width, height):
+    width, height = _api_scaled_size(width, height)
+    return math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE)
+
+
+def target_size(width, height, settings):
+    """Returns the (width, height) that fits the long-edge and tile budgets."""
+    scale = min(1.0, settings['max_long_edge'] / max(width, height))
+    new_width, new_height = width * scale, height * scale
+    max_tiles = settings.get('max_tiles')
+    while max_tiles and _tiles(new_width, new_height) > max_tiles and min(new_width, new_height) > 1:
+        new_width, new_height = new_width * 0.9, new_height * 0.9
+    return max(1, round(new_width)), max(1, round(new_height))
+
+
+def estimate_file_tokens(image_path, settings=None):
+    """
+    Estimates the image tokens prepare_image's payload for a file will be
+    billed, reading only the image header.
+    """
+    settings = {**DEFAULT_SETTINGS, **(settings or {})}
+    with Image.open(image_path) as image:
+        width, height = image.size
+    if not settings['enabled']:
+        return estimate_image_tokens(width, height, 'high', settings)
+    width, height = target_size(width, height, settings)
+    detail = 'high'
+    if settings['auto_detail'] and max(width, height) <= settings['low_detail_max_edge']:
+        detail = 'low'
+    return estimate_image_tokens(width, height, detail, settings)
+
+
+def prepare_image(image_path, settings=None, timings=None):
+    """
+    Produces the payload sent to the Vision API for an image.
+    Returns a dict with data_url, mime_type, detail, bytes_sent and
+    tokens_saved (estimated image tokens saved versus the original file).
+    If a `timings` dict is given, the seconds spent in each step (read,
+    decode, resize, encode, base64) are stored in it.
+
+    Peak memory per image is kept close to one decoded copy at reduced
+    size: JPEGs are decoded straight to the smallest 1/2, 1/4 or 1/8 scale
+    that still covers the target size, EXIF rotation is applied after
+    resizing, and the data URL is encoded in chunks into a single buffer.
+    """
+    settings = {**DEFAULT_SETTINGS, **(settings or {})}
+    timings = {} if timings is None else timings
+    start = time.perf_counter()
+    if not settings['enabled']:
+        mime_type = mimetypes.guess_type(str(image_path))[0] or 'image/jpeg'
+        data_url = encode_file_base64(image_path, f"data:{mime_type};base64,")
+        timings['base64'] = time.perf_counter() - start
+        return {
+            'data_url': data_url,
+            'mime_type': mime_type,
+            'detail': 'high',
+            'bytes_sent': len(data_url),
+            'tokens_saved': 0
+        }
+
+    with Image.open(image_path) as source:
+        original_size = source.size
+        orientation = source.getexif().get(EXIF_ORIENTATION)
+        # The target size does not depend on orientation, so decoding and
+        # resizing work on the stored (unrotated) image
+        source.draft(source.mode, target_size(*original_size, settings))
+        source.load()
+        timings['decode'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        width, height = target_size(*original_size, settings)
+        image = source
+        if (width, height) != image.size:
+            image = image.resize((width, height), Image.LANCZOS)
+            # Free the full-size decode before building more copies
+            source.close()
+        if orientation in ORIENTATION_TRANSPOSE:
+            image = image.transpose(ORIENTATION_TRANSPOSE[orientation])
+
+        image_format = settings['format'].upper()
+        if image_format == 'JPEG':
+            image = _flatten(image)
+        elif image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+        timings['resize'] = time.perf_counter() - start
+
+        # Saving a fresh image without exif/icc arguments strips metadata
+        start = time.perf_counter()
+        buffer = io.BytesIO()
+        image.save(buffer, format=image_format, quality=settings['quality'])
+        del image
+        timings['encode'] = time.perf_counter() - start
+
+    detail = 'high'
+    if settings['auto_detail'] and max(width, height) <= settings['low_detail_max_edge']:
+        detail = 'low'
+
+    tokens_before = estimate_image_tokens(*original_size, 'high', settings)
+    tokens_after = estimate_image_tokens(width, height, detail, settings)
+    mime_type = FORMAT_MIME_TYPES.get(image_format, 'image/jpeg')
+    start = time.perf_counter()
+    with buffer.getbuffer() as encoded:
+        data_url = encode_base64(encoded, f"data:{mime_type};base64,")
+    timings['base64'] = time.perf_counter() - start
+    return {
+        'data_url': data_url,
+        'mime_type': mime_type,
+        'detail': detail,
+        'bytes_sent': len(data_url),
+        'tokens_saved': max(0, tokens_before - tokens_after)
+    }
+
+
+def prepare_image_timed(image_path, settings=None):
+    """Runs prepare_image in a worker process. Returns tuple of (payload, timings)."""
+    timings = {}
+    return prepare_image(image_path, settings, timings), timings
+
+
+class PreprocessPool:
+    """
+    Runs prepare_image in worker processes, so decoding, resizing, encoding
+    and base64 for one image do not compete for the GIL with the threads
+    sending requests and parsing replies in the main process. The other
+    CPU-bound per-image steps (perceptual hashes, embeddings) go through
+    run() on the same workers.
+
+    Callers block in prepare() or run() until their result is ready. At most
+    `max_pending` images are queued for or being prepared by the workers;
+    callers beyond that wait before submitting, so a high request
+    concurrency cannot pile up finished payloads faster than they are sent.
+    Workers are started with 'spawn', which is safe with the threads
+    already running in the main process.
+    """
+
+    def __init__(self, workers, settings=None, max_pending=None, logger=None):
+        self.workers = workers
+        self.settings = settings or {}
+        self.logger = logger
+        self._slots = threading.BoundedSemaphore(max_pending or workers * 2)
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @classmethod
+    def from_config(cls, config, logger=None):
+        """
+        Builds the pool from processing.preprocess_workers ('auto' for one
+        per CPU), or returns None when it is 0 and images are prepared on the
+        requesting thread.
+        """
+        processing = config.get('processing', {}) or {}
+        workers = processing.get('preprocess_workers', 0)
+        if workers == 'auto':
+            workers = os.cpu_count() or 1
+        workers = int(workers or 0)
+        if workers < 1:
+            return None
+        return cls(
+            workers,
+            settings=config.get('preprocessing', {}) or {},
+            max_pending=processing.get('preprocess_queue'),
+            logger=logger
+        )
+
+    def _executor_for(self, broken=None):
+        """Returns the process pool, starting it (or replacing `broken`) if needed."""
+        with self._lock:
+            if broken is not None and self._executor is broken:
+                if self.logger:
+                    self.logger.warning("Preprocessing worker died; restarting the pool")
+                self._executor = None
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def prepare(self, image_path):
+        """Prepares an image in a worker. Returns tuple of (payload, timings)."""
+        return self.run(prepare_image_timed, str(image_path), self.settings)
+
+    def run(self, function, *args):
+        """Calls a module-level function in a worker and returns its result."""
+        with self._slots:
+            executor = self._executor_for()
+            try:
+                return executor.submit(function, *args).result()
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for memory); retry once on a new pool
+                executor = self._executor_for(broken=executor)
+                return executor.submit(function, *args).result()
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures=True)
+                self._executor = None
+
+
+def estimate_memory(image_path, settings=None):
+    """
+    Estimates the peak bytes prepare_image and the upload hold for an image,
+    from its header: the (draft-reduced) decode plus the resized copy and
+    the encoded request, or the base64 payload when preprocessing is off.
+    """
+    settings = {**DEFAULT_SETTINGS, **(settings or {})}
+    if not settings['enabled']:
+        return os.path.getsize(image_path) * 4 // 3 * UPLOAD_COPIES
+    with Image.open(image_path) as image:
+        width, height = image.size
+        bands = max(3, len(image.getbands()))
+        target_width, target_height = target_size(width, height, settings)
+        scale = 1
+        if image.format == 'JPEG':
+            while scale < 8 and width // (scale * 2) >= target_width and height // (scale * 2) >= target_height:
+                scale *= 2
+    decoded = (width // scale) * (height // scale) * bands
+    # Resampling runs one axis at a time, through a target-width intermediate
+    resized = target_width * (height // scale) * bands + target_width * target_height * 4
+    # A JPEG at quality 85 is rarely over a byte per pixel
+    payload = target_width * target_height * 4 // 3 * UPLOAD_COPIES
+    return decoded + resized + payload
+
+
+def _flatten(image):
+    """Converts to RGB, compositing any transparency onto white."""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
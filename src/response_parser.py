@@ -0,0 +1,211 @@
+"""
+Parsers that turn the model's reply into a score and evaluation data.
+"""
+import json
+import re
+
+from file_handler import CHARACTERISTICS
+
+# evaluation_data keys, in prompt order
+CHARACTERISTIC_KEYS = [char.lower() for char in CHARACTERISTICS]
+
+# One "Key: value" line, tolerating list markers, headings, markdown
+# emphasis and a parenthetical after the key: "- **Lighting:** 8/10",
+# "### Score: 72", "Composition (1-10): 7"
+LINE_PATTERN = re.compile(
+    r'[ \t>]*(?:[-*+][ \t]+|\d+[.)][ \t]+)?[#*_ \t]*'
+    r'(?P<key>[A-Za-z][A-Za-z \t]*)(?:\([^)]*\))?[*_ \t]*:(?P<value>.*)'
+)
+
+# "7", "7/10", "7 / 10", "7.5", "8 out of 10"
+SCORE_PATTERN = re.compile(r'(\d+(?:\.\d+)?)(?:\s*(?:/|out\s+of)\s*(\d+(?:\.\d+)?))?', re.IGNORECASE)
+
+# Section headers of a multi-image reply: "### Image 2", "**Image 2:**"
+SECTION_HEADER = re.compile(r'^[#*\s]*Image\s+(\d+)[\s*:#]*$', re.IGNORECASE | re.MULTILINE)
+
+_TEXT_FIELDS = {'description': 'description', 'reason': 'final_analysis'}
+_SCORE_FIELDS = {key: key for key in CHARACTERISTIC_KEYS}
+
+
+def parse_characteristic(value):
+    """
+    Reads a 1-10 characteristic score, scaling fractions such as "7/10" or
+    "35/50" to ten points. Returns an int, or None if there is no number.
+    """
+    match = SCORE_PATTERN.search(value)
+    if not match:
+        return None
+    number = float(match.group(1))
+    if match.group(2):
+        denominator = float(match.group(2))
+        if denominator <= 0:
+            return None
+        number = number * 10 / denominator
+    return max(1, min(10, int(round(number))))
+
+
+def final_score(evaluation_data):
+    """
+    Derives the 1-100 score from the characteristic scores.
+    Raises ValueError if there are none.
+    """
+    scores = [evaluation_data[key] for key in CHARACTERISTIC_KEYS if evaluation_data.get(key)]
+    if not scores:
+        raise ValueError("Could not parse scores from response")
+    return max(1, min(100, (sum(scores) * 10) // len(scores)))
+
+
+class TextResponseParser:
+    """
+    Parses the plain "Key: value" format the evaluation prompt asks for in a
+    single pass over the reply's lines with a precompiled pattern.
+    """
+
+    name = 'text'
+
+    def response_format(self, count=1):
+        """Plain text replies need no response_format."""
+        return None
+
+    def parse(self, response_text):
+        """
+        Returns tuple of (score, evaluation_data); raises ValueError if no
+        characteristic scores could be found.
+        """
+        evaluation_data = {}
+        for line in response_text.splitlines():
+            # Cheap test first; most non-field lines have no colon at all
+            if ':' not in line:
+                continue
+            match = LINE_PATTERN.match(line)
+            if not match:
+                continue
+            key = ' '.join(match.group('key').lower().split())
+            field = _TEXT_FIELDS.get(key, key)
+            # The first occurrence of each field wins
+            if field in evaluation_data:
+                continue
+            if key in _SCORE_FIELDS:
+                evaluation_data[key] = parse_characteristic(match.group('value')) or 0
+            elif key in _TEXT_FIELDS:
+                evaluation_data[field] = match.group('value').strip(' \t*_')
+        return final_score(evaluation_data), evaluation_data
+
+    def split(self, response_text, count):
+        """
+        Splits a multi-image reply into its per-image sections.
+        Returns a dict of 1-based image number -> section text.
+        """
+        headers = list(SECTION_HEADER.finditer(response_text))
+        sections = {}
+        for number, header in enumerate(headers):
+            end = headers[number + 1].start() if number + 1 < len(headers) else len(response_text)
+            sections.setdefault(int(header.group(1)), response_text[header.end():end])
+        return sections
+
+
+def _field_name(key):
+    return key.replace(' ', '_')
+
+
+EVALUATION_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'description': {'type': 'string'},
+        **{_field_name(key): {'type': 'integer', 'description': "Score from 1 to 10"}
+           for key in CHARACTERISTIC_KEYS},
+        'reason': {'type': 'string'}
+    },
+    'required': ['description'] + [_field_name(key) for key in CHARACTERISTIC_KEYS] + ['reason'],
+    'additionalProperties': False
+}
+
+
+class JsonResponseParser:
+    """
+    Requests structured output that follows EVALUATION_SCHEMA, so replies
+    are read with json.loads instead of text parsing. Multi-image requests
+    use a wrapper object with one evaluation per image.
+    """
+
+    name = 'json_schema'
+
+    def response_format(self, count=1):
+        """Returns the response_format request parameter for `count` images."""
+        if count == 1:
+            name, schema = 'image_evaluation', EVALUATION_SCHEMA
+        else:
+            name, schema = 'image_evaluations', {
+                'type': 'object',
+                'properties': {
+                    'images': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'image': {'type': 'integer'},
+                                **EVALUATION_SCHEMA['properties']
+                            },
+                            'required': ['image'] + EVALUATION_SCHEMA['required'],
+                            'additionalProperties': False
+                        }
+                    }
+                },
+                'required': ['images'],
+                'additionalProperties': False
+            }
+        return {'type': 'json_schema', 'json_schema': {'name': name, 'strict': True, 'schema': schema}}
+
+    def parse(self, response):
+        """
+        Accepts the reply text or an already decoded object.
+        Returns tuple of (score, evaluation_data); raises ValueError if the
+        reply is not a valid evaluation.
+        """
+        if isinstance(response, str):
+            try:
+                response = json.loads(response)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Reply is not valid JSON: {e}")
+        if not isinstance(response, dict):
+            raise ValueError("Reply is not a JSON object")
+
+        evaluation_data = {}
+        if isinstance(response.get('description'), str):
+            evaluation_data['description'] = response['description'].strip()
+        for key in CHARACTERISTIC_KEYS:
+            value = response.get(_field_name(key))
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                evaluation_data[key] = max(1, min(10, int(round(value))))
+            elif isinstance(value, str):
+                evaluation_data[key] = parse_characteristic(value) or 0
+        if isinstance(response.get('reason'), str):
+            evaluation_data['final_analysis'] = response['reason'].strip()
+        return final_score(evaluation_data), evaluation_data
+
+    def split(self, response_text, count):
+        """Returns a dict of 1-based image number -> decoded evaluation."""
+        try:
+            images = json.loads(response_text).get('images') or []
+        except (json.JSONDecodeError, AttributeError):
+            return {}
+        sections = {}
+        for position, item in enumerate(images, 1):
+            if isinstance(item, dict):
+                number = item.get('image') if isinstance(item.get('image'), int) else position
+                sections.setdefault(number, item)
+        return sections
+
+
+PARSERS = {
+    TextResponseParser.name: TextResponseParser,
+    JsonResponseParser.name: JsonResponseParser
+}
+
+
+def parser_from_config(config):
+    """Returns the parser named by parsing.mode (default 'text')."""
+    mode = ((config.get('parsing', {}) or {}).get('mode') or 'text').lower()
+    if mode not in PARSERS:
+        raise ValueError(f"Unknown parsing mode '{mode}', expected one of {sorted(PARSERS)}")
+    return PARSERS[mode]()
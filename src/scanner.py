@@ -0,0 +1,163 @@
+"""
+Streaming directory scanner that feeds images to the pipeline as they are found.
+"""
+import fnmatch
+import os
+import queue
+import threading
+from pathlib import Path
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'}
+
+_DONE = object()
+
+
+class ImageScanner:
+    """
+    Walks a directory tree with os.scandir on a background thread.
+
+    Images are yielded as soon as they are found, in a stable order (entries
+    sorted by name, a directory's files before its subdirectories), while
+    `found` keeps counting ahead of the consumer. `total` becomes available
+    once the whole tree has been scanned. Since every path is listed before
+    it is handed out, files moved by the consumer are never miscounted.
+    """
+
+    def __init__(self, root, recursive=False, include=None, exclude=None, max_depth=None,
+                 extensions=IMAGE_EXTENSIONS):
+        self.root = str(root)
+        self.max_depth = max_depth if recursive else 0
+        self.include = list(include or [])
+        self.exclude = list(exclude or [])
+        self.extensions = {ext.lower() for ext in extensions}
+        self.found = 0
+        self.done = False
+        self.error = None
+        self._queue = queue.Queue()
+        self._thread = None
+
+    @classmethod
+    def from_config(cls, root, config, recursive=False):
+        """Builds a scanner using the scanning section of the config."""
+        settings = config.get('scanning', {}) or {}
+        return cls(
+            root,
+            recursive=recursive,
+            include=settings.get('include'),
+            exclude=settings.get('exclude'),
+            max_depth=settings.get('max_depth')
+        )
+
+    @property
+    def total(self):
+        """Number of images in the tree, or None while still scanning."""
+        return self.found if self.done else None
+
+    def progress(self):
+        """Returns the total for progress output, e.g. '1234' or '567+' while counting."""
+        return str(self.found) if self.done else f"{self.found}+"
+
+    def wait(self):
+        """Blocks until the whole tree has been scanned; returns the total."""
+        self.start()._thread.join()
+        return self.found
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._scan, daemon=True)
+            self._thread.start()
+        return self
+
+    def __iter__(self):
+        self.start()
+        while True:
+            item = self._queue.get()
+            if item is _DONE:
+                break
+            yield Path(item)
+        if self.error:
+            raise self.error
+
+    def scan(self):
+        """Walks the tree on the calling thread, yielding image paths as strings."""
+        return self._walk(self.root, '', 0)
+
+    def _scan(self):
+        try:
+            for path in self.scan():
+                self.found += 1
+                self._queue.put(path)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._queue.put(_DONE)
+
+    def _walk(self, directory, relative, depth):
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError as e:
+            if depth == 0:
+                raise
+            print(f"Skipping unreadable directory {directory}: {e}")
+            return
+
+        subdirectories = []
+        for entry in entries:
+            entry_relative = f"{relative}{entry.name}"
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if (self.max_depth is None or depth < self.max_depth) \
+                            and not self._matches(self.exclude, entry_relative, entry.name):
+                        subdirectories.append((entry.path, entry_relative + '/'))
+                    continue
+                if not entry.is_file():
+                    continue
+            except OSError:
+                continue
+
+            if os.path.splitext(entry.name)[1].lower() not in self.extensions:
+                continue
+            if self.include and not self._matches(self.include, entry_relative, entry.name):
+                continue
+            if self._matches(self.exclude, entry_relative, entry.name):
+                continue
+            yield entry.path
+
+        for path, subdirectory_relative in subdirectories:
+            yield from self._walk(path, subdirectory_relative, depth + 1)
+
+    @staticmethod
+    def _matches(patterns, relative, name):
+        """Patterns containing '/' match the path relative to the root, others the name."""
+        for pattern in patterns:
+            target = relative if '/' in pattern else name
+            if fnmatch.fnmatchcase(target, pattern):
+                return True
+        return False
+
+
+class ImageList:
+    """
+    A fixed list of image paths with the same iteration and progress
+    interface as ImageScanner, for files named explicitly.
+    """
+
+    def __init__(self, paths):
+        self.paths = [Path(path) for path in paths]
+        self.found = len(self.paths)
+        self.done = True
+
+    @property
+    def total(self):
+        return self.found
+
+    def progress(self):
+        return str(self.found)
+
+    def wait(self):
+        return self.found
+
+    def __iter__(self):
+        return iter(self.paths)
@@ -0,0 +1,219 @@
+"""
+Rate limiting and retry scheduling for OpenAI API requests.
+"""
+import email.utils
+import random
+import threading
+import time
+from collections import deque
+
+import openai
+
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+WINDOW_SECONDS = 60.0
+
+
+class RequestScheduler:
+    """
+    Sits between the evaluator and the API client.
+
+    Enforces requests-per-minute and tokens-per-minute budgets over a sliding
+    one-minute window, retries transient failures with jittered exponential
+    backoff (honouring Retry-After), and adapts the number of requests in
+    flight: halved on rate limits and server errors, grown by one after a
+    full window of successes.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None,
+                 max_concurrency=1, max_retries=5, backoff_base=1.0,
+                 backoff_max=60.0, estimated_tokens=1000, logger=None,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.estimated_tokens = estimated_tokens
+        self.logger = logger
+        self._clock = clock
+        self._sleep = sleep
+
+        self._condition = threading.Condition()
+        self._window = deque()  # [timestamp, tokens] per request sent
+        self._in_flight = 0
+        self._limit = self.max_concurrency
+        self._successes = 0
+        self._last_decrease = None
+
+        self.stats = {
+            'requests': 0,
+            'retries': 0,
+            'rate_limited': 0,
+            'server_errors': 0,
+            'failed': 0
+        }
+
+    @classmethod
+    def from_config(cls, config, logger=None):
+        """Builds a scheduler from the rate_limits and processing config sections."""
+        limits = config.get('rate_limits', {}) or {}
+        processing = config.get('processing', {}) or {}
+        return cls(
+            requests_per_minute=limits.get('requests_per_minute'),
+            tokens_per_minute=limits.get('tokens_per_minute'),
+            max_concurrency=processing.get('concurrency', 1),
+            max_retries=limits.get('max_retries', 5),
+            backoff_base=limits.get('backoff_base', 1.0),
+            backoff_max=limits.get('backoff_max', 60.0),
+            estimated_tokens=limits.get('estimated_tokens_per_request', 1000),
+            logger=logger
+        )
+
+    @property
+    def concurrency_limit(self):
+        return self._limit
+
+    def resize(self, max_concurrency):
+        """Changes the upper bound on requests in flight."""
+        with self._condition:
+            self.max_concurrency = max(1, int(max_concurrency))
+            self._limit = self.max_concurrency
+            self._condition.notify_all()
+
+    def call(self, request_fn):
+        """
+        Runs request_fn() within the budgets, retrying transient failures.
+        Returns the response; raises the last error once retries run out.
+        """
+        attempt = 0
+        while True:
+            entry = self._acquire()
+            try:
+                response = request_fn()
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                self._release(entry, 0, success=False, retryable=delay is not None)
+                if delay is None or attempt >= self.max_retries:
+                    with self._condition:
+                        self.stats['failed'] += 1
+                    raise
+                attempt += 1
+                with self._condition:
+                    self.stats['retries'] += 1
+                if self.logger:
+                    self.logger.warning(
+                        f"Request failed ({e.__class__.__name__}), "
+                        f"retry {attempt}/{self.max_retries} in {delay:.2f}s"
+                    )
+                self._sleep(delay)
+                continue
+
+            usage = getattr(response, 'usage', None)
+            tokens = getattr(usage, 'total_tokens', None) or self.estimated_tokens
+            self._release(entry, tokens, success=True)
+            return response
+
+    def _acquire(self):
+        with self._condition:
+            while True:
+                now = self._clock()
+                self._expire(now)
+                wait = self._budget_wait(now)
+                if self._in_flight < self._limit and wait == 0:
+                    entry = [now, self.estimated_tokens]
+                    self._window.append(entry)
+                    self._in_flight += 1
+                    self.stats['requests'] += 1
+                    return entry
+                if self._in_flight >= self._limit:
+                    self._condition.wait()
+                else:
+                    self._condition.wait(timeout=wait)
+
+    def _release(self, entry, tokens, success, retryable=False):
+        with self._condition:
+            entry[1] = tokens
+            self._in_flight -= 1
+            if success:
+                self._successes += 1
+                if self._successes >= self._limit and self._limit < self.max_concurrency:
+                    self._limit += 1
+                    self._successes = 0
+            elif retryable:
+                self._successes = 0
+                now = self._clock()
+                # Halve at most once per second so a burst of simultaneous
+                # failures does not collapse the limit to one
+                if self._last_decrease is None or now - self._last_decrease >= 1.0:
+                    self._limit = max(1, self._limit // 2)
+                    self._last_decrease = now
+            self._condition.notify_all()
+
+    def _expire(self, now):
+        while self._window and now - self._window[0][0] >= WINDOW_SECONDS:
+            self._window.popleft()
+
+    def _budget_wait(self, now):
+        """Seconds until another request fits in the RPM and TPM budgets."""
+        wait = 0.0
+        if self.requests_per_minute and len(self._window) >= self.requests_per_minute:
+            index = len(self._window) - self.requests_per_minute
+            wait = max(wait, self._window[index][0] + WINDOW_SECONDS - now)
+        if self.tokens_per_minute:
+            used = sum(tokens for _, tokens in self._window)
+            for timestamp, tokens in self._window:
+                if used + self.estimated_tokens <= self.tokens_per_minute:
+                    break
+                used -= tokens
+                wait = max(wait, timestamp + WINDOW_SECONDS - now)
+        return max(0.0, wait)
+
+    def _retry_delay(self, error, attempt):
+        """Returns seconds to wait before retrying, or None if not retryable."""
+        if isinstance(error, openai.APIConnectionError):
+            pass
+        elif isinstance(error, openai.APIStatusError):
+            status = error.status_code
+            if status == 429:
+                with self._condition:
+                    self.stats['rate_limited'] += 1
+            elif status >= 500:
+                with self._condition:
+                    self.stats['server_errors'] += 1
+            elif status not in RETRYABLE_STATUS_CODES:
+                return None
+            retry_after = parse_retry_after(error.response.headers)
+            if retry_after is not None:
+                return min(retry_after, self.backoff_max)
+        else:
+            return None
+
+        # Full jitter exponential backoff
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+
+def parse_retry_after(headers):
+    """
+    Reads retry-after-ms / retry-after from response headers.
+    Returns the delay in seconds, or None if absent or unparseable.
+    """
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
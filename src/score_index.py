@@ -0,0 +1,304 @@
+"""
+SQLite index of evaluated images for score queries and re-bucketing.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+
+from file_handler import determine_folder, move_file
+from log_sink import CHARACTERISTIC_FIELDS
+
+NUMERIC_FIELDS = ['score'] + CHARACTERISTIC_FIELDS
+TEXT_FIELDS = {'date': 'evaluated_at', 'path': 'path', 'source': 'source', 'status': 'status'}
+OPERATORS = ('>=', '<=', '!=', '=', '>', '<')
+
+_CONDITION = re.compile(r'^\s*([a-z_]+)\s*(>=|<=|!=|=|>|<)\s*(.*?)\s*$')
+_BUCKET_FOLDER = re.compile(r'^\d+-\d+$')
+# Sorts after any character a path can contain, to turn a prefix into a range
+_PREFIX_END = '\U0010ffff'
+_COMMIT_EVERY = 1000
+
+
+def parse_condition(text):
+    """
+    Parses a condition such as "score>=85", "lighting>=8",
+    "date>=2026-01-01" or "path=/photos/2026/*" (a trailing * matches a
+    prefix). Returns tuple of (field, operator, value).
+    """
+    match = _CONDITION.match(text)
+    if not match:
+        raise ValueError(f"Cannot parse condition '{text}', expected e.g. 'score>=85'")
+    field, operator, value = match.groups()
+    if field in NUMERIC_FIELDS:
+        try:
+            value = float(value) if '.' in value else int(value)
+        except ValueError:
+            raise ValueError(f"Condition '{text}' needs a number")
+    elif field not in TEXT_FIELDS:
+        raise ValueError(f"Unknown field '{field}' in '{text}', expected one of "
+                         f"{NUMERIC_FIELDS + sorted(TEXT_FIELDS)}")
+    return field, operator, value
+
+
+class ScoreIndex:
+    """
+    One row per evaluated image with its overall score, the ten
+    characteristic scores, the time it was evaluated, its original source
+    and its current path, each indexed so range queries stay fast over
+    millions of rows.
+
+    Rows are added from the evaluation log as it flushes, so the index
+    holds what the log holds; it can be rebuilt from a JSONL log with
+    index_log(). Only scored images are indexed. An image evaluated again
+    (from its source, or from where an earlier run sorted it) replaces its
+    earlier row.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Rebuildable from the evaluation log, so a lost last commit is acceptable
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        columns = ",\n".join(f"                {field} INTEGER" for field in CHARACTERISTIC_FIELDS)
+        self._conn.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS images (
+                id INTEGER PRIMARY KEY,
+                source TEXT NOT NULL UNIQUE,
+                path TEXT NOT NULL,
+                score INTEGER NOT NULL,
+{columns},
+                status TEXT,
+                evaluated_at TEXT
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_images_score ON images (score)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_images_path ON images (path)")
+        # Queries nearly always bound the score too, which these answer from the index alone
+        for field in ['evaluated_at'] + CHARACTERISTIC_FIELDS:
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_images_{field} ON images ({field}, score)")
+        self._conn.commit()
+
+    @classmethod
+    def from_config(cls, config):
+        """Opens the index described by the score_index config section, or returns None if disabled."""
+        settings = config.get('score_index', {}) or {}
+        if not settings.get('enabled', True):
+            return None
+        db_path = os.path.join(
+            config['directories']['logs'],
+            settings.get('file', 'score_index.sqlite')
+        )
+        return cls(db_path)
+
+    def add_records(self, records, moved=True):
+        """
+        Indexes log records from make_record, skipping those without a
+        score. An image is indexed at its destination if `moved`, at its
+        source if not (a score-only run only plans the move), and with
+        `moved` None wherever it is found. Returns the number indexed.
+        """
+        rows = []
+        for record in records:
+            if not isinstance(record.get('score'), int) or not record.get('source'):
+                continue
+            source = os.path.abspath(record['source'])
+            destination = record['destination'] and os.path.abspath(record['destination'])
+            if moved is None:
+                at_destination = bool(destination) and os.path.exists(destination) and not os.path.exists(source)
+            else:
+                at_destination = moved and bool(destination)
+            path = destination if at_destination else source
+            rows.append(
+                [source, path, record['score']]
+                + [record.get(field) for field in CHARACTERISTIC_FIELDS]
+                + [record.get('status'), record.get('timestamp')]
+            )
+        if not rows:
+            return 0
+        placeholders = ', '.join('?' * len(rows[0]))
+        columns = ', '.join(['source', 'path', 'score'] + CHARACTERISTIC_FIELDS + ['status', 'evaluated_at'])
+        with self._lock:
+            for row in rows:
+                # A sorted image evaluated again from its new location replaces its old row
+                self._conn.execute("DELETE FROM images WHERE path = ? AND source != ?", (row[0], row[0]))
+                self._conn.execute(f"INSERT OR REPLACE INTO images ({columns}) VALUES ({placeholders})", row)
+            self._conn.commit()
+        return len(rows)
+
+    def record_moves(self, moves):
+        """
+        Updates the paths of indexed images moved outside the pipeline,
+        e.g. by applying or rolling back a manifest. `moves` is a list of
+        (old_path, new_path) in the order they were made.
+        """
+        moves = [(os.path.abspath(new), os.path.abspath(old)) for old, new in moves]
+        for start in range(0, len(moves), _COMMIT_EVERY):
+            with self._lock:
+                self._conn.executemany("UPDATE images SET path = ? WHERE path = ?",
+                                       moves[start:start + _COMMIT_EVERY])
+                self._conn.commit()
+
+    def _where(self, conditions):
+        """Turns conditions (strings or (field, operator, value) tuples) into SQL."""
+        clauses, parameters = [], []
+        for condition in conditions:
+            field, operator, value = parse_condition(condition) if isinstance(condition, str) else condition
+            if operator not in OPERATORS:
+                raise ValueError(f"Unknown operator '{operator}', expected one of {OPERATORS}")
+            if field in NUMERIC_FIELDS:
+                column = field
+            elif field in TEXT_FIELDS:
+                column = TEXT_FIELDS[field]
+            else:
+                raise ValueError(f"Unknown field '{field}'")
+            if column in ('path', 'source'):
+                value = str(value)
+                if value.endswith('*') and operator in ('=', '!='):
+                    prefix = os.path.abspath(value[:-1]) + (os.sep if value[:-1].endswith(os.sep) else '')
+                    clause = f"{column} >= ? AND {column} < ?"
+                    clauses.append(clause if operator == '=' else f"NOT ({clause})")
+                    parameters += [prefix, prefix + _PREFIX_END]
+                    continue
+                value = os.path.abspath(value)
+            clauses.append(f"{column} {operator} ?")
+            parameters.append(value)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), parameters
+
+    def query(self, *conditions, order_by='score', descending=True, limit=None):
+        """
+        Returns the images matching every condition as dicts with source,
+        path, score, the characteristic fields, status and evaluated_at,
+        ordered by `order_by` (a numeric field, 'date' or 'path').
+        """
+        where, parameters = self._where(conditions)
+        column = TEXT_FIELDS.get(order_by, order_by)
+        if column not in NUMERIC_FIELDS + list(TEXT_FIELDS.values()):
+            raise ValueError(f"Cannot order by '{order_by}'")
+        direction = 'DESC' if descending else 'ASC'
+        # Ties in insertion order, so the index on `column` also gives the order
+        sql = (f"SELECT * FROM images{where} ORDER BY {column} {direction}, id {direction}"
+               + (" LIMIT ?" if limit else ""))
+        if limit:
+            parameters.append(int(limit))
+        with self._lock:
+            cursor = self._conn.execute(sql, parameters)
+            names = [description[0] for description in cursor.description]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    def count(self, *conditions):
+        """Returns the number of images matching every condition."""
+        where, parameters = self._where(conditions)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM images{where}", parameters).fetchone()[0]
+
+    def histogram(self, *conditions, interval=3):
+        """Returns a dict of bucket folder name -> number of matching images."""
+        where, parameters = self._where(conditions)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT score, COUNT(*) FROM images{where} GROUP BY score", parameters
+            ).fetchall()
+        buckets = {}
+        for score, count in rows:
+            folder = determine_folder(score, interval)
+            buckets[folder] = buckets.get(folder, 0) + count
+        return buckets
+
+    def rebucket(self, output_dir, interval, dry_run=False):
+        """
+        Moves the indexed images under `output_dir` into score folders
+        `interval` points wide, using their stored scores, and removes the
+        score folders left empty. Images whose name is already taken in
+        their new folder are left in place. With `dry_run` nothing is moved.
+        Returns a dict of counts: moved, unchanged, missing and conflicts.
+        """
+        output_dir = os.path.abspath(output_dir)
+        prefix = output_dir + os.sep
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, path, score FROM images WHERE path >= ? AND path < ?",
+                (prefix, prefix + _PREFIX_END)
+            ).fetchall()
+
+        stats = {'moved': 0, 'unchanged': 0, 'missing': 0, 'conflicts': 0}
+        updates = []
+        for row_id, path, score in rows:
+            destination = os.path.join(output_dir, determine_folder(score, interval), os.path.basename(path))
+            if destination == path:
+                stats['unchanged'] += 1
+                continue
+            if not os.path.exists(path):
+                # Moved by an earlier, interrupted rebucket
+                if os.path.exists(destination):
+                    updates.append((destination, row_id))
+                    stats['moved'] += 1
+                else:
+                    stats['missing'] += 1
+                continue
+            if os.path.lexists(destination):
+                stats['conflicts'] += 1
+                continue
+            if not dry_run:
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                move_file(path, destination)
+                updates.append((destination, row_id))
+                if len(updates) >= _COMMIT_EVERY:
+                    self._update_paths(updates)
+                    updates = []
+            stats['moved'] += 1
+        if not dry_run:
+            self._update_paths(updates)
+            self._remove_empty_buckets(output_dir)
+        return stats
+
+    def _update_paths(self, updates):
+        with self._lock:
+            self._conn.executemany("UPDATE images SET path = ? WHERE id = ?", updates)
+            self._conn.commit()
+
+    def _remove_empty_buckets(self, output_dir):
+        for name in os.listdir(output_dir):
+            folder = os.path.join(output_dir, name)
+            if _BUCKET_FOLDER.match(name) and os.path.isdir(folder) and not os.listdir(folder):
+                os.rmdir(folder)
+
+    @property
+    def size(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.execute("PRAGMA optimize")
+            self._conn.close()
+
+
+def index_log(index, log_path):
+    """
+    Adds the scored images in a JSONL evaluation log to the index, at the
+    destination the log names if the image is there and at its source
+    otherwise. Images moved since by rebucket are indexed where the log
+    last put them. Returns tuple of (added, skipped).
+    """
+    added = skipped = 0
+    batch = []
+    with open(log_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                batch.append(json.loads(line))
+            except ValueError:
+                skipped += 1
+                continue
+            if len(batch) >= _COMMIT_EVERY:
+                indexed = index.add_records(batch, moved=None)
+                added, skipped = added + indexed, skipped + len(batch) - indexed
+                batch = []
+    indexed = index.add_records(batch, moved=None)
+    return added + indexed, skipped + len(batch) - indexed
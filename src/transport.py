@@ -0,0 +1,175 @@
+"""
+HTTP transport for the OpenAI client: connection pooling, keep-alive,
+HTTP/2, timeouts, optional request compression and per-phase timings.
+"""
+import gzip
+import threading
+import time
+from collections import deque
+
+import httpx
+
+DEFAULT_HTTP_SETTINGS = {
+    'max_connections': 100,
+    'max_keepalive_connections': 20,  # 0 disables connection reuse
+    'keepalive_expiry': 30.0,  # Seconds an idle connection is kept open
+    'http2': False,  # Needs the h2 package (pip install 'httpx[http2]')
+    'connect_timeout': 10.0,
+    'read_timeout': 120.0,
+    'write_timeout': 60.0,
+    'pool_timeout': 30.0,
+    'verify': True,  # False, or a CA bundle path for a private endpoint
+    'compress_requests': False,  # gzip request bodies; the endpoint must accept it
+    'compress_min_bytes': 1024
+}
+
+PHASES = ('connect', 'upload', 'ttfb', 'total')
+
+
+class TransportStats:
+    """
+    Collects per-request phase timings in seconds:
+    connect (TCP and TLS setup; zero on a reused connection), upload (sending
+    headers and body), ttfb (body sent to response headers received) and
+    total (request start to response body read).
+    """
+
+    def __init__(self, keep=10000):
+        self._lock = threading.Lock()
+        self.requests = deque(maxlen=keep)
+        self.totals = {'requests': 0, 'connections': 0, 'bytes_sent': 0, 'bytes_saved': 0}
+
+    def record(self, timings, new_connection, bytes_sent, bytes_saved=0):
+        with self._lock:
+            self.requests.append(timings)
+            self.totals['requests'] += 1
+            self.totals['connections'] += 1 if new_connection else 0
+            self.totals['bytes_sent'] += bytes_sent
+            self.totals['bytes_saved'] += bytes_saved
+
+    def summary(self):
+        """Returns totals plus mean and p95 per phase, in milliseconds."""
+        with self._lock:
+            requests = list(self.requests)
+            summary = dict(self.totals)
+        for phase in PHASES:
+            values = sorted(timings[phase] for timings in requests if phase in timings)
+            if values:
+                summary[phase] = {
+                    'mean_ms': round(sum(values) / len(values) * 1000, 1),
+                    'p95_ms': round(values[min(len(values) - 1, int(len(values) * 0.95))] * 1000, 1)
+                }
+        return summary
+
+
+class _RequestTrace:
+    """httpcore trace callback that timestamps the phases of one request."""
+
+    def __init__(self, on_complete):
+        self.start = time.perf_counter()
+        self.marks = {}
+        self.on_complete = on_complete
+
+    def __call__(self, event_name, info):
+        # Event names look like 'connection.connect_tcp.started' or
+        # 'http11.receive_response_headers.complete'; http2 uses 'http2.'
+        step = event_name.split('.', 1)[1] if '.' in event_name else event_name
+        self.marks.setdefault(step, time.perf_counter())
+        if step == 'response_closed.complete':
+            self.on_complete(self)
+
+    def timings(self):
+        marks = self.marks
+        timings = {'total': marks['response_closed.complete'] - self.start}
+        if 'connect_tcp.started' in marks:
+            end = marks.get('start_tls.complete') or marks.get('connect_tcp.complete')
+            timings['connect'] = end - marks['connect_tcp.started'] if end else 0.0
+        else:
+            timings['connect'] = 0.0
+        sent = marks.get('send_request_body.complete')
+        if 'send_request_headers.started' in marks and sent:
+            timings['upload'] = sent - marks['send_request_headers.started']
+        if sent and 'receive_response_headers.complete' in marks:
+            timings['ttfb'] = marks['receive_response_headers.complete'] - sent
+        return timings
+
+
+class TimedTransport(httpx.HTTPTransport):
+    """
+    HTTPTransport that records phase timings for every request and can
+    gzip large request bodies (the base64 images) before sending.
+    """
+
+    def __init__(self, stats, compress_requests=False, compress_min_bytes=1024, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = stats
+        self.compress_requests = compress_requests
+        self.compress_min_bytes = compress_min_bytes
+
+    def handle_request(self, request):
+        body = request.read()
+        bytes_saved = 0
+        if (self.compress_requests and len(body) >= self.compress_min_bytes
+                and 'content-encoding' not in request.headers):
+            compressed = gzip.compress(body, compresslevel=5)
+            if len(compressed) < len(body):
+                bytes_saved = len(body) - len(compressed)
+                headers = request.headers.copy()
+                headers['Content-Encoding'] = 'gzip'
+                headers['Content-Length'] = str(len(compressed))
+                request = httpx.Request(
+                    request.method, request.url, headers=headers,
+                    content=compressed, extensions=request.extensions
+                )
+                body = compressed
+
+        def complete(trace):
+            self.stats.record(
+                trace.timings(), 'connect_tcp.started' in trace.marks, len(body), bytes_saved
+            )
+
+        request.extensions = {**request.extensions, 'trace': _RequestTrace(complete)}
+        return super().handle_request(request)
+
+
+def build_http_client(config, logger=None):
+    """
+    Builds the httpx client the OpenAI client sends requests through, from
+    the http section of the config.
+    Returns tuple of (client, stats).
+    """
+    settings = {**DEFAULT_HTTP_SETTINGS, **(config.get('http', {}) or {})}
+    http2 = bool(settings['http2'])
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            if logger:
+                logger.warning("http.http2 needs the h2 package (pip install 'httpx[http2]'), "
+                               "using HTTP/1.1")
+            http2 = False
+
+    stats = TransportStats()
+    transport = TimedTransport(
+        stats,
+        compress_requests=settings['compress_requests'],
+        compress_min_bytes=settings['compress_min_bytes'],
+        verify=settings['verify'],
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=settings['max_connections'],
+            max_keepalive_connections=settings['max_keepalive_connections'],
+            keepalive_expiry=settings['keepalive_expiry']
+        )
+    )
+    client = httpx.Client(
+        transport=transport,
+        timeout=httpx.Timeout(
+            connect=settings['connect_timeout'],
+            read=settings['read_timeout'],
+            write=settings['write_timeout'],
+            pool=settings['pool_timeout']
+        ),
+        follow_redirects=True
+    )
+    return client, stats
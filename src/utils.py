@@ -1,22 +1,86 @@
 """
 Utility functions for the image evaluator.
 """
-import base64
+import binascii
 import logging
 import os
 from pathlib import Path
 
+# Bytes encoded per step; a multiple of 3 so chunks need no padding
+BASE64_CHUNK_SIZE = 3 * 1024 * 1024
+
+def _encode_chunks(chunks, size, prefix):
+    """
+    Base64-encodes `chunks` (about `size` bytes in total) into one buffer
+    allocated up front, behind `prefix`, and returns it as a str.
+    """
+    prefix = prefix.encode('ascii')
+    encoded = bytearray(len(prefix) + (size + 2) // 3 * 4)
+    encoded[:len(prefix)] = prefix
+    position = len(prefix)
+    for chunk in chunks:
+        piece = binascii.b2a_base64(chunk, newline=False)
+        encoded[position:position + len(piece)] = piece
+        position += len(piece)
+    # The size was only a hint if a file changed while it was read
+    del encoded[position:]
+    return encoded.decode('ascii')
+
+def encode_base64(data, prefix=''):
+    """
+    Base64-encodes a bytes-like object into a str that starts with `prefix`
+    (e.g. "data:image/png;base64,"), without a full-size intermediate
+    bytes object.
+    """
+    with memoryview(data) as source, source.cast('B') as view:
+        return _encode_chunks(
+            (view[start:start + BASE64_CHUNK_SIZE] for start in range(0, len(view), BASE64_CHUNK_SIZE)),
+            len(view), prefix
+        )
+
+def encode_file_base64(path, prefix=''):
+    """
+    Base64-encodes a file read in fixed-size chunks, so its raw contents
+    are never held in memory at once.
+    """
+    def read_chunks(f):
+        buffer = bytearray(BASE64_CHUNK_SIZE)
+        with memoryview(buffer) as view:
+            while True:
+                count = f.readinto(buffer)
+                if not count:
+                    return
+                yield view[:count]
+
+    with open(path, 'rb') as f:
+        return _encode_chunks(read_chunks(f), os.fstat(f.fileno()).st_size, prefix)
+
 def get_image_base64(image_path):
     """
     Converts an image to base64 encoding.
     """
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+    return encode_file_base64(image_path)
+
+def merge_config(config, overrides):
+    """
+    Returns `config` with `overrides` merged in; nested dicts are merged
+    key by key, any other value replaces the original.
+    """
+    merged = dict(config or {})
+    for key, value in (overrides or {}).items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_config(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
 
 def setup_logging():
     """Setup logging configuration."""
     logger = logging.getLogger('image_evaluator')
     logger.setLevel(logging.INFO)
+    if logger.handlers:
+        # Already configured by an earlier evaluator in this process
+        return logger
     
     # Create logs directory if it doesn't exist
     log_dir = Path('logs')
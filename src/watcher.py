@@ -0,0 +1,285 @@
+"""
+Watch-folder daemon that evaluates and sorts images as they arrive.
+"""
+import json
+import os
+import queue
+import signal
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+from scanner import ImageScanner
+
+
+class FolderWatcher:
+    """
+    Polls one or more directories and reports images once they have
+    stopped changing.
+
+    Each poll lists the trees with os.scandir (through ImageScanner, so the
+    scanning include/exclude/max_depth settings apply) and stats only new or
+    still-settling files. A file is ready once its size and modification
+    time have been unchanged for `settle_time` seconds, so copies that are
+    still being written are never picked up half-finished. Each path is
+    reported once for as long as it stays in place.
+    """
+
+    def __init__(self, scanners, settle_time=2.0, poll_interval=1.0, clock=time.monotonic):
+        self.scanners = list(scanners)
+        self.settle_time = settle_time
+        self.poll_interval = poll_interval
+        self._clock = clock
+        self._settling = {}  # path -> (size, mtime_ns, first_seen, unchanged_since)
+        self._reported = set()
+
+    @property
+    def settling(self):
+        """Number of images seen but not yet stable."""
+        return len(self._settling)
+
+    def poll(self):
+        """
+        Scans once. Returns a list of (path, root, first_seen) for images
+        that became ready since the last poll, first_seen being the clock
+        value when the image was first noticed.
+        """
+        now = self._clock()
+        present = set()
+        ready = []
+        for scanner in self.scanners:
+            try:
+                paths = list(scanner.scan())
+            except OSError as e:
+                print(f"Cannot scan {scanner.root}: {e}")
+                continue
+            for path in paths:
+                present.add(path)
+                if path in self._reported:
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                signature = (stat.st_size, stat.st_mtime_ns)
+                previous = self._settling.get(path)
+                if previous is None:
+                    self._settling[path] = signature + (now, now)
+                elif previous[:2] != signature:
+                    self._settling[path] = signature + (previous[2], now)
+                elif stat.st_size > 0 and now - previous[3] >= self.settle_time:
+                    del self._settling[path]
+                    self._reported.add(path)
+                    ready.append((Path(path), scanner.root, previous[2]))
+
+        # Forget files that were moved away or deleted, so a new file
+        # dropped under the same name is picked up again
+        self._reported &= present
+        for path in list(self._settling):
+            if path not in present:
+                del self._settling[path]
+        return ready
+
+
+class WatchDaemon:
+    """
+    Feeds images from watched folders through an ImageEvaluator.
+
+    A watcher thread queues images as they settle; the daemon thread packs
+    them into chunks of processing.images_per_request, keeps up to
+    `concurrency` chunks in flight and sorts each image as soon as its chunk
+    completes. Moves and log writes happen on the daemon thread only.
+
+    Queue depth, in-flight work and latency (from a file first being seen to it
+    being sorted) are logged every `status_interval` seconds and written to
+    `status_file` as JSON. stop() (or SIGINT/SIGTERM under run()) stops
+    picking up new work, waits for every chunk already in flight and flushes
+    the log; queued images stay in the inbox for the next start. Images
+    that fail to evaluate are left in place and retried after a restart.
+    When the budget's limit is reached the daemon pauses, keeping new
+    images queued until the next budget period.
+    """
+
+    def __init__(self, evaluator, directories, recursive=False, concurrency=None,
+                 settle_time=2.0, poll_interval=1.0, status_interval=60.0, status_file=None):
+        self.evaluator = evaluator
+        self.roots = [os.path.abspath(directory) for directory in directories]
+        processing = evaluator.config.get('processing', {}) or {}
+        if concurrency is None:
+            concurrency = processing.get('concurrency', 1)
+        self.concurrency = max(1, int(concurrency))
+        self.images_per_request = max(1, int(processing.get('images_per_request', 1)))
+        self.status_interval = status_interval
+        self.status_file = status_file
+        self.watcher = FolderWatcher(
+            [ImageScanner.from_config(root, evaluator.config, recursive=recursive)
+             for root in self.roots],
+            settle_time=settle_time,
+            poll_interval=poll_interval
+        )
+
+        self.stats = {'processed': 0, 'sorted': 0, 'failed': 0}
+        self._queue = queue.Queue()
+        self._in_flight = {}  # future -> list of (path, first_seen)
+        self._latencies = deque(maxlen=1000)
+        self._stopping = threading.Event()
+        self._last_status = time.monotonic()
+
+    @classmethod
+    def from_config(cls, evaluator, directories=None, recursive=None, concurrency=None):
+        """Builds the daemon from the watch section of the evaluator's config."""
+        settings = evaluator.config.get('watch', {}) or {}
+        directories = directories or settings.get('directories') or []
+        if not directories:
+            raise ValueError("No directories to watch (set watch.directories or pass them in)")
+        status_file = settings.get('status_file', 'watch_status.json')
+        return cls(
+            evaluator,
+            directories,
+            recursive=settings.get('recursive', False) if recursive is None else recursive,
+            concurrency=concurrency,
+            settle_time=settings.get('settle_time', 2.0),
+            poll_interval=settings.get('poll_interval', 1.0),
+            status_interval=settings.get('status_interval', 60.0),
+            status_file=(
+                os.path.join(evaluator.config['directories']['logs'], status_file)
+                if status_file else None
+            )
+        )
+
+    def status(self):
+        """Returns a snapshot of queue depth, in-flight work and latency."""
+        latencies = sorted(self._latencies)
+        return {
+            'queued': self._queue.qsize(),
+            'settling': self.watcher.settling,
+            'in_flight': sum(len(chunk) for chunk in list(self._in_flight.values())),
+            'processed': self.stats['processed'],
+            'sorted': self.stats['sorted'],
+            'failed': self.stats['failed'],
+            'latency_p50': round(latencies[len(latencies) // 2], 3) if latencies else None,
+            'latency_max': round(latencies[-1], 3) if latencies else None,
+            'budget_blocked': self.evaluator.budget.blocked if self.evaluator.budget else None,
+            'updated_at': time.time()
+        }
+
+    def stop(self):
+        """Asks the daemon to drain in-flight work and return from run()."""
+        self._stopping.set()
+
+    def run(self):
+        """Runs until stop() or SIGINT/SIGTERM, then drains and returns."""
+        previous_handlers = {}
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                previous_handlers[signum] = signal.signal(signum, lambda *_: self.stop())
+
+        evaluator = self.evaluator
+        evaluator.scheduler.resize(self.concurrency)
+        if evaluator.journal:
+            for root in self.roots:
+                evaluator.journal.start(root, resume=True)
+                evaluator._recover_journal(root)
+
+        watcher_thread = threading.Thread(target=self._watch, daemon=True)
+        watcher_thread.start()
+        print(f"Watching {', '.join(self.roots)} (Ctrl+C to stop)")
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                while not self._stopping.is_set():
+                    self._submit(executor)
+                    self._collect(timeout=0.2)
+                    self._report_status()
+                # Drain: no new chunks, finish everything already sent
+                if self._in_flight:
+                    print(f"Stopping: waiting for {len(self._in_flight)} requests in flight")
+                while self._in_flight:
+                    self._collect(timeout=None)
+        finally:
+            watcher_thread.join()
+            evaluator.evaluation_log.flush()
+            self._report_status(force=True)
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+        print(f"Stopped after sorting {self.stats['sorted']} images "
+              f"({self.stats['failed']} failed, {self._queue.qsize()} left queued)")
+
+    def _watch(self):
+        while not self._stopping.is_set():
+            for path, root, first_seen in self.watcher.poll():
+                if self.evaluator.journal:
+                    self.evaluator.journal.discover(root, os.path.abspath(path))
+                self._queue.put((path, first_seen))
+            self._stopping.wait(self.watcher.poll_interval)
+
+    def _submit(self, executor):
+        while len(self._in_flight) < self.concurrency:
+            chunk = []
+            budget = self.evaluator.budget
+            # Only this thread takes from the queue, so an image seen here is
+            # still there once reserved and every reservation is used
+            while len(chunk) < self.images_per_request and not self._queue.empty():
+                # Out of budget: leave files queued until the next period
+                if budget and not budget.reserve():
+                    break
+                chunk.append(self._queue.get_nowait())
+            if not chunk:
+                return
+            future = executor.submit(
+                self.evaluator.evaluate_chunk, [path for path, _ in chunk], True
+            )
+            self._in_flight[future] = chunk
+
+    def _collect(self, timeout):
+        if not self._in_flight:
+            if timeout is not None:
+                self._stopping.wait(timeout)
+            return
+        done, _ = wait(list(self._in_flight), timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            chunk = self._in_flight.pop(future)
+            try:
+                outcomes = future.result()
+            except Exception as e:
+                self.evaluator.logger.error(f"Chunk evaluation failed: {str(e)}")
+                outcomes = [((None, str(e), None), {'latency': None})] * len(chunk)
+            for (path, first_seen), (result, details) in zip(chunk, outcomes):
+                self._sort(path, first_seen, result, details)
+
+    def _sort(self, path, first_seen, result, details):
+        self.stats['processed'] += 1
+        if self.evaluator.budget:
+            self.evaluator.budget.release()
+        try:
+            folder_name = self.evaluator.sort_image(path, result, details)
+        except OSError as e:
+            self.evaluator.logger.error(f"Could not sort {path}: {str(e)}")
+            folder_name = None
+        if folder_name:
+            self.stats['sorted'] += 1
+            print(f"Sorted {path.name} into {folder_name} (score {result[0]})")
+        else:
+            self.stats['failed'] += 1
+            print(f"Failed to evaluate {path.name}: {result[1]}")
+        self._latencies.append(time.monotonic() - first_seen)
+
+    def _report_status(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_status < self.status_interval:
+            return
+        self._last_status = now
+        status = self.status()
+        latency = f"{status['latency_p50']}s" if status['latency_p50'] is not None else "n/a"
+        self.evaluator.logger.info(
+            f"Watch status: {status['queued']} queued, {status['settling']} settling, "
+            f"{status['in_flight']} in flight, {status['sorted']} sorted, "
+            f"latency p50 {latency}"
+        )
+        if self.status_file:
+            temporary = self.status_file + '.tmp'
+            with open(temporary, 'w') as f:
+                json.dump(status, f)
+            os.replace(temporary, self.status_file)
+        self.evaluator.metrics.write()
@@ -0,0 +1,128 @@
+import json
+import logging
+import os
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('openai')
+
+from batch_api import BatchRunner
+
+
+class Crash(BaseException):
+    """Stands in for the process dying while it waits for a batch."""
+
+
+class FakeClient:
+    """Files and batches endpoints answering every request with a score of 70."""
+
+    def __init__(self):
+        self.uploads = 0
+        self.batches_created = 0
+        self.crash_on_poll = False
+        self._inputs = {}
+        self._outputs = {}
+        self.files = SimpleNamespace(create=self._create_file, content=self._content)
+        self.batches = SimpleNamespace(create=self._create_batch, retrieve=self._retrieve)
+
+    def _create_file(self, file, purpose):
+        self.uploads += 1
+        file_id = f"file_{self.uploads}"
+        self._inputs[file_id] = file.read().decode()
+        return SimpleNamespace(id=file_id)
+
+    def _create_batch(self, input_file_id, endpoint, completion_window):
+        self.batches_created += 1
+        batch_id = f"batch_{self.batches_created}"
+        lines = []
+        for line in self._inputs[input_file_id].splitlines():
+            request = json.loads(line)
+            lines.append(json.dumps({'custom_id': request['custom_id'], 'response': {
+                'status_code': 200,
+                'body': {'choices': [{'message': {'content': '70'}}], 'usage': {'prompt_tokens': 10}}
+            }}))
+        self._outputs[batch_id] = '\n'.join(lines)
+        return SimpleNamespace(id=batch_id)
+
+    def _retrieve(self, batch_id):
+        if self.crash_on_poll:
+            raise Crash()
+        return SimpleNamespace(id=batch_id, status='completed', output_file_id=batch_id,
+                               error_file_id=None, request_counts=None)
+
+    def _content(self, file_id):
+        return SimpleNamespace(text=self._outputs[file_id])
+
+
+class FakeEvaluator:
+    def __init__(self, logs, client):
+        self.config = {'directories': {'logs': logs}, 'batch': {'max_requests_per_batch': 2}}
+        self.client = client
+        self.scheduler = SimpleNamespace(call=lambda function: function())
+        self.logger = logging.getLogger('test_batch_api')
+        self.budget = None
+        # Never hits, so every image goes to a batch
+        self.cache = SimpleNamespace(get=lambda key: None, put=lambda *args: None)
+        self.prompt = 'v1'
+
+    def cache_key(self, file_path):
+        return f"{self.prompt}:{os.path.basename(file_path)}"
+
+    def build_request(self, file_path):
+        return {'model': 'test', 'messages': [str(file_path)]}, {'tokens_saved': 0}
+
+    def parse_response(self, content):
+        return int(content), {'score': int(content)}
+
+
+def make_images(tmp_path, count=3):
+    paths = []
+    for i in range(count):
+        path = tmp_path / 'input' / f"image_{i}.jpg"
+        path.parent.mkdir(exist_ok=True)
+        path.write_bytes(b'jpeg')
+        paths.append(str(path))
+    return paths
+
+
+def run(evaluator, paths, work_dir):
+    runner = BatchRunner(evaluator)
+    runner.work_dir = str(work_dir)
+    return dict(runner.evaluate(paths))
+
+
+def test_rerun_collects_batches_submitted_before_a_crash(tmp_path):
+    client = FakeClient()
+    evaluator = FakeEvaluator(str(tmp_path / 'logs'), client)
+    paths = make_images(tmp_path)
+
+    client.crash_on_poll = True
+    with pytest.raises(Crash):
+        run(evaluator, paths, tmp_path / 'logs' / 'batches' / 'run1')
+    assert client.batches_created == 2
+
+    client.crash_on_poll = False
+    results = run(evaluator, paths, tmp_path / 'logs' / 'batches' / 'run2')
+
+    assert client.batches_created == 2
+    assert {path: result[0] for path, result in results.items()} == {path: 70 for path in paths}
+    # Collected batches are not resumed again
+    results = run(evaluator, paths, tmp_path / 'logs' / 'batches' / 'run3')
+    assert client.batches_created == 4
+
+
+def test_changed_prompt_is_submitted_again(tmp_path):
+    client = FakeClient()
+    evaluator = FakeEvaluator(str(tmp_path / 'logs'), client)
+    paths = make_images(tmp_path, count=1)
+
+    client.crash_on_poll = True
+    with pytest.raises(Crash):
+        run(evaluator, paths, tmp_path / 'logs' / 'batches' / 'run1')
+    client.crash_on_poll = False
+    evaluator.prompt = 'v2'
+    results = run(evaluator, paths, tmp_path / 'logs' / 'batches' / 'run2')
+
+    assert client.batches_created == 2
+    assert results[paths[0]][0] == 70
@@ -0,0 +1,72 @@
+import json
+from datetime import datetime
+
+from budget import Budget, find_price, period_key, scale_forecast
+
+
+def test_prices_fall_back_to_the_model_family():
+    pricing = {'gpt-4o': {'input': 2.5, 'output': 10.0}, 'gpt-4o-mini': {'input': 0.15, 'output': 0.6}}
+    assert find_price(pricing, 'gpt-4o-mini-2024-07-18') == pricing['gpt-4o-mini']
+    assert find_price(pricing, 'gpt-4o-2024-08-06') == pricing['gpt-4o']
+    assert find_price(pricing, 'o1') is None
+
+    budget = Budget(None, 'gpt-4o', period='run')
+    assert budget.cost(1_000_000, 100_000) == 3.5
+    assert budget.cost(1_000_000, 100_000, batch=True) == 1.75
+
+
+def test_period_keys():
+    now = datetime(2026, 10, 16, 12, 0)
+    assert period_key('monthly', now) == '2026-10'
+    assert period_key('daily', now) == '2026-10-16'
+    assert period_key('total', now) == 'total'
+
+
+def test_reserve_and_release():
+    budget = Budget(None, 'gpt-4o', period='run', hard_limit_tokens=350)
+    budget.charge(100, 0)
+
+    assert budget.reserve(images=2)
+    assert not budget.reserve()
+    assert budget.blocked == "hard limit 350 tokens"
+    budget.release()
+    assert budget.reserve()
+    assert budget.blocked is None
+    budget.release(images=5)
+    assert budget._reserved == 0
+
+
+def test_soft_limit_stops_only_when_asked():
+    warn = Budget(None, 'gpt-4o', period='run', soft_limit_tokens=150)
+    stop = Budget(None, 'gpt-4o', period='run', soft_limit_tokens=150, soft_limit_action='stop')
+    for budget in (warn, stop):
+        budget.charge(100, 0)
+
+    assert warn.reserve()
+    assert not stop.reserve()
+    assert stop.blocked == "soft limit 150 tokens"
+
+
+def test_processes_share_the_state_file(tmp_path):
+    state_path = str(tmp_path / 'budget_state.json')
+    first = Budget(state_path, 'gpt-4o', hard_limit_usd=1.0)
+    second = Budget(state_path, 'gpt-4o', hard_limit_usd=1.0)
+    first.charge(200_000, 0)
+    second.charge(100_000, 0)
+    first.flush()
+    second.flush()
+
+    with open(state_path) as f:
+        state = json.load(f)
+    assert state['period'] == period_key('monthly')
+    assert state['prompt_tokens'] == 300_000
+    assert state['by_model']['gpt-4o']['requests'] == 2
+    assert Budget(state_path, 'gpt-4o', hard_limit_usd=1.0).remaining() == {'usd': 0.25, 'tokens': None}
+
+
+def test_scale_forecast():
+    forecast = {'images': 10, 'prompt_tokens_per_image': 900, 'completion_tokens_per_image': 100,
+                'tokens': 10_000, 'cost_usd': 0.02, 'cost_usd_per_image': 0.002}
+    scaled = scale_forecast(forecast, 250)
+    assert scaled['images'] == 250 and scaled['tokens'] == 250_000 and scaled['cost_usd'] == 0.5
+    assert forecast['images'] == 10
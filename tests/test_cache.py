@@ -0,0 +1,54 @@
+import hashlib
+import itertools
+
+import cache
+from cache import EvaluationCache, hash_file
+
+
+def test_hash_file(tmp_path):
+    path = tmp_path / 'a.jpg'
+    path.write_bytes(b'x' * 3000)
+    assert hash_file(str(path), chunk_size=1024) == hashlib.sha256(b'x' * 3000).hexdigest()
+
+
+def test_key_covers_everything_that_shapes_the_response():
+    key = EvaluationCache.make_key('abc', 'Rate this image', 'gpt-4o', 1000)
+    assert key == EvaluationCache.make_key('abc', 'Rate this image', 'gpt-4o', 1000)
+    assert len({
+        key,
+        EvaluationCache.make_key('abd', 'Rate this image', 'gpt-4o', 1000),
+        EvaluationCache.make_key('abc', 'Rate this photo', 'gpt-4o', 1000),
+        EvaluationCache.make_key('abc', 'Rate this image', 'gpt-4o-mini', 1000),
+        EvaluationCache.make_key('abc', 'Rate this image', 'gpt-4o', 500),
+        EvaluationCache.make_key('abc', 'Rate this image', 'gpt-4o', 1000, variant='{"max_side": 512}'),
+    }) == 6
+
+
+def test_round_trip_and_stats(tmp_path):
+    evaluations = EvaluationCache(str(tmp_path / 'cache.sqlite'))
+    assert evaluations.get('key') is None
+    evaluations.put('key', 80, {'score': 80}, {'total_tokens': 900})
+    evaluations.close()
+
+    reopened = EvaluationCache(str(tmp_path / 'cache.sqlite'))
+    assert reopened.get('key') == (80, {'score': 80}, {'total_tokens': 900})
+    assert reopened.stats == {'hits': 1, 'misses': 0, 'tokens_saved': 900}
+
+
+def test_eviction_by_age_and_least_recent_use(tmp_path, monkeypatch):
+    clock = itertools.count(1_000_000)
+    monkeypatch.setattr(cache.time, 'time', lambda: next(clock))
+    evaluations = EvaluationCache(str(tmp_path / 'cache.sqlite'), max_entries=2)
+    for key in ('a', 'b', 'c'):
+        evaluations.put(key, 50, {}, None)
+    evaluations.get('a')
+
+    evaluations.evict()
+    assert evaluations.get('a') is not None
+    assert evaluations.get('b') is None
+    assert evaluations.get('c') is not None
+
+    evaluations.max_age_days = 1
+    monkeypatch.setattr(cache.time, 'time', lambda: 1_000_000 + 2 * 86400)
+    evaluations.evict()
+    assert evaluations.get('a') is None and evaluations.get('c') is None
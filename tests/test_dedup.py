@@ -0,0 +1,75 @@
+import numpy as np
+from PIL import Image
+
+from dedup import BKTree, DedupIndex
+
+
+def test_bk_tree_nearest_and_remove():
+    tree = BKTree()
+    tree.add(0b00000000, 'a')
+    tree.add(0b00001111, 'b')
+    tree.add(0b11111111, 'c')
+
+    assert tree.nearest(0b00000001, 1) == (1, 'a')
+    assert tree.nearest(0b00011111, 1) == (1, 'b')
+    assert tree.nearest(0b00110011, 1) is None
+    assert tree.remove(0b00000000, 'a')
+    assert not tree.remove(0b00000000, 'a')
+    assert tree.nearest(0b00000001, 3) == (3, 'b')
+    # Entries below the removed node are still found
+    assert tree.nearest(0b11111111, 0) == (0, 'c')
+
+
+def test_members_share_a_scored_representative(tmp_path):
+    index = DedupIndex(str(tmp_path / 'dedup.sqlite'), max_distance=4)
+    cluster, is_representative, value = index.claim('/in/a.jpg', 0b1010)
+    assert is_representative
+    member, is_representative, _ = index.claim('/in/b.jpg', 0b1011)
+    assert member is cluster and not is_representative
+
+    index.resolve(cluster, value, (80, {'score': 80}, None))
+    assert member.wait()[0] == 80
+
+    # Scored representatives are reloaded by later runs
+    index.close()
+    reopened = DedupIndex(str(tmp_path / 'dedup.sqlite'), max_distance=4)
+    known, is_representative, _ = reopened.claim('/in/c.jpg', 0b1000)
+    assert not is_representative and known.wait()[0] == 80
+    assert reopened.stats['known'] == 1
+
+
+def test_failed_representative_does_not_hold_its_cluster(tmp_path):
+    index = DedupIndex(str(tmp_path / 'dedup.sqlite'), max_distance=4)
+    cluster, _, value = index.claim('/in/a.jpg', 0b1010)
+    waiting, _, _ = index.claim('/in/b.jpg', 0b1011)
+
+    index.resolve(cluster, value, (None, "Request failed", None))
+    # Members already waiting fall back to their own evaluation
+    assert waiting.wait()[0] is None
+
+    retry, is_representative, value = index.claim('/in/c.jpg', 0b1010)
+    assert is_representative and retry is not cluster
+    index.resolve(retry, value, (75, {'score': 75}, None))
+    later, is_representative, _ = index.claim('/in/d.jpg', 0b1110)
+    assert later is retry and not is_representative
+    assert later.wait()[0] == 75
+
+
+def test_claim_hashes_images(tmp_path):
+    index = DedupIndex(str(tmp_path / 'dedup.sqlite'))
+    pixels = (np.random.default_rng(1).random((8, 8)) * 255).astype('uint8')
+    image = Image.fromarray(pixels).resize((128, 128), Image.BILINEAR).convert('RGB')
+    image.save(tmp_path / 'a.jpg', quality=95)
+    image.resize((100, 100)).save(tmp_path / 'b.jpg', quality=60)
+    Image.fromarray(255 - pixels).resize((128, 128), Image.BILINEAR).save(tmp_path / 'c.jpg')
+    (tmp_path / 'broken.jpg').write_bytes(b'not an image')
+
+    first, is_representative, _ = index.claim(str(tmp_path / 'a.jpg'))
+    assert is_representative
+    # Re-encoded and resized: the same cluster
+    second, is_representative, _ = index.claim(str(tmp_path / 'b.jpg'))
+    assert second is first and not is_representative
+    # Inverted: a different image
+    third, is_representative, _ = index.claim(str(tmp_path / 'c.jpg'))
+    assert third is not first and is_representative
+    assert index.claim(str(tmp_path / 'broken.jpg')) == (None, False, None)
@@ -0,0 +1,121 @@
+import logging
+import os
+import threading
+
+from distributed import DONE, FAILED, QueueWorker, WorkQueue
+
+
+class FakeBudget:
+    def __init__(self):
+        self.reserved = 0
+
+    def reserve(self, images=1):
+        self.reserved += images
+        return True
+
+    def release(self, images=1):
+        self.reserved -= images
+
+
+class FakeScheduler:
+    def resize(self, concurrency):
+        pass
+
+
+class FakeLog:
+    def write(self, record):
+        pass
+
+    def flush(self):
+        pass
+
+
+class FakeEvaluator:
+    """Scores every image 80 and moves it to `output`, failing the first `move_failures` moves per image."""
+
+    def __init__(self, output, move_failures=0):
+        self.config = {'processing': {'concurrency': 2, 'images_per_request': 1}}
+        self.output = output
+        self.move_failures = move_failures
+        self.moves = {}
+        self.budget = FakeBudget()
+        self.scheduler = FakeScheduler()
+        self.logger = logging.getLogger('test_distributed')
+        self.evaluation_log = FakeLog()
+
+    def evaluate_chunk(self, paths):
+        return [((80, {'score': 80}, None), {'latency': 0.0}) for _ in paths]
+
+    def _destination_path(self, source, score):
+        return os.path.join(self.output, os.path.basename(source))
+
+    def sort_image(self, source, result, details):
+        attempts = self.moves[source] = self.moves.get(source, 0) + 1
+        if attempts <= self.move_failures:
+            raise OSError("Share unavailable")
+        os.makedirs(self.output, exist_ok=True)
+        os.replace(source, self._destination_path(source, result[0]))
+
+
+def make_queue(tmp_path, count=3, max_attempts=3):
+    input_dir = tmp_path / 'input'
+    input_dir.mkdir()
+    sources = []
+    for i in range(count):
+        path = input_dir / f"image_{i}.jpg"
+        path.write_bytes(b'jpeg')
+        sources.append(str(path))
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'), lease_seconds=60, max_attempts=max_attempts)
+    queue.begin_scan()
+    queue.enqueue(str(input_dir), sources)
+    queue.finish_scan()
+    return queue, sources
+
+
+def run_worker(worker, timeout=20):
+    thread = threading.Thread(target=worker.run, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "worker did not drain the queue"
+
+
+def test_failed_move_is_retried_under_next_lease(tmp_path):
+    queue, sources = make_queue(tmp_path)
+    evaluator = FakeEvaluator(str(tmp_path / 'output'), move_failures=1)
+    worker = QueueWorker(evaluator, queue, heartbeat_interval=0.05, poll_interval=0.05)
+
+    run_worker(worker)
+
+    assert queue.drained()
+    assert queue.counts() == {DONE: len(sources)}
+    assert all(not os.path.exists(source) for source in sources)
+    assert all(evaluator.moves[source] == 2 for source in sources)
+    assert evaluator.budget.reserved == 0
+
+
+def test_move_that_keeps_failing_ends_failed(tmp_path):
+    queue, sources = make_queue(tmp_path, max_attempts=3)
+    evaluator = FakeEvaluator(str(tmp_path / 'output'), move_failures=100)
+    worker = QueueWorker(evaluator, queue, heartbeat_interval=0.05, poll_interval=0.05)
+
+    run_worker(worker)
+
+    assert queue.drained()
+    assert queue.counts() == {FAILED: len(sources)}
+    assert all(os.path.exists(source) for source in sources)
+    assert all(evaluator.moves[source] == 3 for source in sources)
+
+
+def test_release_unmoved_needs_the_lease(tmp_path):
+    queue, sources = make_queue(tmp_path, count=1)
+    queue.lease('a', 1)
+    assert queue.record_evaluated('a', sources[0], (80, {}, None), '/elsewhere')
+
+    assert queue.release_unmoved('b', sources[0], 'not mine') is False
+    assert queue.heartbeat('a') == 1
+    queue.release_unmoved('a', sources[0], 'disk full')
+    assert queue.heartbeat('a') == 0
+
+    item, = queue.lease('b', 1)
+    assert item['result'][0] == 80
+    assert item['destination'] == '/elsewhere'
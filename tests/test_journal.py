@@ -0,0 +1,43 @@
+from journal import DISCOVERED, EVALUATED, LOGGED, JobJournal
+
+
+def scored(journal, root, source):
+    journal.discover(root, source)
+    journal.record_evaluated(source, 80, {'score': 80}, None, '/output/79-81/a.jpg')
+
+
+def test_fresh_run_forgets_its_root(tmp_path):
+    journal = JobJournal(str(tmp_path / 'journal.sqlite'))
+    scored(journal, '/photos', '/photos/a.jpg')
+
+    journal.start('/photos')
+    assert journal.counts('/photos') == {}
+    assert journal.get('/photos/a.jpg') is None
+
+
+def test_resume_keeps_results(tmp_path):
+    journal = JobJournal(str(tmp_path / 'journal.sqlite'))
+    scored(journal, '/photos', '/photos/a.jpg')
+
+    journal.start('/photos', resume=True)
+    journal.discover('/photos', '/photos/a.jpg')
+    entry, = journal.unfinished('/photos')
+    assert entry['state'] == EVALUATED and entry['score'] == 80
+
+
+def test_run_over_another_root_takes_over_stale_entries(tmp_path):
+    journal = JobJournal(str(tmp_path / 'journal.sqlite'))
+    scored(journal, '/photos', '/photos/2026/a.jpg')
+    journal.record_logged_many(['/photos/2026/a.jpg'])
+
+    journal.start('/photos/2026')
+    journal.discover('/photos/2026', '/photos/2026/a.jpg')
+
+    assert journal.counts('/photos') == {}
+    assert journal.counts('/photos/2026') == {DISCOVERED: 1}
+    entry = journal.get('/photos/2026/a.jpg')
+    assert entry['score'] is None and entry['destination'] is None
+
+    journal.record_evaluated('/photos/2026/a.jpg', 70, {'score': 70}, None, '/output/70-72/a.jpg')
+    journal.record_logged_many(['/photos/2026/a.jpg'])
+    assert journal.counts('/photos/2026') == {LOGGED: 1}
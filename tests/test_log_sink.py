@@ -0,0 +1,42 @@
+import json
+import time
+
+from log_sink import EvaluationLog, make_record
+
+
+def read_records(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_partial_buffer_is_written_while_idle(tmp_path):
+    flushed = []
+    log = EvaluationLog(str(tmp_path), flush_every=100, flush_interval=0.1, on_flush=flushed.extend)
+    try:
+        log.write(make_record('a.jpg', 80, {'score': 80}, source='/in/a.jpg'))
+        path = tmp_path / 'evaluation_log.jsonl'
+
+        # No further writes: the timer alone has to flush the record
+        assert wait_for(lambda: flushed)
+        assert [record['image'] for record in read_records(path)] == ['a.jpg']
+    finally:
+        log.close()
+
+
+def test_full_buffer_and_close_flush(tmp_path):
+    flushed = []
+    log = EvaluationLog(str(tmp_path), flush_every=2, flush_interval=60, on_flush=flushed.append)
+    for name in ('a.jpg', 'b.jpg', 'c.jpg'):
+        log.write(make_record(name, 80, {'score': 80}))
+    assert [len(batch) for batch in flushed] == [2]
+
+    log.close()
+    assert [len(batch) for batch in flushed] == [2, 1]
+    assert len(read_records(tmp_path / 'evaluation_log.jsonl')) == 3
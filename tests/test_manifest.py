@@ -0,0 +1,96 @@
+import json
+import os
+
+import pytest
+
+import manifest
+from manifest import Manifest, applied_log_path, apply_manifest, rollback_manifest
+
+
+class Crash(BaseException):
+    """Stands in for the process dying mid-apply."""
+
+
+def make_manifest(tmp_path, count=3):
+    output = tmp_path / 'output'
+    entries = []
+    record = Manifest(str(tmp_path / 'manifest.jsonl'))
+    for i in range(count):
+        source = tmp_path / 'input' / f"image_{i}.jpg"
+        source.parent.mkdir(exist_ok=True)
+        source.write_bytes(b'jpeg %d' % i)
+        destination = output / '79-81' / source.name
+        record.add(str(source), str(destination), 80)
+        entries.append((str(source), str(destination)))
+    record.close()
+    return record.path, entries
+
+
+def test_apply_and_rollback(tmp_path):
+    path, entries = make_manifest(tmp_path)
+
+    stats = apply_manifest(path, workers=2)
+    assert stats['renamed'] == len(entries) and stats['failed'] == 0
+    assert all(os.path.exists(destination) and not os.path.exists(source) for source, destination in entries)
+
+    assert rollback_manifest(path, workers=2) == len(entries)
+    assert all(os.path.exists(source) and not os.path.exists(destination) for source, destination in entries)
+    assert not os.path.exists(applied_log_path(path))
+
+
+def test_rollback_after_crash_mid_apply(tmp_path, monkeypatch):
+    path, entries = make_manifest(tmp_path)
+    real_move = manifest.move_file
+    moves = []
+
+    def crash_after_second_move(source, destination):
+        # Nothing moves once the process has died
+        if len(moves) == 2:
+            raise Crash()
+        method = real_move(source, destination)
+        moves.append(source)
+        if len(moves) == 2:
+            raise Crash()
+        return method
+
+    monkeypatch.setattr(manifest, 'move_file', crash_after_second_move)
+    with pytest.raises(Crash):
+        apply_manifest(path, workers=1)
+    monkeypatch.setattr(manifest, 'move_file', real_move)
+
+    # The second file moved but its apply never finished; rollback still knows about it
+    assert rollback_manifest(path, workers=1) == 2
+    assert all(os.path.exists(source) and not os.path.exists(destination) for source, destination in entries)
+    assert not os.path.exists(applied_log_path(path))
+
+
+def test_rollback_skips_moves_that_never_happened(tmp_path):
+    path, entries = make_manifest(tmp_path)
+    # A crash right after recording the intent leaves an entry with nothing moved
+    with open(applied_log_path(path), 'w', encoding='utf-8') as f:
+        for source, destination in entries:
+            f.write(json.dumps({'source': source, 'destination': destination}) + '\n')
+    source, destination = entries[0]
+    os.makedirs(os.path.dirname(destination))
+    os.rename(source, destination)
+
+    assert rollback_manifest(path) == 1
+    assert all(os.path.exists(source) for source, _ in entries)
+    assert not os.path.exists(applied_log_path(path))
+
+
+def test_failed_move_with_stop_on_error_rolls_back(tmp_path):
+    path, entries = make_manifest(tmp_path)
+    # Taken destination: the move fails without touching either file
+    taken_source, taken_destination = entries[1]
+    os.makedirs(os.path.dirname(taken_destination))
+    with open(taken_destination, 'wb') as f:
+        f.write(b'other')
+
+    stats = apply_manifest(path, workers=1, stop_on_error=True)
+
+    assert stats['failed'] == 1
+    assert stats['rolled_back'] == 1
+    assert all(os.path.exists(source) for source, _ in entries)
+    with open(taken_destination, 'rb') as f:
+        assert f.read() == b'other'
@@ -0,0 +1,53 @@
+import cProfile
+import pstats
+import threading
+
+import metrics
+from metrics import profile_call
+
+
+def busy_work():
+    return sum(i * i for i in range(1000))
+
+
+def run_in_thread():
+    results = []
+    thread = threading.Thread(target=lambda: results.append(busy_work()))
+    thread.start()
+    thread.join()
+    return results
+
+
+def profiled_functions(path):
+    return {name for _, _, name in pstats.Stats(str(path)).stats}
+
+
+def test_profile_call_covers_threads(tmp_path, capsys):
+    path = tmp_path / 'run.prof'
+
+    assert profile_call(run_in_thread, str(path)) == [busy_work()]
+    assert 'busy_work' in profiled_functions(path)
+
+
+class SingleProfiler(cProfile.Profile):
+    """Allows one enabled profiler at a time, as cProfile does from Python 3.12."""
+    active = None
+
+    def enable(self, *args, **kwargs):
+        if SingleProfiler.active not in (None, self):
+            raise ValueError("Another profiling tool is already active")
+        SingleProfiler.active = self
+        super().enable(*args, **kwargs)
+
+    def disable(self):
+        if SingleProfiler.active is self:
+            SingleProfiler.active = None
+        super().disable()
+
+
+def test_profile_call_survives_a_single_profiler(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(metrics.cProfile, 'Profile', SingleProfiler)
+
+    # Threads still run when their own profiler cannot be enabled
+    assert profile_call(run_in_thread, str(tmp_path / 'run.prof')) == [busy_work()]
+    assert SingleProfiler.active is None
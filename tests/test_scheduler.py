@@ -0,0 +1,99 @@
+from types import SimpleNamespace
+
+import openai
+import pytest
+
+from scheduler import RequestScheduler, parse_retry_after
+
+
+def status_error(status, headers=None):
+    response = SimpleNamespace(request=None, status_code=status, headers=headers or {})
+    return openai.APIStatusError(f"HTTP {status}", response=response, body=None)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_scheduler(**kwargs):
+    delays = []
+    clock = FakeClock()
+    scheduler = RequestScheduler(clock=clock, sleep=delays.append, **kwargs)
+    return scheduler, delays, clock
+
+
+def failing(*errors, result='ok'):
+    errors = list(errors)
+
+    def request():
+        if errors:
+            raise errors.pop(0)
+        return result
+    return request
+
+
+def test_retries_transient_errors_honouring_retry_after():
+    scheduler, delays, _ = make_scheduler(max_retries=3)
+
+    result = scheduler.call(failing(status_error(429, {'retry-after': '2'}),
+                                    openai.APIConnectionError(request=None)))
+
+    assert result == 'ok'
+    assert delays[0] == 2.0 and 0 <= delays[1] <= 2.0
+    assert scheduler.stats['retries'] == 2
+    assert scheduler.stats['rate_limited'] == 1
+    assert scheduler.stats['requests'] == 3
+
+
+def test_client_errors_are_not_retried():
+    scheduler, delays, _ = make_scheduler()
+
+    with pytest.raises(openai.APIStatusError):
+        scheduler.call(failing(status_error(400)))
+    assert delays == []
+    assert scheduler.stats['failed'] == 1
+
+
+def test_gives_up_after_max_retries():
+    scheduler, delays, _ = make_scheduler(max_retries=2, backoff_max=0.0)
+
+    with pytest.raises(openai.APIStatusError):
+        scheduler.call(failing(*[status_error(503)] * 5))
+    assert len(delays) == 2
+    assert scheduler.stats['server_errors'] == 3
+    assert scheduler.stats['failed'] == 1
+
+
+def test_rate_limits_halve_concurrency_and_successes_restore_it():
+    scheduler = make_scheduler(max_concurrency=4)[0]
+
+    scheduler.call(failing(status_error(429, {'retry-after': '0'})))
+    assert scheduler.concurrency_limit == 2
+    for _ in range(2 + 3):
+        scheduler.call(failing())
+    assert scheduler.concurrency_limit == 4
+
+
+def test_request_and_token_budgets_delay_the_next_request():
+    scheduler, _, clock = make_scheduler(requests_per_minute=2)
+    scheduler.call(failing())
+    clock.now = 10.0
+    scheduler.call(failing())
+    # The third request fits once the first leaves the one-minute window
+    assert scheduler._budget_wait(20.0) == 40.0
+
+    scheduler, _, clock = make_scheduler(tokens_per_minute=1500, estimated_tokens=1000)
+    scheduler.call(failing(result=SimpleNamespace(usage=SimpleNamespace(total_tokens=800))))
+    assert scheduler._budget_wait(30.0) == 30.0
+    assert scheduler._budget_wait(60.0) == 0.0
+
+
+def test_parse_retry_after():
+    assert parse_retry_after({'retry-after-ms': '1500'}) == 1.5
+    assert parse_retry_after({'retry-after': '3'}) == 3.0
+    assert parse_retry_after({'retry-after': 'soon'}) is None
+    assert parse_retry_after({}) is None
@@ -0,0 +1,96 @@
+import json
+import os
+
+import pytest
+
+from file_handler import determine_folder
+from log_sink import make_record
+from score_index import ScoreIndex, index_log, parse_condition
+
+
+def record(tmp_path, name, score, moved=True, lighting=5):
+    source = tmp_path / 'input' / name
+    destination = tmp_path / 'output' / determine_folder(score) / name
+    path = destination if moved else source
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b'jpeg')
+    return make_record(name, score, {'score': score, 'lighting': lighting},
+                       source=str(source), destination=str(destination))
+
+
+def paths(rows):
+    return [os.path.basename(os.path.dirname(row['path'])) + '/' + os.path.basename(row['path']) for row in rows]
+
+
+def test_parse_condition():
+    assert parse_condition('score>=85') == ('score', '>=', 85)
+    assert parse_condition(' lighting < 7.5 ') == ('lighting', '<', 7.5)
+    assert parse_condition('path=/photos/*') == ('path', '=', '/photos/*')
+    for text in ('score>>1', 'bogus=1', 'score>=high'):
+        with pytest.raises(ValueError):
+            parse_condition(text)
+
+
+def test_query_count_and_histogram(tmp_path):
+    index = ScoreIndex(str(tmp_path / 'index.sqlite'))
+    index.add_records([record(tmp_path, 'a.jpg', 91, lighting=9), record(tmp_path, 'b.jpg', 62),
+                       record(tmp_path, 'c.jpg', 85, lighting=8),
+                       make_record('d.jpg', None, "Request failed", source='/in/d.jpg')])
+
+    assert index.size == 3
+    assert [row['score'] for row in index.query('score>=80')] == [91, 85]
+    assert index.count('score>=80', 'lighting>=9') == 1
+    assert index.count(f"path={tmp_path / 'output' / '85-87'}/*") == 1
+    assert [row['score'] for row in index.query(order_by='score', descending=False, limit=2)] == [62, 85]
+    assert index.histogram(interval=10) == {'91-100': 1, '61-70': 1, '81-90': 1}
+
+
+def test_score_only_records_are_indexed_at_their_source(tmp_path):
+    index = ScoreIndex(str(tmp_path / 'index.sqlite'))
+    planned = record(tmp_path, 'a.jpg', 80, moved=False)
+    index.add_records([planned], moved=False)
+    assert paths(index.query()) == ['input/a.jpg']
+
+    index.record_moves([(planned['source'], planned['destination'])])
+    assert paths(index.query()) == ['79-81/a.jpg']
+    index.record_moves([(planned['destination'], planned['source'])])
+    assert paths(index.query()) == ['input/a.jpg']
+
+
+def test_image_evaluated_again_replaces_its_row(tmp_path):
+    index = ScoreIndex(str(tmp_path / 'index.sqlite'))
+    first = record(tmp_path, 'a.jpg', 80)
+    index.add_records([first])
+    # Evaluated again from where it was sorted
+    again = make_record('a.jpg', 70, {'score': 70}, source=first['destination'],
+                        destination=str(tmp_path / 'output' / '70-72' / 'a.jpg'))
+    index.add_records([again])
+
+    assert [row['score'] for row in index.query()] == [70]
+
+
+def test_rebucket_moves_files_and_paths(tmp_path):
+    index = ScoreIndex(str(tmp_path / 'index.sqlite'))
+    index.add_records([record(tmp_path, 'a.jpg', 91), record(tmp_path, 'b.jpg', 62)])
+    output = tmp_path / 'output'
+
+    assert index.rebucket(str(output), 10, dry_run=True)['moved'] == 2
+    assert sorted(os.listdir(output)) == ['61-63', '91-93']
+
+    stats = index.rebucket(str(output), 10)
+    assert stats == {'moved': 2, 'unchanged': 0, 'missing': 0, 'conflicts': 0}
+    assert sorted(os.listdir(output)) == ['61-70', '91-100']
+    assert sorted(paths(index.query())) == ['61-70/b.jpg', '91-100/a.jpg']
+    assert all(os.path.exists(row['path']) for row in index.query())
+
+
+def test_index_log_uses_where_the_image_is(tmp_path):
+    log_path = tmp_path / 'evaluation_log.jsonl'
+    with open(log_path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(record(tmp_path, 'a.jpg', 80)) + '\n')
+        f.write(json.dumps(record(tmp_path, 'b.jpg', 50, moved=False)) + '\n')
+        f.write('not json\n')
+    index = ScoreIndex(str(tmp_path / 'index.sqlite'))
+
+    assert index_log(index, str(log_path)) == (2, 1)
+    assert sorted(paths(index.query())) == ['79-81/a.jpg', 'input/b.jpg']
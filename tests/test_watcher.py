@@ -0,0 +1,133 @@
+import logging
+from concurrent.futures import Future
+from pathlib import Path
+
+from budget import Budget
+from scanner import ImageScanner
+from watcher import FolderWatcher, WatchDaemon
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeExecutor:
+    """Holds submitted chunks until the test completes their futures."""
+
+    def __init__(self):
+        self.futures = []
+
+    def submit(self, function, paths, *args):
+        future = Future()
+        self.futures.append((future, paths))
+        return future
+
+
+class FakeEvaluator:
+    def __init__(self, budget, concurrency):
+        self.config = {'processing': {'concurrency': concurrency, 'images_per_request': 1}}
+        self.budget = budget
+        self.logger = logging.getLogger('test_watcher')
+        self.sorted = []
+
+    def evaluate_chunk(self, paths, *args):
+        raise AssertionError("the test executor never runs chunks")
+
+    def sort_image(self, path, result, details):
+        self.sorted.append(path)
+        return '79-81'
+
+
+def make_daemon(tmp_path, hard_limit_tokens=None, concurrency=5):
+    budget = Budget(None, 'gpt-4o', period='run', hard_limit_tokens=hard_limit_tokens)
+    # One image charged at 100 tokens sets the estimate for the rest
+    budget.charge(100, 0)
+    daemon = WatchDaemon(FakeEvaluator(budget, concurrency), [str(tmp_path)])
+    return daemon, budget
+
+
+def queue_images(daemon, count, start=0):
+    for i in range(start, start + count):
+        daemon._queue.put((Path(f"image_{i}.jpg"), 0.0))
+
+
+def complete(daemon, executor):
+    for future, paths in executor.futures:
+        if not future.done():
+            future.set_result([((80, {'score': 80}, None), {'latency': 0.0}) for _ in paths])
+    daemon._collect(timeout=1)
+
+
+def test_idle_polls_keep_reservations_of_work_in_flight(tmp_path):
+    daemon, budget = make_daemon(tmp_path)
+    executor = FakeExecutor()
+    queue_images(daemon, 2)
+
+    daemon._submit(executor)
+    assert budget._reserved == 2
+    for _ in range(5):
+        daemon._submit(executor)
+    assert budget._reserved == 2
+
+    complete(daemon, executor)
+    assert budget._reserved == 0
+    assert daemon.stats['sorted'] == 2
+
+
+def test_hard_limit_holds_across_idle_polls(tmp_path):
+    # 100 tokens spent and 100 per image: two more images fit under 350
+    daemon, budget = make_daemon(tmp_path, hard_limit_tokens=350)
+    executor = FakeExecutor()
+    queue_images(daemon, 2)
+    daemon._submit(executor)
+    for _ in range(5):
+        daemon._submit(executor)
+
+    queue_images(daemon, 3, start=2)
+    daemon._submit(executor)
+
+    assert len(executor.futures) == 2
+    assert daemon._queue.qsize() == 3
+    assert budget.blocked
+
+
+def test_images_are_reported_once_they_settle(tmp_path):
+    clock = FakeClock()
+    watcher = FolderWatcher([ImageScanner(str(tmp_path))], settle_time=2.0, clock=clock)
+    image = tmp_path / 'a.jpg'
+    image.write_bytes(b'half')
+    (tmp_path / 'notes.txt').write_bytes(b'not an image')
+
+    assert watcher.poll() == [] and watcher.settling == 1
+    clock.now = 1.0
+    image.write_bytes(b'half a copy more')
+    assert watcher.poll() == []
+    clock.now = 2.5
+    # Unchanged for only 1.5s since the last write
+    assert watcher.poll() == []
+    clock.now = 3.0
+    assert watcher.poll() == [(image, str(tmp_path), 0.0)]
+    clock.now = 10.0
+    assert watcher.poll() == []
+
+    # A new file under the same name is picked up again
+    image.unlink()
+    assert watcher.poll() == []
+    image.write_bytes(b'again')
+    watcher.poll()
+    clock.now = 12.0
+    assert watcher.poll() == [(image, str(tmp_path), 10.0)]
+
+
+def test_empty_files_never_settle(tmp_path):
+    clock = FakeClock()
+    watcher = FolderWatcher([ImageScanner(str(tmp_path))], settle_time=1.0, clock=clock)
+    (tmp_path / 'a.jpg').write_bytes(b'')
+
+    watcher.poll()
+    clock.now = 5.0
+    assert watcher.poll() == []